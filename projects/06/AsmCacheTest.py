@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+from asmcache import *
+import assembler
+import hackfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class AssemblyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = AssemblyCache(os.path.join(self.tmpdir, 'cache'), '1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_miss_then_hit(self):
+        key = self.cache.key(b'@0\nD=A\n')
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, [0, 0b1110110000010000], hackfile.source_hash(b'@0\nD=A\n'))
+        self.assertEqual(list(self.cache.get(key)), [0, 0b1110110000010000])
+
+    def test_key_depends_on_source_and_version(self):
+        other_version = AssemblyCache(self.cache.directory, '2')
+        self.assertNotEqual(self.cache.key(b'@0'), self.cache.key(b'@1'))
+        self.assertNotEqual(self.cache.key(b'@0'), other_version.key(b'@0'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        entry_size = hackfile.HEADER.size + 2 * 100
+        self.cache.max_size = entry_size * 2
+
+        keys = [self.cache.key(str(i).encode()) for i in range(3)]
+        self.cache.put(keys[0], [0] * 100, b'\0' * 8)
+        self.cache.put(keys[1], [1] * 100, b'\0' * 8)
+        # Make sure entry 0 is more recently used than entry 1
+        os.utime(self.cache.entry_path(keys[1]), ns=(0, 0))
+        self.cache.get(keys[0])
+
+        self.cache.put(keys[2], [2] * 100, b'\0' * 8)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_unreadable_entries_are_misses(self):
+        key = self.cache.key(b'@0\n')
+        self.cache.put(key, [0] * 10, b'\0' * 8)
+        with open(self.cache.entry_path(key), 'rb') as fp:
+            entry = fp.read()
+        for contents in [b'', entry[:hackfile.HEADER.size - 1], entry[:-1]]:
+            with open(self.cache.entry_path(key), 'wb') as fp:
+                fp.write(contents)
+            self.assertIsNone(self.cache.get(key))
+            self.assertFalse(os.path.exists(self.cache.entry_path(key)))
+
+    def test_failed_put_leaves_nothing_behind(self):
+        def words():
+            yield 0
+            raise OSError('No space left on device')
+        with self.assertRaises(OSError):
+            self.cache.put(self.cache.key(b'@0\n'), words(), b'\0' * 8)
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_assemble_path_through_cache(self):
+        asm_filepath = os.path.join(self.tmpdir, 'Max.asm')
+        shutil.copy(os.path.join(HERE, 'max/Max.asm'), asm_filepath)
+        expected = list(hackfile.read_text(os.path.join(HERE, 'max/Max.hack')))
+
+        for _ in range(2): # Miss, then hit
+            assembler.assemble_path(asm_filepath, cache=self.cache)
+            self.assertEqual(list(hackfile.read_text(os.path.join(self.tmpdir, 'Max.hack'))), expected)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 1)
+
+    def test_truncated_entry_is_assembled_again(self):
+        asm_filepath = os.path.join(self.tmpdir, 'Max.asm')
+        shutil.copy(os.path.join(HERE, 'max/Max.asm'), asm_filepath)
+        expected = list(hackfile.read_text(os.path.join(HERE, 'max/Max.hack')))
+        assembler.assemble_path(asm_filepath, cache=self.cache)
+
+        (entry,) = os.listdir(self.cache.directory)
+        entry_path = os.path.join(self.cache.directory, entry)
+        with open(entry_path, 'r+b') as fp:
+            fp.truncate(hackfile.HEADER.size + 2)
+        assembler.assemble_path(asm_filepath, cache=self.cache)
+        self.assertEqual(list(hackfile.read_text(os.path.join(self.tmpdir, 'Max.hack'))), expected)
+        self.assertEqual(list(self.cache.get(entry[:-len(hackfile.PACKED_EXTENSION)])), expected)
@@ -0,0 +1,159 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from assembler import *
+import assembler
+import hackfile
+
+PROGRAMS = ['add/Add', 'max/Max', 'rect/Rect', 'pong/Pong']
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FORWARD_REFERENCES = '@i\nM=1\n@END\n0;JMP\n@j\nM=0\n(END)\n@END\n0;JMP\n'
+
+class AssemblerTest(unittest.TestCase):
+    def expected_words(self, program):
+        with open(os.path.join(HERE, program + '.hack')) as fp:
+            return [int(line, 2) for line in fp]
+
+    def test_two_pass_matches_reference_output(self):
+        assembler = Assembler()
+        for program in PROGRAMS:
+            result = assembler.assemble_file(os.path.join(HERE, program + '.asm'))
+            self.assertEqual(result, self.expected_words(program))
+
+    def test_single_pass_matches_two_pass(self):
+        assembler = Assembler()
+        for program in PROGRAMS:
+            result = assembler.assemble_file(os.path.join(HERE, program + '.asm'), single_pass=True)
+            self.assertEqual(result, self.expected_words(program))
+
+    def test_single_pass_forward_references_and_variables(self):
+        result = Assembler().assemble(FORWARD_REFERENCES, single_pass=True)
+        self.assertEqual(result, [
+            0b0000000000010000, # @i -> 16
+            0b1110111111001000,
+            0b0000000000000110, # @END, patched once the label is seen
+            0b1110101010000111,
+            0b0000000000010001, # @j -> 17
+            0b1110101010001000,
+            0b0000000000000110, # @END, already known
+            0b1110101010000111,
+        ])
+
+    def test_assemble_from_str_bytes_and_file(self):
+        assembler = Assembler()
+        expected = assembler.assemble(FORWARD_REFERENCES)
+        self.assertEqual(assembler.assemble(FORWARD_REFERENCES.encode()), expected)
+        with open(os.path.join(HERE, 'max/Max.asm'), 'rb') as fp:
+            self.assertEqual(assembler.assemble(fp), self.expected_words('max/Max'))
+
+    def test_symbol_tables_do_not_leak_between_programs(self):
+        assembler = Assembler()
+        # END is a label here...
+        assembler.assemble('@END\n0;JMP\n(END)\n@END\n0;JMP\n')
+        self.assertEqual(assembler.symbols['END'], 2)
+
+        # ...and a variable here, so it has to start again from 16
+        result = assembler.assemble('@x\nM=0\n@END\nM=1\n')
+        self.assertEqual(result[0], 16)
+        self.assertEqual(result[2], 17)
+        self.assertNotIn('END', predefined_symbols)
+
+    def test_separate_instances_are_independent(self):
+        first = Assembler()
+        second = Assembler()
+        first.assemble('@a\n@b\n')
+        second.assemble('@b\n')
+        self.assertEqual(first.symbols['b'], 17)
+        self.assertEqual(second.symbols['b'], 16)
+
+    def test_c_instruction_encoding(self):
+        words = Assembler().assemble('D=M\nAM=M-1\nMA=M-1\nD;JGT\n0;JMP\n')
+        self.assertEqual(list(words), [0b1111110000010000, 0b1111110010101000, 0b1111110010101000,
+            0b1110001100000001, 0b1110101010000111])
+        self.assertEqual(encode_c_instruction(1, b'AM', b'M-1', b''), 0b1111110010101000)
+
+    def test_a_instruction_encoding(self):
+        self.assertEqual(list(Assembler().assemble('@2\n@KBD\n@R13\n')), [2, 24576, 13])
+        self.assertEqual(format_word(2), '0000000000000010')
+
+    def test_batch_assembly_in_process_pool(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for program in PROGRAMS:
+                os.makedirs(os.path.join(tmpdir, os.path.dirname(program)))
+                shutil.copy(os.path.join(HERE, program + '.asm'), os.path.join(tmpdir, program + '.asm'))
+
+            filepaths = find_asm_files(tmpdir)
+            with redirect_stdout(io.StringIO()) as report:
+                timings = assemble_batch(filepaths, jobs=2)
+
+            # Reported in the same (sorted) order the files went in
+            reported = [line.split(':')[0] for line in report.getvalue().splitlines()[:-1]]
+            self.assertEqual(reported, filepaths)
+            self.assertEqual([word_count for word_count, _ in timings], [6, 16, 27483, 25])
+            for program in PROGRAMS:
+                with open(os.path.join(tmpdir, program + '.hack')) as fp:
+                    self.assertEqual([int(line, 2) for line in fp], self.expected_words(program))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_scanner_fields_and_line_numbers(self):
+        source = b'// comment\n(LOOP)\n  @i // inline\r\nAM=M-1;JNE\n\n0;JMP'
+        self.assertEqual(list(scan(source)), [
+            (b'', b'', b'', b'', b'', b''),
+            (b'LOOP', b'', b'', b'', b'', b''),
+            (b'', b'i', b'', b'', b'', b''),
+            (b'', b'', b'AM', b'M-1', b'JNE', b''),
+            (b'', b'', b'', b'', b'', b''),
+            (b'', b'', b'', b'0', b'JMP', b''),
+        ])
+
+    def test_scanner_chunks_split_on_line_breaks(self):
+        with open(os.path.join(HERE, 'pong/Pong.asm'), 'rb') as fp:
+            source = fp.read()
+        expected = list(scan(source))
+
+        chunk_size = assembler.SCAN_CHUNK_SIZE
+        assembler.SCAN_CHUNK_SIZE = 1000
+        try:
+            self.assertEqual(list(scan(source)), expected)
+        finally:
+            assembler.SCAN_CHUNK_SIZE = chunk_size
+
+    def test_invalid_lines_report_line_number(self):
+        with self.assertRaisesRegex(Exception, 'Line 2'):
+            Assembler().assemble('@0\nfoo bar\n')
+        with self.assertRaisesRegex(Exception, 'Line 3'):
+            Assembler().assemble('@0\nD=A\nD=Q\n', single_pass=True)
+
+    def test_source_map_line_numbers(self):
+        source = '// Loop forever\n(LOOP)\n  @LOOP\n\n  0;JMP // back\n'
+        for single_pass in (False, True):
+            assembler = Assembler(source_map=True)
+            assembler.assemble(source, single_pass)
+            self.assertEqual(list(assembler.line_numbers), [3, 5])
+
+        self.assertEqual(list(instruction_line_numbers(source.encode())), [3, 5])
+        self.assertIsNone(Assembler().line_numbers)
+
+    def test_assemble_path_writes_source_map(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            asm_filepath = os.path.join(tmpdir, 'Max.asm')
+            shutil.copy(os.path.join(HERE, 'max/Max.asm'), asm_filepath)
+            assemble_path(asm_filepath, source_map=True)
+
+            source_map = hackfile.SourceMap(os.path.join(tmpdir, 'Max' + hackfile.SOURCE_MAP_EXTENSION))
+            self.assertEqual(len(source_map), 16)
+            with open(asm_filepath) as fp:
+                lines = fp.read().splitlines()
+            for address in range(len(source_map)):
+                filename, line_number = source_map.location(address)
+                self.assertEqual(filename, 'Max.asm')
+                self.assertTrue(lines[line_number - 1].strip()[0] not in '(/')
+        finally:
+            shutil.rmtree(tmpdir)
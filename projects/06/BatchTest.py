@@ -0,0 +1,68 @@
+import os
+import random
+import unittest
+from batch import *
+from assembler import Assembler
+from testprograms import random_program
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class BatchTest(unittest.TestCase):
+    def assertMatchesHackCPU(self, batch_cpu, words, initial_ram, max_cycles):
+        # Runs each instance's initial RAM through HackCPU on its own
+        for i, values in enumerate(initial_ram):
+            cpu = HackCPU(words)
+            cpu.ram[:len(values)] = values
+            cpu.run(max_cycles)
+            self.assertEqual(
+                (int(batch_cpu.a[i]), int(batch_cpu.d[i]), int(batch_cpu.pc[i]),
+                    int(batch_cpu.cycles[i]), bool(batch_cpu.halted[i])),
+                (cpu.a, cpu.d, cpu.pc, cpu.cycles, cpu.halted), i)
+            self.assertTrue((batch_cpu.ram[i] == cpu.ram).all(), i)
+
+    def test_max(self):
+        rng = random.Random(0)
+        cpu = BatchHackCPU.load(os.path.join(HERE, 'max/Max.hack'), 200)
+        # Max compares with a subtraction, so keep the difference in range
+        pairs = [(rng.randrange(-0x4000, 0x4000), rng.randrange(-0x4000, 0x4000)) for _ in range(200)]
+        cpu.ram[:, 0] = [first & 0xFFFF for first, _ in pairs]
+        cpu.ram[:, 1] = [second & 0xFFFF for _, second in pairs]
+        cpu.run(1000)
+        self.assertTrue(cpu.halted.all())
+        self.assertEqual(cpu.signed(2).tolist(), [max(pair) for pair in pairs])
+
+    def test_rect(self):
+        words = hackfile.read_hack(os.path.join(HERE, 'rect/Rect.hack'))
+        cpu = BatchHackCPU(words, 6)
+        heights = [0, 1, 2, 5, 17, 256]
+        cpu.ram[:, 0] = heights
+        cpu.run(100000)
+        self.assertMatchesHackCPU(cpu, words, [[height] for height in heights], 100000)
+
+    def test_run_returns_total_instructions(self):
+        cpu = BatchHackCPU.load(os.path.join(HERE, 'pong/Pong.hack'), 3)
+        self.assertEqual(cpu.run(1000), 3000)
+        self.assertEqual(cpu.cycles.tolist(), [1000] * 3)
+
+    def test_halt_depends_on_jump_target(self):
+        # Jumps to itself, onto the halt pair, into its middle, or back to
+        # the start which isn't a halt
+        words = Assembler().assemble('@R0\nA=M\n0;JMP\n@3\n0;JMP\n')
+        initial_ram = [[2], [3], [4], [0]]
+        cpu = BatchHackCPU(words, len(initial_ram))
+        cpu.ram[:, :1] = initial_ram
+        cpu.run(100)
+        self.assertEqual(cpu.halted.tolist(), [True, True, True, False])
+        self.assertMatchesHackCPU(cpu, words, initial_ram, 100)
+
+    def test_random_programs_match_hack_cpu(self):
+        # Random programs diverge all over the place, and some instances
+        # stop on max_cycles partway through
+        rng = random.Random(1)
+        for _ in range(30):
+            words = random_program(rng, rng.randrange(1, 40))
+            initial_ram = [[rng.randrange(0x10000) for _ in range(16)] for _ in range(8)]
+            cpu = BatchHackCPU(words, len(initial_ram))
+            cpu.ram[:, :16] = initial_ram
+            cpu.run(300)
+            self.assertMatchesHackCPU(cpu, words, initial_ram, 300)
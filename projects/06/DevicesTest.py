@@ -0,0 +1,93 @@
+import io
+import os
+import struct
+import unittest
+import zlib
+from devices import *
+from assembler import Assembler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Copies the keyboard to R0 forever
+ECHO_KEYBOARD = '(LOOP)\n@KBD\nD=M\n@R0\nM=D\n@LOOP\n0;JMP\n'
+
+def run_rect(height):
+    machine = HeadlessMachine(HackCPU.load(os.path.join(HERE, 'rect/Rect.hack')))
+    machine.cpu.ram[0] = height
+    machine.run(10000)
+    return machine
+
+def read_png_chunks(data):
+    chunks = []
+    position = len(PNG_SIGNATURE)
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', data[position + 8 + length:position + 12 + length])
+        chunks.append((chunk_type, chunk, crc == zlib.crc32(chunk_type + chunk)))
+        position += 12 + length
+    return chunks
+
+class DevicesTest(unittest.TestCase):
+    def test_screen_is_a_view_of_ram(self):
+        cpu = HackCPU([])
+        screen = Screen(cpu.ram)
+        self.assertTrue(np.shares_memory(screen.words, cpu.ram))
+        cpu.ram[SCREEN + 33] = 0b101
+        self.assertEqual(screen.words[1, 1], 0b101)
+        # Leftmost pixel in the least significant bit
+        self.assertEqual(screen.pixels()[1, 16:19].tolist(), [1, 0, 1])
+        self.assertEqual(screen.pixels().sum(), 2)
+
+    def test_rect_pixels(self):
+        pixels = run_rect(4).screen.pixels()
+        self.assertTrue(pixels[:4, :16].all())
+        self.assertEqual(pixels.sum(), 4 * 16)
+
+    def test_pbm_snapshot(self):
+        fp = io.BytesIO()
+        write_pbm(fp, run_rect(4).screen.pixels())
+        data = fp.getvalue()
+        header = b'P4\n512 256\n'
+        self.assertTrue(data.startswith(header))
+        rows = data[len(header):]
+        self.assertEqual(len(rows), 64 * 256)
+        self.assertEqual(rows[:3], b'\xff\xff\x00')
+        self.assertEqual(rows[64 * 4:], bytes(64 * 252))
+
+    def test_png_snapshot(self):
+        fp = io.BytesIO()
+        write_png(fp, run_rect(4).screen.pixels())
+        data = fp.getvalue()
+        self.assertTrue(data.startswith(PNG_SIGNATURE))
+        chunks = read_png_chunks(data)
+        self.assertEqual([chunk_type for chunk_type, _, _ in chunks], [b'IHDR', b'IDAT', b'IEND'])
+        self.assertTrue(all(crc_ok for _, _, crc_ok in chunks))
+        self.assertEqual(struct.unpack('>II', chunks[0][1][:8]), (512, 256))
+        rows = zlib.decompress(chunks[1][1])
+        self.assertEqual(len(rows), 65 * 256)
+        # Filter byte, then black (0) for the rectangle and white after it
+        self.assertEqual(rows[:4], b'\x00\x00\x00\xff')
+        self.assertEqual(rows[65 * 4:65 * 5], b'\x00' + b'\xff' * 64)
+
+    def test_snapshot_needs_known_extension(self):
+        with self.assertRaises(ValueError):
+            run_rect(1).screen.snapshot(os.path.join(HERE, 'snapshot.gif'))
+
+    def test_key_script(self):
+        words = Assembler().assemble(ECHO_KEYBOARD)
+        for cpu_class in [HackCPU, BlockJITCPU]:
+            machine = HeadlessMachine(cpu_class(words), [(60, key_code('left')), (120, key_code(''))])
+            self.assertEqual(machine.run(90), 90)
+            self.assertEqual(machine.cpu.ram[0], 130)
+            self.assertEqual(machine.run(90), 90)
+            self.assertEqual(machine.cpu.ram[0], 0)
+
+    def test_key_codes(self):
+        self.assertEqual(key_code('a'), 97)
+        self.assertEqual(key_code('space'), 32)
+        self.assertEqual(key_code('Newline'), 128)
+        self.assertEqual(key_code('f12'), 152)
+        self.assertEqual(key_code('140'), 140)
+        with self.assertRaises(ValueError):
+            key_code('hyper')
@@ -0,0 +1,91 @@
+import os
+import random
+import unittest
+from emulator import *
+from assembler import Assembler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def assemble(source):
+    return Assembler().assemble(source)
+
+class EmulatorTest(unittest.TestCase):
+    def test_max(self):
+        cpu = HackCPU.load(os.path.join(HERE, 'max/Max.hack'))
+        for first, second in [(3, 5), (23456, 12345), (-7, -9), (0, 0)]:
+            cpu.reset()
+            cpu.ram[0] = first & 0xFFFF
+            cpu.ram[1] = second & 0xFFFF
+            cpu.run(1000)
+            self.assertTrue(cpu.halted)
+            self.assertEqual(cpu.signed(2), max(first, second))
+
+    def test_add(self):
+        cpu = HackCPU.load(os.path.join(HERE, 'add/Add.hack'))
+        cpu.run(1000)
+        self.assertEqual(cpu.signed(0), 5)
+
+    def test_rect(self):
+        cpu = HackCPU.load(os.path.join(HERE, 'rect/Rect.hack'))
+        cpu.ram[0] = 4
+        cpu.run(10000)
+        self.assertTrue(cpu.halted)
+        # 16 pixels wide, 4 rows down the left edge of the screen
+        self.assertEqual([cpu.signed(SCREEN + 32 * row) for row in range(5)], [-1, -1, -1, -1, 0])
+
+    def test_halt_depends_on_jump_target(self):
+        # (program, cycles run, pc it halts on)
+        programs = [
+            ('@3\nD=A\nA=D\n0;JMP\n', 4, 3), # A computed, jumps to itself
+            ('@3\n0;JMP\n@2\n0;JMP\n', 3, 3), # Into the middle of a halt pair
+            ('@2\n0;JMP\n@2\n0;JMP\n', 4, 3), # Onto the pair's @X
+        ]
+        for source, cycles, pc in programs:
+            cpu = HackCPU(assemble(source))
+            self.assertEqual(cpu.run(100), cycles, source)
+            self.assertTrue(cpu.halted)
+            self.assertEqual(cpu.pc, pc)
+
+        # Jumps that go somewhere else aren't halts, even from a halt pair
+        cpu = HackCPU(assemble('@R0\nA=M\n0;JMP\n(END)\n@END\n0;JMP\n'))
+        cpu.ram[0] = 1
+        self.assertEqual(cpu.run(100), 100)
+        self.assertFalse(cpu.halted)
+
+    def test_pong_runs(self):
+        cpu = HackCPU.load(os.path.join(HERE, 'pong/Pong.hack'))
+        self.assertEqual(cpu.run(100000), 100000)
+        self.assertFalse(cpu.halted)
+        self.assertTrue(256 <= cpu.ram[0] < 2048) # SP stays on the stack
+
+    def test_alu_table_matches_alu(self):
+        rng = random.Random(0)
+        for c, fn in ALU.items():
+            for _ in range(100):
+                x, y = rng.randrange(0x10000), rng.randrange(0x10000)
+                self.assertEqual(fn(x, y), alu(c, x, y), bin(c))
+
+    def test_m_is_written_before_a_changes(self):
+        cpu = HackCPU(assemble('@100\nM=1\n@100\nAM=M+1\nM=-1\n'))
+        cpu.run(5)
+        self.assertEqual(cpu.ram[100], 2)
+        self.assertEqual(cpu.signed(2), -1)
+
+    def test_jump_goes_to_old_a(self):
+        # A changes in the same instruction that jumps, the jump still
+        # goes where A pointed before
+        cpu = HackCPU(assemble('@4\nA=1;JMP\n@0\n@0\nD=A\n'))
+        cpu.run(3)
+        self.assertEqual(cpu.pc, 5)
+        self.assertEqual(cpu.a, 1)
+        self.assertEqual(cpu.d, 1)
+
+    def test_signed_jumps(self):
+        source = '@R0\nD=M\n@NEG\nD;JLT\n@R1\nM=1\n(END)\n@END\n0;JMP\n(NEG)\n@R1\nM=-1\n@END\n0;JMP\n'
+        cpu = HackCPU(assemble(source))
+        for value, expected in [(-1, -1), (0x7FFF, 1), (-0x8000, -1), (0, 1)]:
+            cpu.reset()
+            cpu.ram[0] = value & 0xFFFF
+            cpu.run(100)
+            self.assertTrue(cpu.halted)
+            self.assertEqual(cpu.signed(1), expected)
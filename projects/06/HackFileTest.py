@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+import hackfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class HackFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_packed_round_trip(self):
+        words = hackfile.read_text(os.path.join(HERE, 'max/Max.hack'))
+        packed_filepath = os.path.join(self.tmpdir, 'Max.hackb')
+        source_hash = hackfile.source_hash('// Max.asm')
+        with open(packed_filepath, 'wb') as fp:
+            hackfile.write_packed(fp, words, source_hash)
+
+        self.assertEqual(os.path.getsize(packed_filepath), hackfile.HEADER.size + 2 * len(words))
+
+        result, result_hash = hackfile.read_packed(packed_filepath)
+        self.assertEqual(list(result), list(words))
+        self.assertEqual(result_hash, source_hash)
+
+    def test_read_hack_detects_format(self):
+        text_filepath = os.path.join(HERE, 'add/Add.hack')
+        packed_filepath = os.path.join(self.tmpdir, 'Add.hackb')
+        words = hackfile.read_text(text_filepath)
+        with open(packed_filepath, 'wb') as fp:
+            hackfile.write_packed(fp, words, hackfile.source_hash(b''))
+
+        self.assertEqual(list(hackfile.read_hack(text_filepath)), list(words))
+        self.assertEqual(list(hackfile.read_hack(packed_filepath)), list(words))
+
+    def test_rejects_non_packed_file(self):
+        with self.assertRaises(Exception):
+            hackfile.read_packed(os.path.join(HERE, 'add/Add.hack'))
+
+    def test_rejects_short_files(self):
+        filepath = os.path.join(self.tmpdir, 'Short.hackb')
+        for contents in [b'', hackfile.MAGIC, hackfile.HEADER.pack(hackfile.MAGIC, 2, b'\0' * 8) + b'\0\0']:
+            with open(filepath, 'wb') as fp:
+                fp.write(contents)
+            with self.assertRaisesRegex(Exception, 'not a packed|truncated'):
+                hackfile.read_packed(filepath)
+            with self.assertRaisesRegex(Exception, 'not a source map'):
+                hackfile.SourceMap(filepath)
+
+    def test_write_packed_streams_from_generator(self):
+        packed_filepath = os.path.join(self.tmpdir, 'Stream.hackb')
+        word_count = hackfile.CHUNK_SIZE * 2 + 5
+        with open(packed_filepath, 'wb') as fp:
+            hackfile.write_packed(fp, (i & 0xFFFF for i in range(word_count)), hackfile.source_hash(b''))
+
+        result, _ = hackfile.read_packed(packed_filepath)
+        self.assertEqual(len(result), word_count)
+        self.assertEqual(result[-1], word_count - 1)
+
+    def test_file_hash_matches_source_hash(self):
+        filepath = os.path.join(self.tmpdir, 'Big.asm')
+        source = b'@0\nD=A\n' * (hackfile.HASH_CHUNK_SIZE // 3)
+        with open(filepath, 'wb') as fp:
+            fp.write(source)
+        self.assertEqual(hackfile.file_hash(filepath), hackfile.source_hash(source))
+
+    def test_source_map_round_trip(self):
+        map_filepath = os.path.join(self.tmpdir, 'Prog' + hackfile.SOURCE_MAP_EXTENSION)
+        with open(map_filepath, 'wb') as fp:
+            hackfile.write_source_map(fp, ['Main.asm', 'Sys.asm'], [3, 4, 10, 1], [0, 0, 0, 1])
+
+        source_map = hackfile.SourceMap(map_filepath)
+        self.assertEqual(len(source_map), 4)
+        self.assertEqual(source_map.location(2), ('Main.asm', 10))
+        self.assertEqual(source_map.location(3), ('Sys.asm', 1))
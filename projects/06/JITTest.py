@@ -0,0 +1,88 @@
+import os
+import random
+import unittest
+from jit import *
+from assembler import Assembler
+from testprograms import random_program
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def assemble(source):
+    return Assembler().assemble(source)
+
+class JITTest(unittest.TestCase):
+    def assertSameState(self, jit_cpu, cpu):
+        self.assertEqual((jit_cpu.a, jit_cpu.d, jit_cpu.pc, jit_cpu.cycles, jit_cpu.halted),
+            (cpu.a, cpu.d, cpu.pc, cpu.cycles, cpu.halted))
+        self.assertTrue((jit_cpu.ram == cpu.ram).all())
+
+    def test_max(self):
+        cpu = BlockJITCPU.load(os.path.join(HERE, 'max/Max.hack'))
+        for first, second in [(3, 5), (23456, 12345), (-7, -9), (0, 0)]:
+            cpu.reset()
+            cpu.ram[0] = first & 0xFFFF
+            cpu.ram[1] = second & 0xFFFF
+            cpu.run(1000)
+            self.assertTrue(cpu.halted)
+            self.assertEqual(cpu.signed(2), max(first, second))
+
+    def test_rect(self):
+        cpu = BlockJITCPU.load(os.path.join(HERE, 'rect/Rect.hack'))
+        cpu.ram[0] = 4
+        cpu.run(10000)
+        self.assertTrue(cpu.halted)
+        self.assertEqual([cpu.signed(SCREEN + 32 * row) for row in range(5)], [-1, -1, -1, -1, 0])
+
+    def test_pong_matches_interpreter(self):
+        filepath = os.path.join(HERE, 'pong/Pong.hack')
+        jit_cpu, cpu = BlockJITCPU.load(filepath), HackCPU.load(filepath)
+        # Odd cycle counts so runs stop partway through blocks
+        for cycles in [1, 7, 1000, 12345, 200000]:
+            self.assertEqual(jit_cpu.run(cycles), cpu.run(cycles))
+            self.assertSameState(jit_cpu, cpu)
+
+    def test_random_programs_match_interpreter(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            words = random_program(rng, rng.randrange(1, 40))
+            jit_cpu, cpu = BlockJITCPU(words), HackCPU(words)
+            for i in range(16):
+                jit_cpu.ram[i] = cpu.ram[i] = rng.randrange(0x10000)
+            jit_cpu.run(500)
+            cpu.run(500)
+            self.assertSameState(jit_cpu, cpu)
+
+    def test_halt_stops_on_jump(self):
+        # The halt loop is reached with an unconditional jump, which is
+        # followed inside the block
+        words = assemble('@R0\nM=1\n@END\n0;JMP\n@R0\nM=0\n(END)\n@END\n0;JMP\n')
+        jit_cpu, cpu = BlockJITCPU(words), HackCPU(words)
+        jit_cpu.run(100)
+        cpu.run(100)
+        self.assertSameState(jit_cpu, cpu)
+        self.assertEqual(jit_cpu.pc, 7)
+
+    def test_halt_depends_on_jump_target(self):
+        for source in ['@3\nD=A\nA=D\n0;JMP\n', '@3\n0;JMP\n@2\n0;JMP\n',
+                '@R0\nA=M\n0;JMP\n(END)\n@END\n0;JMP\n']:
+            words = assemble(source)
+            jit_cpu, cpu = BlockJITCPU(words), HackCPU(words)
+            jit_cpu.ram[0] = cpu.ram[0] = 1
+            jit_cpu.run(100)
+            cpu.run(100)
+            self.assertSameState(jit_cpu, cpu)
+
+    def test_a_offset(self):
+        cpu = BlockJITCPU(assemble('@R1\nD=M\nA=D\nA=A+1\nA=A+1\nA=A-1\nM=-1\n'))
+        cpu.ram[1] = 100
+        cpu.run(100)
+        self.assertEqual(cpu.signed(101), -1)
+        self.assertEqual(cpu.a, 101)
+
+    def test_blocks_are_cached(self):
+        cpu = BlockJITCPU.load(os.path.join(HERE, 'pong/Pong.hack'))
+        cpu.run(100000)
+        translated = cpu.blocks_translated
+        cpu.reset()
+        cpu.run(100000)
+        self.assertEqual(cpu.blocks_translated, translated)
@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+import hackfile
+
+# Default cap on the total size of the cache directory
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+class AssemblyCache:
+    # On-disk cache of assembled programs. Entries are packed .hack images
+    # named after a hash of the assembler version and the .asm source, so
+    # an unchanged file (or a new copy of one) never gets assembled twice.
+    # Once the directory grows past max_size the least recently used
+    # entries are evicted; every hit bumps the entry's mtime.
+    def __init__(self, directory, version, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source):
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(b'\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + hackfile.PACKED_EXTENSION)
+
+    def get(self, key):
+        # Returns the cached words, or None on a miss
+        entry_path = self.entry_path(key)
+        try:
+            words, _ = hackfile.read_packed(entry_path)
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Left empty or cut short, say by a full disk. Removed so the
+            # source gets assembled and cached again.
+            remove(entry_path)
+            return None
+        return words
+
+    def put(self, key, words, source_hash):
+        # Written to a temp file first so other processes sharing the
+        # cache never see a half-written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                hackfile.write_packed(fp, words, source_hash)
+            os.replace(tmp_path, self.entry_path(key))
+        except BaseException:
+            remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(hackfile.PACKED_EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            remove(path)
+            total_size -= size
+
+def remove(path):
+    # Entries can go from under us (another process got to it first), and
+    # one that can't be removed is left for the next eviction
+    try:
+        os.remove(path)
+    except OSError:
+        pass
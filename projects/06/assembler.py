@@ -1,143 +1,382 @@
+import argparse
+import array
+import concurrent.futures
+import functools
+import glob
+import itertools
+import mmap
 import os
+import re
 import sys
+import time
+import asmcache
+import hackfile
 
-output = []
+# Hashed into every AssemblyCache key. Entries made by an older assembler
+# are only ignored if this changes, so change it with the encoding.
+ASSEMBLER_VERSION = '1'
 
 def main():
-    filepath = sys.argv[1]
-
-    if not os.path.isfile(filepath):
-        print("File path {} does not exist. Exiting...".format(filepath))
-        sys.exit()
-
-    print('Populating symbol table')
-    with open(filepath) as fp:
-        line_number = 0
-        for line in fp:
-            line = preprocess_line(line)
-            if line.startswith('//') or line == '':
-                continue
-            elif line.startswith('('):
-                process_label(line, line_number)
-            elif line.startswith('@'):
-                process_symbol(line)
-                line_number += 1
-            else: # C-instruction
-                line_number += 1
-
-    process_custom_symbols()
-
-    print('Processing all instructions (converting to binary code)')
-    with open(filepath) as fp:
-        line_number = 1
-        for line in fp:
-            line = preprocess_line(line)
-            print("Line {} contents {}".format(line_number, line))
-            processed_line = process_line(line)
-            print(processed_line)
-            line_number += 1
-
-    # Print output program
-    print("Binary code output")
-    for item in output:
-        print(item)
+    args = parse_args()
 
-    hack_filepath = os.path.splitext(filepath)[0] + ".hack"
-    print("Writing code output to file: {}".format(hack_filepath))
-    with open(hack_filepath, 'w') as hack_fp:
-        for line in output:
-            hack_fp.write(line + '\n')
-
-def preprocess_line(line):
-    # Remove all comments, even from mid-line
-    result = line.split('//')[0]
-    result = result.strip()
-    return result
-
-def process_symbol(line):
-    symbol = line.replace('@', '')
-    if symbol in symbols.keys():
-        return
-    elif symbol.isdigit():
-        return
-
-    # Placeholder value will be replaced when we get the label's line number
-    symbols[symbol] = "PLACEHOLDER"
-    print(symbol)
-
-def process_label(line, line_number):
-    symbol = line.replace('(', '').replace(')', '')
-    symbols[symbol] = line_number
-
-def process_custom_symbols():
-    address = 16 # Custom symbols start at address 16
-    for symbol, value in symbols.items():
-        if value == 'PLACEHOLDER':
-            symbols[symbol] = address
-            address += 1
-
-def process_line(line):
-    if line == '':
-        return 'Empty line'
-    elif line.startswith('('):
-        return 'Label line'
-    elif line.startswith('@'):
-        a_instruction = process_a_instruction(line)
-        output.append(a_instruction)
-        return "A-instruction: {}".format(a_instruction)
+    filepaths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            filepaths += find_asm_files(path)
+        elif os.path.isfile(path):
+            filepaths.append(path)
+        else:
+            print("File path {} does not exist. Exiting...".format(path))
+            sys.exit()
+
+    cache = None
+    if args.cache_dir:
+        cache = asmcache.AssemblyCache(args.cache_dir, ASSEMBLER_VERSION, args.cache_size * 1024 * 1024)
+
+    if len(filepaths) == 1:
+        assemble_path(filepaths[0], args.single_pass, args.packed, args.verbose, cache, args.source_map)
     else:
-        c_instruction = process_c_instruction(line)
-        output.append(c_instruction)
-        return "C-instruction: {}".format(c_instruction)
-
-def process_a_instruction(inst):
-    # A-instruction is 1-bit op code then 15 bits data value
-    # For example:  0000000000000010 = @R2 = @2
-
-    result = inst.replace("@", "")
-
-    if result in symbols.keys():
-        # Built-in symbol (R1, KBD, etc)
-        result = symbols[result]
-
-    # Convert int value to binary
-    result = bin(int(result))[2:]
-
-    # Pad front with zeros until we reach 16 bits
-    while len(result) < 16:
-        result = '0' + result
-    return result
-
-def process_c_instruction(inst):
-    # C-instruction is:
-    # 1-bit op code, 2 bits unused
-    # 7 bits computation (a bit and 6 ALU control bits)
-    # 3 bits destination (A, D, M registers)
-    # 3 bits jump
-    # dest = comp; jump (dest and jump are optional)
-
-    dest_asm = comp_asm = jump_asm = ''
-    dest_bin = comp_bin = jump_bin = ''
-
-    jump_split = inst.split(';')
-    dest_cont = jump_split[0]
-    if len(jump_split) == 2: # has jump portion
-        jump_asm = jump_split[1].strip()
-
-    dest_split = dest_cont.split('=')
-    if len(dest_split) == 2: # has dest portion
-        dest_asm = dest_split[0]
-        comp_asm = dest_split[1]
+        assemble_batch(filepaths, args.jobs, args.single_pass, args.packed, cache, args.source_map)
+
+def find_asm_files(directory):
+    # Sorted so batch output is always reported in the same order
+    return sorted(glob.glob(os.path.join(directory, '**', '*.asm'), recursive=True))
+
+def assemble_batch(filepaths, jobs=None, single_pass=False, packed=False, cache=None, source_map=False):
+    # Fans the files out across a process pool. map() hands results back
+    # in the order the files were given, whichever worker finishes first.
+    assemble_fn = functools.partial(timed_assemble_path,
+        single_pass=single_pass, packed=packed, cache=cache, source_map=source_map)
+
+    start = time.perf_counter()
+    if jobs == 1:
+        timings = report_timings(filepaths, map(assemble_fn, filepaths))
     else:
-        comp_asm = dest_split[0]
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            timings = report_timings(filepaths, executor.map(assemble_fn, filepaths))
+
+    total_words = sum(word_count for word_count, _ in timings)
+    print("Assembled {} files ({} words) in {:.1f} ms".format(
+        len(filepaths), total_words, (time.perf_counter() - start) * 1000))
+    return timings
+
+def report_timings(filepaths, results):
+    timings = []
+    for filepath, (word_count, seconds) in zip(filepaths, results):
+        print("{}: {} words in {:.1f} ms".format(filepath, word_count, seconds * 1000))
+        timings.append((word_count, seconds))
+    return timings
+
+def timed_assemble_path(filepath, single_pass=False, packed=False, cache=None, source_map=False):
+    start = time.perf_counter()
+    word_count = assemble_path(filepath, single_pass, packed, cache=cache, source_map=source_map)
+    return word_count, time.perf_counter() - start
+
+def assemble_path(filepath, single_pass=False, packed=False, verbose=False, cache=None, source_map=False):
+    # Assembles one .asm file to its .hack file. Returns the word count.
+    assembler = Assembler(verbose, source_map)
+
+    # The two-pass path only needs the symbol table in memory; words are
+    # encoded on the second pass and go straight out to the file. The
+    # single-pass path has to hold the program until it's backpatched.
+    if cache is not None:
+        words = assemble_cached(assembler, filepath, single_pass, cache)
+    elif single_pass:
+        words = assembler.assemble_single_pass(map_file(filepath))
+    else:
+        words = assembler.assemble_two_pass(map_file(filepath))
+
+    if verbose:
+        words = print_words(words)
+
+    if packed:
+        word_count = write_packed_output(filepath, words, verbose)
+    else:
+        word_count = write_text_output(filepath, words, verbose)
+
+    # Only complete once the words have all been encoded and written
+    if source_map:
+        write_source_map_output(filepath, assembler.line_numbers, verbose)
+    return word_count
+
+def assemble_cached(assembler, filepath, single_pass, cache):
+    with open(filepath, 'rb') as fp:
+        source = fp.read()
+
+    key = cache.key(source)
+    words = cache.get(key)
+    if words is None:
+        words = assembler.assemble(source, single_pass)
+        cache.put(key, words, hackfile.source_hash(source))
+    else:
+        if assembler.verbose:
+            print("Cache hit for {}".format(filepath))
+        if assembler.source_map:
+            assembler.line_numbers = instruction_line_numbers(source)
+    return words
+
+def print_words(words):
+    for word in words:
+        print(format_word(word))
+        yield word
+
+def write_text_output(filepath, words, verbose=False):
+    hack_filepath = os.path.splitext(filepath)[0] + ".hack"
+    if verbose:
+        print("Writing code output to file: {}".format(hack_filepath))
+    word_count = 0
+    with open(hack_filepath, 'w') as hack_fp:
+        for word_count, word in enumerate(words, 1):
+            hack_fp.write(format_word(word) + '\n')
+    return word_count
+
+def write_packed_output(filepath, words, verbose=False):
+    hack_filepath = os.path.splitext(filepath)[0] + hackfile.PACKED_EXTENSION
+    if verbose:
+        print("Writing packed code output to file: {}".format(hack_filepath))
+    with open(hack_filepath, 'wb') as hack_fp:
+        return hackfile.write_packed(hack_fp, words, hackfile.file_hash(filepath))
+
+def write_source_map_output(filepath, line_numbers, verbose=False):
+    map_filepath = os.path.splitext(filepath)[0] + hackfile.SOURCE_MAP_EXTENSION
+    if verbose:
+        print("Writing source map to file: {}".format(map_filepath))
+    with open(map_filepath, 'wb') as map_fp:
+        hackfile.write_source_map(map_fp, [os.path.basename(filepath)], line_numbers)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hack assembler')
+    parser.add_argument('paths', nargs='+',
+        help='.asm files to assemble, or directories to search for them')
+    parser.add_argument('--single-pass', action='store_true',
+        help='read the file once and backpatch forward label references')
+    parser.add_argument('--packed', action='store_true',
+        help='write a packed binary {} image instead of text'.format(hackfile.PACKED_EXTENSION))
+    parser.add_argument('--source-map', action='store_true',
+        help='also write a {} file mapping ROM addresses to source lines'.format(hackfile.SOURCE_MAP_EXTENSION))
+    parser.add_argument('--cache-dir',
+        help='reuse assembled output for unchanged sources, stored in this directory')
+    parser.add_argument('--cache-size', type=int, default=asmcache.DEFAULT_MAX_SIZE // (1024 * 1024),
+        help='evict least recently used cache entries beyond this many MB')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes for batches of files (default: one per core)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='print every line, symbol and instruction as it is processed')
+    return parser.parse_args()
+
+def map_file(filepath):
+    # The scanner works on the whole file at once. Mapping it rather than
+    # reading it keeps memory use flat however big the file is.
+    with open(filepath, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return b'' # mmap can't map an empty file
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
 
-    dest_bin = process_dest(dest_asm)
-    comp_bin = comp[comp_asm]
-    jump_bin = jump[jump_asm]
+def source_buffer(source):
+    # Accepts .asm source as str, bytes or an open file (text or binary)
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, str):
+        source = source.encode()
+    return source
 
-    op_code = '111' # Op code plus unused bits
-    result = op_code + comp_bin + dest_bin + jump_bin
-    return result
+# Matches exactly one line of assembly, comments and all, and pulls out
+# every field we need in one go: (label, symbol, dest, comp, jump, error),
+# with b'' for any part that isn't there. Possessive quantifiers stop the
+# regex engine from backtracking through fields that already matched.
+instruction_pattern = re.compile(rb'''
+    [ \t]*+
+    (?:
+        \((?P<label>[^)\s]++)\)                  # (LABEL)
+      | @(?P<symbol>[^\s/]++)                    # @value or @symbol
+      | (?:(?P<dest>[AMD]{1,3})=)?+              # dest=comp;jump
+        (?P<comp>[-+!&|01ADM]++)
+        (?:;[ \t]*+(?P<jump>J[A-Z]{2}))?+
+      | (?P<error>(?!//)\S[^\n]*?)               # Anything else is a mistake
+    )?
+    [ \t]*+(?://[^\n]*+)?\r?(?:\n|\Z)
+''', re.VERBOSE)
+
+# Bytes of source handed to the regex engine at a time
+SCAN_CHUNK_SIZE = 64 * 1024
+
+def scan(buffer):
+    # Yields the fields of every line in the buffer, blank lines included,
+    # so enumerate(scan(buffer), 1) gives line numbers. findall does the
+    # matching a chunk at a time in C, and chunks always end on a line
+    # break so a chunk boundary never splits a line.
+    position = 0
+    size = len(buffer)
+    while position < size:
+        end = buffer.find(b'\n', position + SCAN_CHUNK_SIZE)
+        end = size if end == -1 else end + 1
+        lines = instruction_pattern.findall(buffer, position, end)
+        del lines[-1] # The empty match findall always finds at the very end
+        yield from lines
+        position = end
+
+def instruction_line_numbers(buffer):
+    # Source line of every instruction, in ROM address order
+    return array.array('I', (line_number
+        for line_number, (label, symbol, dest, comp, jump, error) in enumerate(scan(buffer), 1)
+        if symbol or comp))
+
+def scan_error(line_number, error):
+    return Exception("Line {}: can't parse '{}'".format(line_number, error.decode()))
+
+class Assembler:
+    # Each instance has its own symbol table, which is reset at the start
+    # of every assembly, so one instance can assemble any number of
+    # programs in the same process.
+    #
+    # With source_map on, line_numbers collects the source line of each
+    # word as it's encoded, so line_numbers[address] is where the
+    # instruction at that ROM address came from.
+    def __init__(self, verbose=False, source_map=False):
+        self.verbose = verbose
+        self.source_map = source_map
+        self.reset()
+
+    def reset(self):
+        self.symbols = dict(predefined_symbols)
+        self.line_numbers = array.array('I') if self.source_map else None
+
+    def assemble(self, source, single_pass=False):
+        # Returns the program's instruction words as a list of ints
+        buffer = source_buffer(source)
+        if single_pass:
+            return self.assemble_single_pass(buffer)
+        return list(self.assemble_two_pass(buffer))
+
+    def assemble_file(self, filepath, single_pass=False):
+        buffer = map_file(filepath)
+        if single_pass:
+            return self.assemble_single_pass(buffer)
+        return list(self.assemble_two_pass(buffer))
+
+    def assemble_two_pass(self, buffer):
+        # Scans the buffer once to fill the symbol table and returns a
+        # generator that scans it again to encode.
+        self.reset()
+        self.populate_symbol_table(buffer)
+
+        if self.verbose:
+            print('Processing all instructions (converting to binary code)')
+        return self.encode_instructions(buffer)
+
+    def populate_symbol_table(self, buffer):
+        if self.verbose:
+            print('Populating symbol table')
+        address = 0
+        for line_number, (label, symbol, dest, comp, jump, error) in enumerate(scan(buffer), 1):
+            if label:
+                self.process_label(label.decode(), address)
+            elif symbol:
+                symbol = symbol.decode()
+                if self.process_symbol(symbol) and self.verbose:
+                    print("New symbol {}".format(symbol))
+                address += 1
+            elif comp:
+                address += 1
+            elif error:
+                raise scan_error(line_number, error)
+
+        self.process_custom_symbols()
+
+    def encode_instructions(self, buffer):
+        # Generator so words can be written out as they're encoded
+        symbols = self.symbols
+        line_numbers = self.line_numbers
+        for line_number, (label, symbol, dest, comp, jump, error) in enumerate(scan(buffer), 1):
+            if symbol:
+                symbol = symbol.decode()
+                word = symbols[symbol] if symbol in symbols else int(symbol)
+            elif comp:
+                word = encode_c_instruction(line_number, dest, comp, jump)
+            elif error:
+                raise scan_error(line_number, error)
+            else: # Label or blank line
+                continue
+
+            if line_numbers is not None:
+                line_numbers.append(line_number)
+            if self.verbose:
+                print("Line {}: {}".format(line_number, format_word(word)))
+            yield word
+
+    def assemble_single_pass(self, buffer):
+        # Labels can be used before they're declared, so any @symbol we can't
+        # resolve yet goes in the fixup table: symbol -> output positions
+        # waiting on it. Dicts keep insertion order, so variables still get
+        # addresses in order of first use, same as the two-pass path.
+        self.reset()
+        symbols = self.symbols
+        line_numbers = self.line_numbers
+        output = []
+        fixups = {}
+
+        if self.verbose:
+            print('Processing all instructions in a single pass')
+        for line_number, (label, symbol, dest, comp, jump, error) in enumerate(scan(buffer), 1):
+            if label:
+                self.process_label(label.decode(), len(output))
+            elif symbol:
+                symbol = symbol.decode()
+                if symbol in symbols:
+                    output.append(symbols[symbol])
+                elif symbol.isdigit():
+                    output.append(int(symbol))
+                else:
+                    fixups.setdefault(symbol, array.array('I')).append(len(output))
+                    output.append(None)
+                if line_numbers is not None:
+                    line_numbers.append(line_number)
+            elif comp:
+                output.append(encode_c_instruction(line_number, dest, comp, jump))
+                if line_numbers is not None:
+                    line_numbers.append(line_number)
+            elif error:
+                raise scan_error(line_number, error)
+
+        if self.verbose:
+            print('Patching {} forward references'.format(len(fixups)))
+        address = 16 # Custom symbols start at address 16
+        for symbol, positions in fixups.items():
+            if symbol not in symbols: # Never declared as a label so it's a variable
+                symbols[symbol] = address
+                address += 1
+            a_instruction = symbols[symbol]
+            for position in positions:
+                output[position] = a_instruction
+        return output
+
+    def process_symbol(self, symbol):
+        # Returns True if this is the first time we've seen the symbol
+        if symbol in self.symbols:
+            return False
+        elif symbol.isdigit():
+            return False
+
+        # Placeholder value will be replaced when we get the label's line number
+        self.symbols[symbol] = "PLACEHOLDER"
+        return True
+
+    def process_label(self, symbol, line_number):
+        self.symbols[symbol] = line_number
+
+    def process_custom_symbols(self):
+        address = 16 # Custom symbols start at address 16
+        for symbol, value in self.symbols.items():
+            if value == 'PLACEHOLDER':
+                self.symbols[symbol] = address
+                address += 1
+
+def encode_c_instruction(line_number, dest, comp, jump):
+    # Takes the dest/comp/jump fields straight from the scanner
+    try:
+        return scanned_c_instructions[(dest, comp, jump)]
+    except KeyError:
+        raise Exception("Line {}: invalid C-instruction".format(line_number))
 
 def process_dest(dest_asm):
     # The dest bits are the A, D, and M registers
@@ -147,7 +386,28 @@ def process_dest(dest_asm):
     dest_M = '1' if 'M' in dest_asm else '0'
     return dest_A + dest_D + dest_M
 
-symbols = {
+def format_word(word):
+    # Instructions are kept as ints and only turned into
+    # text when they're printed or written out
+    return format(word, '016b')
+
+def build_c_instruction_table():
+    # Every C-instruction is one of a fixed set of dest/comp/jump
+    # combinations, so encode them all once up front instead of
+    # building each word out of strings
+    dests = [''] + [''.join(p) for n in range(1, 4) for p in itertools.permutations('ADM', n)]
+
+    table = {}
+    for dest_asm in dests:
+        dest_bits = int(process_dest(dest_asm), 2)
+        for comp_asm, comp_bin in comp.items():
+            for jump_asm, jump_bin in jump.items():
+                table[(dest_asm, comp_asm, jump_asm)] = \
+                    0b111 << 13 | int(comp_bin, 2) << 6 | dest_bits << 3 | int(jump_bin, 2)
+    return table
+
+# Built-in symbols every program starts with
+predefined_symbols = {
     'R0': 0,
     'R1': 1,
     'R2': 2,
@@ -217,5 +477,14 @@ comp = {
     'D|M': '1010101'
 }
 
+# (dest, comp, jump) -> 16-bit instruction word
+c_instructions = build_c_instruction_table()
+
+# Same table keyed the way the scanner hands fields over, as bytes
+scanned_c_instructions = {
+    (dest_asm.encode(), comp_asm.encode(), jump_asm.encode()): word
+    for (dest_asm, comp_asm, jump_asm), word in c_instructions.items()
+}
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,160 @@
+import argparse
+import time
+import numpy as np
+from emulator import *
+
+def main():
+    args = parse_args()
+    cpu = BatchHackCPU.load(args.filepath, args.batch_size)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        cpu.ram[:, int(address)] = int(value) & 0xFFFF
+    rng = np.random.default_rng(args.seed)
+    for address in args.randomize:
+        cpu.ram[:, address] = rng.integers(0, 0x10000, args.batch_size, dtype=np.uint16)
+
+    start = time.perf_counter()
+    instructions = cpu.run(args.cycles)
+    seconds = time.perf_counter() - start
+
+    print("Ran {} instances, {} instructions in {:.3f} s ({:.2f} M instructions/s), {} halted".format(
+        args.batch_size, instructions, seconds, instructions / seconds / 1e6 if seconds else 0,
+        int(cpu.halted.sum())))
+    for address in args.dump:
+        print("RAM[{}] = {}".format(address, cpu.signed(address).tolist()))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run many instances of a Hack program in lockstep, one per RAM initial state')
+    parser.add_argument('filepath', help='.hack or packed .hackb file to run')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000,
+        help='number of instances')
+    parser.add_argument('-n', '--cycles', type=int, default=1000000,
+        help='stop each instance after this many cycles if it hasn\'t halted')
+    parser.add_argument('-s', '--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+        help='initial RAM contents, the same in every instance')
+    parser.add_argument('-r', '--randomize', type=int, nargs='*', default=[], metavar='ADDRESS',
+        help='RAM addresses to start at a different random value in each instance')
+    parser.add_argument('--seed', type=int, default=0, help='seed for --randomize')
+    parser.add_argument('-d', '--dump', type=int, nargs='*', default=[], metavar='ADDRESS',
+        help='RAM addresses to print for every instance once they all stop')
+    return parser.parse_args()
+
+def alu_vector(c, x, y):
+    # alu() on uint16 arrays, NumPy's uint16 arithmetic wraps like the
+    # hardware does
+    if c & 0b100000: x = np.zeros_like(x)
+    if c & 0b010000: x = x ^ 0xFFFF
+    if c & 0b001000: y = np.zeros_like(y)
+    if c & 0b000100: y = y ^ 0xFFFF
+    out = x + y if c & 0b000010 else x & y
+    if c & 0b000001: out = out ^ 0xFFFF
+    return out
+
+class BatchHackCPU:
+    # Runs batch_size independent copies of one Hack program in lockstep.
+    # Each instance has its own registers and RAM: ram is a
+    # batch_size x RAM_SIZE uint16 matrix (one row per instance) and a, d,
+    # pc, cycles and halted are arrays with one entry per instance.
+    #
+    # Every step picks one ROM address and runs that instruction for all
+    # the instances whose PC is there, with NumPy operations over those
+    # rows. Instances that branched elsewhere are masked out until the
+    # step's address reaches them. The lowest PC among running instances
+    # goes first, which lets instances that took different branches of an
+    # if/else come back together where the branches join.
+    def __init__(self, words, batch_size):
+        self.rom = DecodedROM(words)
+        self.batch_size = batch_size
+        self.ram = np.zeros((batch_size, RAM_SIZE), dtype=np.uint16)
+        self.reset()
+
+    @classmethod
+    def load(cls, filepath, batch_size):
+        return cls(hackfile.read_hack(filepath), batch_size)
+
+    def reset(self):
+        # Resets every instance, RAM is left alone
+        self.a = np.zeros(self.batch_size, dtype=np.uint16)
+        self.d = np.zeros(self.batch_size, dtype=np.uint16)
+        self.pc = np.zeros(self.batch_size, dtype=np.int64)
+        self.cycles = np.zeros(self.batch_size, dtype=np.int64)
+        self.halted = np.zeros(self.batch_size, dtype=np.bool_)
+
+    def signed(self, address):
+        # RAM[address] of every instance, as signed values
+        return self.ram[:, address].astype(np.int16)
+
+    def run(self, max_cycles):
+        # Runs until every instance has halted, run off the end of the ROM
+        # or done max_cycles more cycles. Each instance stops in exactly the
+        # state HackCPU.run would leave it in. Returns the total number of
+        # instructions run across all instances.
+        rom = self.rom
+        rom_size = len(rom)
+        is_c = rom.is_c.tolist()
+        values = rom.value.tolist()
+        a_bits = rom.a_bit.tolist()
+        comps = rom.comp.tolist()
+        dests = rom.dest.tolist()
+        jumps = rom.jump.tolist()
+        halts = rom.halts.tolist()
+        loop_starts = rom.loop_starts.tolist()
+        ram, a, d, pc, cycles, halted = self.ram, self.a, self.d, self.pc, self.cycles, self.halted
+
+        limit = cycles + max_cycles
+        start_cycles = int(cycles.sum())
+        while True:
+            running = ~halted & (cycles < limit)
+            if not running.any():
+                break
+            step_pc = int(pc[running].min())
+            if step_pc >= rom_size:
+                halted[running & (pc >= rom_size)] = True
+                continue
+
+            rows = np.flatnonzero(running & (pc == step_pc))
+            cycles[rows] += 1
+
+            if not is_c[step_pc]:
+                a[rows] = values[step_pc]
+                pc[rows] = step_pc + 1
+                continue
+
+            old_a = a[rows]
+            addresses = old_a & 0x7FFF
+            out = alu_vector(comps[step_pc], d[rows], ram[rows, addresses] if a_bits[step_pc] else old_a)
+
+            dest = dests[step_pc]
+            if dest & 1:
+                ram[rows, addresses] = out
+            if dest & 2:
+                d[rows] = out
+            if dest & 4:
+                a[rows] = out
+
+            jump = jumps[step_pc]
+            if not jump:
+                pc[rows] = step_pc + 1
+                continue
+            if jump == 0b111:
+                taken = np.ones(len(rows), dtype=np.bool_)
+            else:
+                negative = out >= 0x8000
+                zero = out == 0
+                taken = np.zeros(len(rows), dtype=np.bool_)
+                if jump & 0b100: taken |= negative
+                if jump & 0b010: taken |= zero
+                if jump & 0b001: taken |= ~negative & ~zero
+            if halts[step_pc]:
+                # Halted instances stay on the jump, same as HackCPU
+                halting = taken & ((old_a == step_pc) | (old_a == loop_starts[step_pc]))
+                halted[rows[halting]] = True
+                rows, taken, old_a = rows[~halting], taken[~halting], old_a[~halting]
+            # Jumps go to A as it was before this instruction
+            pc[rows] = np.where(taken, old_a, step_pc + 1)
+
+        return int(cycles.sum()) - start_cycles
+
+if __name__ == '__main__':
+    main()
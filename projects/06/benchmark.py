@@ -0,0 +1,250 @@
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import assembler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROGRAMS = ['add/Add.asm', 'max/Max.asm', 'rect/Rect.asm', 'pong/Pong.asm']
+DEFAULT_SIZES = [10000, 100000, 1000000]
+MODES = ['two-pass', 'single-pass', 'streaming']
+
+# Instruction mix measured from pong/Pong.asm (the VM translator's output
+# for the whole OS plus the game): about 3% of lines are labels, 35%
+# A-instructions and 65% C-instructions.
+LABEL_RATE = 0.032
+A_INSTRUCTION_RATE = 0.345
+
+# What the A-instructions in Pong.asm refer to
+A_INSTRUCTION_TARGETS = [
+    ('predefined', 0.70),
+    ('constant', 0.22),
+    ('label', 0.06),
+    ('variable', 0.02),
+]
+PREDEFINED_TARGETS = ['SP'] * 8 + ['LCL', 'ARG', 'THIS', 'THAT', 'R13', 'R14', 'R5', 'R15']
+
+# The most common C-instructions in Pong.asm with their counts
+C_INSTRUCTIONS = [
+    ('M=D', 3375), ('A=A-1', 2309), ('D=M', 2265), ('D=A', 2218), ('AM=M+1', 1988),
+    ('AM=M-1', 1155), ('0;JMP', 742), ('A=M-1', 684), ('M=M+1', 596), ('M=0', 548),
+    ('A=M', 523), ('A=M+1', 413), ('A=A+1', 306), ('M=D+M', 197), ('A=D+A', 154),
+    ('D;JNE', 126), ('M=1', 84), ('M=M-D', 69), ('M=!M', 69), ('M=D|M', 34),
+]
+
+# Labels above this can't be loaded with an A-instruction (they're still
+# defined, they just never get referenced)
+MAX_ADDRESS = 32767
+
+def main():
+    args = parse_args()
+    if args.command == 'front-end':
+        run_front_end(args)
+    else:
+        run_suite(args)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hack assembler benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    suite = subparsers.add_parser('suite',
+        help='time each assembler mode on synthetic programs of several sizes')
+    suite.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='program sizes in instructions')
+    suite.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    suite.add_argument('-n', '--repeat', type=int, default=3,
+        help='runs per measurement, the fastest is reported')
+    suite.add_argument('--seed', type=int, default=0,
+        help='seed for the program generator, keep it fixed to compare runs')
+    suite.add_argument('-o', '--output',
+        help='write the results to this file as JSON (default: stdout)')
+
+    front_end = subparsers.add_parser('front-end',
+        help='report scanner throughput in MB/s on existing .asm files')
+    front_end.add_argument('filepaths', nargs='*', help='.asm files (default: the project 6 programs)')
+    front_end.add_argument('-n', '--repeat', type=int, default=5,
+        help='runs per measurement, the fastest is reported')
+
+    return parser.parse_args()
+
+def run_front_end(args):
+    filepaths = args.filepaths or [os.path.join(HERE, program) for program in DEFAULT_PROGRAMS]
+
+    for filepath in filepaths:
+        with open(filepath, 'rb') as fp:
+            buffer = fp.read()
+        print(filepath)
+        for name, seconds in benchmark_front_end(buffer, args.repeat):
+            print("  {:<12} {:8.1f} MB/s".format(name, megabytes_per_second(len(buffer), seconds)))
+
+def run_suite(args):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for size in args.sizes:
+            asm_filepath = os.path.join(tmpdir, 'Synthetic{}.asm'.format(size))
+            with open(asm_filepath, 'w') as fp:
+                fp.write(generate_program(size, args.seed))
+
+            for mode in args.modes:
+                result = run_isolated(benchmark_mode, asm_filepath, mode, args.repeat)
+                result['size'] = size
+                results.append(result)
+                print_result(result)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+
+def print_result(result):
+    # Human readable summary, on stderr so stdout stays valid JSON
+    phases = ', '.join("{} {:.1f} ms".format(phase, seconds * 1000)
+        for phase, seconds in result['seconds'].items())
+    print("{:>8} {:<12} {:7.2f} MB/s {:10.0f} inst/s  peak RSS {:7.1f} MB  ({})".format(
+        result['size'], result['mode'], result['mb_per_second'], result['instructions_per_second'],
+        result['peak_rss_kb'] / 1024, phases), file=sys.stderr)
+
+def generate_program(instruction_count, seed=0):
+    # Returns the text of a synthetic .asm program with instruction_count
+    # instructions and roughly the same mix of labels, symbols and
+    # C-instructions as Pong.asm
+    rng = random.Random(seed)
+    label_count = max(1, int(instruction_count * LABEL_RATE))
+    variable_count = max(1, min(instruction_count // 1000, 1000))
+
+    # Decide up front where each label goes so references can point
+    # forwards as well as backwards
+    label_addresses = sorted(rng.randrange(instruction_count) for _ in range(label_count))
+    referenceable = [i for i, address in enumerate(label_addresses) if address <= MAX_ADDRESS]
+
+    target_kinds = [kind for kind, _ in A_INSTRUCTION_TARGETS]
+    target_weights = [weight for _, weight in A_INSTRUCTION_TARGETS]
+    c_instructions = [inst for inst, _ in C_INSTRUCTIONS]
+    c_weights = [count for _, count in C_INSTRUCTIONS]
+
+    lines = ['// Synthetic program, {} instructions, seed {}'.format(instruction_count, seed)]
+    next_label = 0
+    for address in range(instruction_count):
+        while next_label < label_count and label_addresses[next_label] == address:
+            lines.append('(LABEL.{})'.format(next_label))
+            next_label += 1
+
+        if rng.random() >= A_INSTRUCTION_RATE:
+            lines.append(rng.choices(c_instructions, c_weights)[0])
+            continue
+
+        kind = rng.choices(target_kinds, target_weights)[0]
+        if kind == 'label' and referenceable:
+            lines.append('@LABEL.{}'.format(rng.choice(referenceable)))
+        elif kind == 'variable':
+            lines.append('@var.{}'.format(rng.randrange(variable_count)))
+        elif kind == 'constant':
+            lines.append('@{}'.format(rng.randrange(256)))
+        else:
+            lines.append('@' + rng.choice(PREDEFINED_TARGETS))
+
+    # Any labels left over sit at the very end
+    lines += ['(LABEL.{})'.format(i) for i in range(next_label, label_count)]
+    return '\n'.join(lines) + '\n'
+
+def run_isolated(fn, *args):
+    # Runs fn(*args) in a fresh interpreter so its peak RSS isn't
+    # inflated by whatever ran before it
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+def benchmark_mode(asm_filepath, mode, repeat):
+    # Times each phase separately: filling the symbol table, encoding, and
+    # writing the text and packed outputs. Single-pass has no separate
+    # symbol phase since it resolves symbols as it encodes. Streaming is
+    # the command line's default path, where encoding and writing overlap,
+    # so it's only timed as a whole.
+    baseline_rss_kb = peak_rss_kb()
+    buffer = assembler.map_file(asm_filepath)
+    asm = assembler.Assembler()
+    seconds = {}
+
+    if mode == 'streaming':
+        seconds['total'] = best_time(lambda: assembler.assemble_path(asm_filepath), repeat)
+        instruction_count = assembler.assemble_path(asm_filepath)
+        return benchmark_result(mode, len(buffer), seconds['total'], seconds, baseline_rss_kb, instruction_count)
+    elif mode == 'two-pass':
+        def symbol_pass():
+            asm.reset()
+            asm.populate_symbol_table(buffer)
+        seconds['symbols'] = best_time(symbol_pass, repeat)
+        seconds['encode'] = best_time(lambda: list(asm.encode_instructions(buffer)), repeat)
+        words = list(asm.encode_instructions(buffer))
+    else:
+        seconds['encode'] = best_time(lambda: asm.assemble_single_pass(buffer), repeat)
+        words = asm.assemble_single_pass(buffer)
+
+    seconds['write'] = best_time(lambda: assembler.write_text_output(asm_filepath, words), repeat)
+    seconds['write_packed'] = best_time(lambda: assembler.write_packed_output(asm_filepath, words), repeat)
+
+    total = seconds.get('symbols', 0) + seconds['encode'] + seconds['write']
+    return benchmark_result(mode, len(buffer), total, seconds, baseline_rss_kb, len(words))
+
+def benchmark_result(mode, size, total_seconds, seconds, baseline_rss_kb, instruction_count):
+    return {
+        'mode': mode,
+        'instructions': instruction_count,
+        'bytes': size,
+        'seconds': seconds,
+        'mb_per_second': megabytes_per_second(size, total_seconds),
+        'instructions_per_second': instruction_count / total_seconds,
+        'baseline_rss_kb': baseline_rss_kb,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def benchmark_front_end(buffer, repeat):
+    # Returns (name, best seconds) for the scanner on its own, the
+    # equivalent line-by-line string splitting, and full assembly
+    return [
+        ('lines', best_time(lambda: split_lines(buffer), repeat)),
+        ('scanner', best_time(lambda: consume(assembler.scan(buffer)), repeat)),
+        ('assemble', best_time(lambda: assembler.Assembler().assemble(buffer), repeat)),
+    ]
+
+def split_lines(buffer):
+    # Line-by-line classification with str methods, for comparison
+    for line in buffer.decode().splitlines():
+        line = line.split('//')[0].strip()
+        if line == '' or line.startswith('(') or line.startswith('@'):
+            continue
+        dest_comp, _, jump = line.partition(';')
+        dest, _, comp = dest_comp.rpartition('=')
+
+def consume(iterator):
+    collections.deque(iterator, maxlen=0)
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def megabytes_per_second(size, seconds):
+    return size / (1024 * 1024) / seconds
+
+if __name__ == '__main__':
+    main()
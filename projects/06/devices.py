@@ -0,0 +1,171 @@
+import argparse
+import struct
+import time
+import zlib
+import numpy as np
+from emulator import *
+from jit import BlockJITCPU
+
+SCREEN_WIDTH = 512
+SCREEN_HEIGHT = 256
+SCREEN_WORDS = SCREEN_WIDTH * SCREEN_HEIGHT // 16
+
+# Hack character set codes for the keys that don't have a character
+KEY_CODES = {
+    'newline': 128, 'backspace': 129, 'left': 130, 'up': 131, 'right': 132,
+    'down': 133, 'home': 134, 'end': 135, 'pageup': 136, 'pagedown': 137,
+    'insert': 138, 'delete': 139, 'esc': 140,
+}
+KEY_CODES.update(('f{}'.format(n), 140 + n) for n in range(1, 13))
+KEY_CODES['space'] = ord(' ')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def main():
+    args = parse_args()
+    cpu_class = BlockJITCPU if args.jit else HackCPU
+    machine = HeadlessMachine(cpu_class.load(args.filepath), parse_key_script(args.keys))
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        machine.cpu.ram[int(address)] = int(value) & 0xFFFF
+
+    start = time.perf_counter()
+    cycles = machine.run(args.cycles)
+    seconds = time.perf_counter() - start
+    print("Ran {} cycles in {:.3f} s ({:.2f} M instructions/s){}".format(
+        cycles, seconds, cycles / seconds / 1e6 if seconds else 0,
+        ", halted at PC {}".format(machine.cpu.pc) if machine.cpu.halted else ''))
+
+    if args.snapshot:
+        machine.screen.snapshot(args.snapshot)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run a Hack program with a headless screen and a scripted keyboard')
+    parser.add_argument('filepath', help='.hack or packed .hackb file to run')
+    parser.add_argument('-n', '--cycles', type=int, default=10000000,
+        help='stop after this many cycles if the program hasn\'t halted')
+    parser.add_argument('-s', '--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+        help='initial RAM contents')
+    parser.add_argument('-k', '--keys', nargs='*', default=[], metavar='CYCLE=KEY',
+        help='hold KEY down from CYCLE on: a character, a key name like left or f1, '
+            'a key code, or nothing to release it')
+    parser.add_argument('-o', '--snapshot', metavar='FILE',
+        help='write the screen to this .png or .pbm file once the program stops')
+    parser.add_argument('--jit', action='store_true', help='run with the basic block JIT')
+    return parser.parse_args()
+
+def parse_key_script(assignments):
+    script = []
+    for assignment in assignments:
+        cycle, key = assignment.split('=', 1)
+        script.append((int(cycle), key_code(key)))
+    return script
+
+def key_code(key):
+    # Hack key code for a character, key name or number, 0 for no key
+    if key == '':
+        return 0
+    if len(key) == 1:
+        return ord(key)
+    if key.lower() in KEY_CODES:
+        return KEY_CODES[key.lower()]
+    if key.isdigit():
+        return int(key)
+    raise ValueError("Unknown key '{}'".format(key))
+
+class Screen:
+    # The memory mapped screen. words is a 256 x 32 view straight onto the
+    # RAM it was created from, so it's always current and costs nothing to
+    # read. Each word holds 16 pixels with the leftmost in the least
+    # significant bit; NumPy can't view single bits, so pixels() unpacks
+    # them when asked.
+    def __init__(self, ram):
+        self.words = ram[SCREEN:SCREEN + SCREEN_WORDS].reshape(SCREEN_HEIGHT, SCREEN_WIDTH // 16)
+
+    def pixels(self):
+        # 256 x 512 uint8 array, 1 for black
+        words = self.words.astype('<u2', copy=False)
+        return np.unpackbits(words.view(np.uint8), axis=1, bitorder='little')
+
+    def snapshot(self, filepath):
+        if filepath.lower().endswith('.pbm'):
+            write = write_pbm
+        elif filepath.lower().endswith('.png'):
+            write = write_png
+        else:
+            raise ValueError("Snapshots must be .png or .pbm: '{}'".format(filepath))
+        with open(filepath, 'wb') as fp:
+            write(fp, self.pixels())
+
+class Keyboard:
+    # The memory mapped keyboard: whatever's in RAM[KBD] is the key held
+    # down. script is a list of (cycle, key code) pairs, each key is held
+    # from that cycle until the next one (0 releases it).
+    def __init__(self, ram, script=()):
+        self.ram = ram
+        self.script = sorted(script)
+        self.position = 0
+
+    def press(self, key):
+        self.ram[KBD] = key_code(key) if isinstance(key, str) else key
+
+    def release(self):
+        self.ram[KBD] = 0
+
+    def update(self, cycle):
+        # Applies every scripted key due by cycle, returns the cycle of the
+        # next one or None once the script's done
+        while self.position < len(self.script) and self.script[self.position][0] <= cycle:
+            self.press(self.script[self.position][1])
+            self.position += 1
+        if self.position < len(self.script):
+            return self.script[self.position][0]
+        return None
+
+class HeadlessMachine:
+    # A CPU (HackCPU or BlockJITCPU) with the screen and keyboard attached.
+    # Nothing is drawn while it runs, the screen's only read when asked for.
+    def __init__(self, cpu, key_script=()):
+        self.cpu = cpu
+        self.screen = Screen(cpu.ram)
+        self.keyboard = Keyboard(cpu.ram, key_script)
+
+    def run(self, max_cycles):
+        # Runs the CPU in stretches between scripted key events. Returns the
+        # cycles run, like cpu.run.
+        cpu = self.cpu
+        start = cpu.cycles
+        end = start + max_cycles
+        while cpu.cycles < end and not cpu.halted:
+            next_event = self.keyboard.update(cpu.cycles)
+            stop = end if next_event is None else min(end, next_event)
+            if cpu.run(stop - cpu.cycles) == 0:
+                break
+        return cpu.cycles - start
+
+def write_pbm(fp, pixels):
+    # Binary PBM, rows packed most significant bit first with 1 for black
+    height, width = pixels.shape
+    fp.write('P4\n{} {}\n'.format(width, height).encode())
+    fp.write(np.packbits(pixels, axis=1).tobytes())
+
+def write_png(fp, pixels):
+    # 1 bit greyscale PNG, where 1 is white
+    height, width = pixels.shape
+    rows = np.packbits(pixels ^ 1, axis=1)
+    # Each row starts with its filter type, 0 for none
+    data = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+    fp.write(PNG_SIGNATURE)
+    write_png_chunk(fp, b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 0, 0, 0, 0))
+    write_png_chunk(fp, b'IDAT', zlib.compress(data))
+    write_png_chunk(fp, b'IEND', b'')
+
+def write_png_chunk(fp, chunk_type, data):
+    fp.write(struct.pack('>I', len(data)))
+    fp.write(chunk_type)
+    fp.write(data)
+    fp.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import argparse
+import time
+import numpy as np
+import hackfile
+
+# Memory map
+RAM_SIZE = 32768 # The address bus is 15 bits wide
+SCREEN = 16384
+KBD = 24576
+
+# ALU output for each 6-bit c1-c6 code, x is D and y is A or M. These are
+# the 18 documented computations; anything else goes through the general
+# ALU below.
+ALU = {
+    0b101010: lambda x, y: 0,
+    0b111111: lambda x, y: 1,
+    0b111010: lambda x, y: 0xFFFF,
+    0b001100: lambda x, y: x,
+    0b110000: lambda x, y: y,
+    0b001101: lambda x, y: x ^ 0xFFFF,
+    0b110001: lambda x, y: y ^ 0xFFFF,
+    0b001111: lambda x, y: -x & 0xFFFF,
+    0b110011: lambda x, y: -y & 0xFFFF,
+    0b011111: lambda x, y: (x + 1) & 0xFFFF,
+    0b110111: lambda x, y: (y + 1) & 0xFFFF,
+    0b001110: lambda x, y: (x - 1) & 0xFFFF,
+    0b110010: lambda x, y: (y - 1) & 0xFFFF,
+    0b000010: lambda x, y: (x + y) & 0xFFFF,
+    0b010011: lambda x, y: (x - y) & 0xFFFF,
+    0b000111: lambda x, y: (y - x) & 0xFFFF,
+    0b000000: lambda x, y: x & y,
+    0b010101: lambda x, y: x | y,
+}
+
+# Whether each jump (j1 j2 j3 bits) is taken, indexed by the sign of the
+# ALU output: 0 for zero, 1 for positive, 2 for negative
+JUMP_TAKEN = [
+    (False, False, False), # null
+    (False, True, False),  # JGT
+    (True, False, False),  # JEQ
+    (True, True, False),   # JGE
+    (False, False, True),  # JLT
+    (False, True, True),   # JNE
+    (True, False, True),   # JLE
+    (True, True, True),    # JMP
+]
+
+def main():
+    args = parse_args()
+    cpu = HackCPU.load(args.filepath)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        cpu.ram[int(address)] = int(value) & 0xFFFF
+
+    start = time.perf_counter()
+    cycles = cpu.run(args.cycles)
+    seconds = time.perf_counter() - start
+
+    print("Ran {} cycles in {:.3f} s ({:.2f} M instructions/s){}".format(
+        cycles, seconds, cycles / seconds / 1e6 if seconds else 0,
+        ", halted at PC {}".format(cpu.pc) if cpu.halted else ''))
+    for address in args.dump:
+        print("RAM[{}] = {}".format(address, cpu.signed(address)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hack CPU emulator')
+    parser.add_argument('filepath', help='.hack or packed .hackb file to run')
+    parser.add_argument('-n', '--cycles', type=int, default=10000000,
+        help='stop after this many cycles if the program hasn\'t halted')
+    parser.add_argument('-s', '--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+        help='initial RAM contents')
+    parser.add_argument('-d', '--dump', type=int, nargs='*', default=[], metavar='ADDRESS',
+        help='RAM addresses to print once the program stops')
+    return parser.parse_args()
+
+def alu(c, x, y):
+    # The ALU as the hardware implements it, for any c1-c6 bits
+    zx, nx, zy, ny, f, no = [(c >> bit) & 1 for bit in range(5, -1, -1)]
+    if zx: x = 0
+    if nx: x ^= 0xFFFF
+    if zy: y = 0
+    if ny: y ^= 0xFFFF
+    out = (x + y) & 0xFFFF if f else x & y
+    if no: out ^= 0xFFFF
+    return out
+
+def alu_function(c):
+    if c in ALU:
+        return ALU[c]
+    return lambda x, y: alu(c, x, y)
+
+class DecodedROM:
+    # The program split up front into one NumPy array per instruction
+    # field, so the CPU never has to pick bits out of a word while running
+    def __init__(self, words):
+        words = np.asarray(words, dtype=np.uint16)
+        self.words = words
+        self.is_c = (words >> 15).astype(np.bool_)
+        self.value = words & 0x7FFF           # A-instruction value
+        self.a_bit = ((words >> 12) & 1).astype(np.bool_)
+        self.comp = (words >> 6) & 0x3F       # c1-c6
+        self.dest = (words >> 3) & 0x7
+        self.jump = words & 0x7
+
+        # Hack programs stop by jumping to themselves forever, normally with
+        # an '@X / 0;JMP' pair at address X. halts marks the 0;JMPs (that
+        # leave A alone, so nothing changes from one time round to the
+        # next) and loop_starts the address each one halts on when it jumps
+        # there: the pair's @X if it's just before, else the jump itself.
+        # Which address is actually jumped to is only known at runtime, see
+        # is_halt.
+        address = np.arange(len(words))
+        self.halts = self.is_c & (self.jump == 0b111) & (self.comp == 0b101010) & ((self.dest & 4) == 0)
+        previous_is_self = np.zeros(len(words), dtype=np.bool_)
+        previous_is_self[1:] = ~self.is_c[:-1] & (self.value[:-1] == address[:-1])
+        self.loop_starts = np.where(previous_is_self, address - 1, address)
+
+    def is_halt(self, address, target):
+        # Whether the jump at address, going to target, halts the program
+        return bool(self.halts[address]) and target in (address, int(self.loop_starts[address]))
+
+    def __len__(self):
+        return len(self.words)
+
+class HackCPU:
+    # Runs a Hack program. RAM is a uint16 NumPy array covering the whole
+    # 15-bit address space (so SCREEN and KBD are part of it); self.ram can
+    # be read and written between runs.
+    def __init__(self, words):
+        self.rom = DecodedROM(words)
+        self.ram = np.zeros(RAM_SIZE, dtype=np.uint16)
+        self.reset()
+
+    @classmethod
+    def load(cls, filepath):
+        return cls(hackfile.read_hack(filepath))
+
+    def reset(self):
+        # Same as the reset pin, RAM is left alone
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def signed(self, address):
+        return int(self.ram[address].astype(np.int16))
+
+    def run(self, max_cycles):
+        # Runs until the program halts (jumps to itself), runs off the end
+        # of the ROM, or max_cycles have passed. Returns the cycles run.
+        rom = self.rom
+        rom_size = len(rom)
+        # Python lists index far faster than NumPy arrays one item at a
+        # time, so the loop runs on list copies of the decoded fields and a
+        # memoryview of RAM (which writes straight through to the array)
+        is_c = rom.is_c.tolist()
+        values = rom.value.tolist()
+        a_bits = rom.a_bit.tolist()
+        alus = [alu_function(c) for c in range(64)]
+        alu_ops = [alus[c] for c in rom.comp.tolist()]
+        dests = rom.dest.tolist()
+        jumps = [JUMP_TAKEN[j] for j in rom.jump.tolist()]
+        halts = rom.halts.tolist()
+        loop_starts = rom.loop_starts.tolist()
+        ram = memoryview(self.ram)
+
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+        while cycles < max_cycles:
+            if pc >= rom_size:
+                self.halted = True
+                break
+            cycles += 1
+
+            if not is_c[pc]:
+                a = values[pc]
+                pc += 1
+                continue
+
+            address = a & 0x7FFF
+            out = alu_ops[pc](d, ram[address] if a_bits[pc] else a)
+
+            dest = dests[pc]
+            if dest:
+                if dest & 1:
+                    ram[address] = out
+                if dest & 2:
+                    d = out
+                if dest & 4:
+                    a_next = out
+                else:
+                    a_next = a
+            else:
+                a_next = a
+
+            if jumps[pc][0 if out == 0 else 1 if out < 0x8000 else 2]:
+                if halts[pc] and (a == pc or a == loop_starts[pc]):
+                    self.halted = True
+                    a = a_next
+                    break
+                pc = a # Jumps go to A as it was before this instruction
+            else:
+                pc += 1
+            a = a_next
+
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import array
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+import sys
+
+# Packed .hack images store the program as raw instruction words rather
+# than one line of '0'/'1' text per instruction.
+#
+# Layout (all little-endian):
+#   4 bytes   magic, b'HKPK'
+#   4 bytes   word count (uint32)
+#   8 bytes   source hash (first 8 bytes of SHA-256 of the .asm source)
+#   2 bytes   per instruction word (uint16)
+MAGIC = b'HKPK'
+HEADER = struct.Struct('<4sI8s')
+PACKED_EXTENSION = '.hackb'
+
+# Source maps are a sidecar to a .hack image giving the (file, line) each
+# ROM address was assembled from.
+#
+# Layout (all little-endian):
+#   4 bytes   magic, b'HKSM'
+#   4 bytes   address count (uint32)
+#   4 bytes   file count (uint32)
+#   4 bytes   per address, source line number (uint32)
+#   2 bytes   per address, index into the file names (uint16)
+#   then the file names, each a uint16 length and that many bytes of UTF-8
+SOURCE_MAP_MAGIC = b'HKSM'
+SOURCE_MAP_HEADER = struct.Struct('<4sII')
+SOURCE_MAP_EXTENSION = '.hackmap'
+
+# Number of words buffered between writes
+CHUNK_SIZE = 8192
+
+# Bytes read at a time when hashing a source file
+HASH_CHUNK_SIZE = 64 * 1024
+
+def source_hash(source):
+    if isinstance(source, str):
+        source = source.encode()
+    return hashlib.sha256(source).digest()[:8]
+
+def file_hash(filepath):
+    # Same as source_hash but reads the file in chunks
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as fp:
+        chunk = fp.read(HASH_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = fp.read(HASH_CHUNK_SIZE)
+    return digest.digest()[:8]
+
+def write_packed(fp, words, source_hash):
+    # words can be any iterable (e.g. a generator straight out of the
+    # assembler). They're written in chunks and the word count in the
+    # header is filled in at the end, so fp needs to be seekable.
+    header_position = fp.tell()
+    fp.write(HEADER.pack(MAGIC, 0, source_hash))
+
+    words = iter(words)
+    word_count = 0
+    while True:
+        chunk = array.array('H', itertools.islice(words, CHUNK_SIZE))
+        if not chunk:
+            break
+        if sys.byteorder == 'big':
+            chunk.byteswap()
+        fp.write(chunk.tobytes())
+        word_count += len(chunk)
+
+    end_position = fp.tell()
+    fp.seek(header_position)
+    fp.write(HEADER.pack(MAGIC, word_count, source_hash))
+    fp.seek(end_position)
+    return word_count
+
+def map_with_header(filepath, header, description):
+    # mmaps the file for reading. Files too short for the header get the
+    # same error as a bad magic number (mmap can't map an empty file).
+    with open(filepath, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size < header.size:
+            raise Exception("File {} is not {}".format(filepath, description))
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_packed(filepath):
+    # Returns (words, source_hash). The words are a uint16 memoryview
+    # straight onto the mmapped file, so nothing gets copied or parsed.
+    mapped = map_with_header(filepath, HEADER, 'a packed .hack image')
+
+    magic, word_count, hash_value = HEADER.unpack_from(mapped)
+    if magic != MAGIC:
+        raise Exception("File {} is not a packed .hack image".format(filepath))
+
+    end = HEADER.size + word_count * 2
+    if len(mapped) < end:
+        raise Exception("File {} is truncated".format(filepath))
+
+    words = memoryview(mapped)[HEADER.size:end].cast('H')
+    if sys.byteorder == 'big':
+        # Stored little-endian so swap into a copy on big-endian hosts
+        words = array.array('H', words)
+        words.byteswap()
+    return words, hash_value
+
+def read_text(filepath):
+    # Reads a regular text .hack file (one binary word per line)
+    with open(filepath) as fp:
+        return array.array('H', [int(line, 2) for line in fp if line.strip()])
+
+def read_hack(filepath):
+    # Loads the instruction words from either kind of .hack file
+    with open(filepath, 'rb') as fp:
+        is_packed = fp.read(len(MAGIC)) == MAGIC
+
+    if is_packed:
+        return read_packed(filepath)[0]
+    return read_text(filepath)
+
+def write_source_map(fp, filenames, line_numbers, file_indexes=None):
+    # file_indexes can be left out when everything came from one file
+    line_numbers = array.array('I', line_numbers)
+    if file_indexes is None:
+        file_indexes = array.array('H', bytes(2 * len(line_numbers)))
+    else:
+        file_indexes = array.array('H', file_indexes)
+    if sys.byteorder == 'big':
+        line_numbers.byteswap()
+        file_indexes.byteswap()
+
+    fp.write(SOURCE_MAP_HEADER.pack(SOURCE_MAP_MAGIC, len(line_numbers), len(filenames)))
+    fp.write(line_numbers.tobytes())
+    fp.write(file_indexes.tobytes())
+    for filename in filenames:
+        name = filename.encode()
+        fp.write(struct.pack('<H', len(name)))
+        fp.write(name)
+
+class SourceMap:
+    # Read-only view of a source map file. The line number and file index
+    # arrays are memoryviews onto the mmapped file, like read_packed.
+    def __init__(self, filepath):
+        mapped = map_with_header(filepath, SOURCE_MAP_HEADER, 'a source map')
+
+        magic, address_count, file_count = SOURCE_MAP_HEADER.unpack_from(mapped)
+        if magic != SOURCE_MAP_MAGIC:
+            raise Exception("File {} is not a source map".format(filepath))
+
+        view = memoryview(mapped)
+        position = SOURCE_MAP_HEADER.size
+        self.line_numbers = view[position:position + 4 * address_count].cast('I')
+        position += 4 * address_count
+        self.file_indexes = view[position:position + 2 * address_count].cast('H')
+        position += 2 * address_count
+
+        self.filenames = []
+        for _ in range(file_count):
+            (length,) = struct.unpack_from('<H', mapped, position)
+            position += 2
+            self.filenames.append(bytes(mapped[position:position + length]).decode())
+            position += length
+
+        if sys.byteorder == 'big':
+            self.line_numbers = array.array('I', self.line_numbers)
+            self.line_numbers.byteswap()
+            self.file_indexes = array.array('H', self.file_indexes)
+            self.file_indexes.byteswap()
+
+    def __len__(self):
+        return len(self.line_numbers)
+
+    def location(self, address):
+        # Returns (filename, line number) for a ROM address
+        return self.filenames[self.file_indexes[address]], self.line_numbers[address]
@@ -0,0 +1,256 @@
+import argparse
+import time
+from emulator import *
+
+# Python expression for each documented c1-c6 code, x is D and y is A or M
+ALU_EXPRESSIONS = {
+    0b101010: '0',
+    0b111111: '1',
+    0b111010: '0xFFFF',
+    0b001100: '{x}',
+    0b110000: '{y}',
+    0b001101: '{x} ^ 0xFFFF',
+    0b110001: '{y} ^ 0xFFFF',
+    0b001111: '-{x} & 0xFFFF',
+    0b110011: '-{y} & 0xFFFF',
+    0b011111: '({x} + 1) & 0xFFFF',
+    0b110111: '({y} + 1) & 0xFFFF',
+    0b001110: '({x} - 1) & 0xFFFF',
+    0b110010: '({y} - 1) & 0xFFFF',
+    0b000010: '({x} + {y}) & 0xFFFF',
+    0b010011: '({x} - {y}) & 0xFFFF',
+    0b000111: '({y} - {x}) & 0xFFFF',
+    0b000000: '{x} & {y}',
+    0b010101: '{x} | {y}',
+}
+
+# Condition on the ALU output for each jump, 'out' is replaced with
+# wherever the output was stored
+JUMP_CONDITIONS = [
+    None,
+    '0 < out < 0x8000', # JGT
+    'out == 0',         # JEQ
+    'out < 0x8000',     # JGE
+    'out >= 0x8000',    # JLT
+    'out != 0',         # JNE
+    'out == 0 or out >= 0x8000', # JLE
+    'True',             # JMP
+]
+
+# Following unconditional jumps stops once a block is this long
+MAX_BLOCK_LENGTH = 1000
+
+def main():
+    args = parse_args()
+    cpu = BlockJITCPU.load(args.filepath)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        cpu.ram[int(address)] = int(value) & 0xFFFF
+
+    start = time.perf_counter()
+    cycles = cpu.run(args.cycles)
+    seconds = time.perf_counter() - start
+
+    print("Ran {} cycles in {:.3f} s ({:.2f} M instructions/s, {} blocks translated){}".format(
+        cycles, seconds, cycles / seconds / 1e6 if seconds else 0, cpu.blocks_translated,
+        ", halted at PC {}".format(cpu.pc) if cpu.halted else ''))
+    for address in args.dump:
+        print("RAM[{}] = {}".format(address, cpu.signed(address)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hack CPU emulator with a basic block JIT')
+    parser.add_argument('filepath', help='.hack or packed .hackb file to run')
+    parser.add_argument('-n', '--cycles', type=int, default=100000000,
+        help='stop after this many cycles if the program hasn\'t halted')
+    parser.add_argument('-s', '--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+        help='initial RAM contents')
+    parser.add_argument('-d', '--dump', type=int, nargs='*', default=[], metavar='ADDRESS',
+        help='RAM addresses to print once the program stops')
+    return parser.parse_args()
+
+def translate_block(rom, start):
+    # Returns the Python source of a function running the block that
+    # starts at ROM address start, plus the block's length in cycles and
+    # the address of its last jump if that might halt the program (None
+    # otherwise). Whether it does depends on where it jumps to, so the
+    # caller has to check (see DecodedROM.is_halt). A block runs up to and
+    # including the next conditional or computed jump (or the end of the
+    # ROM); unconditional jumps to a constant address just carry on
+    # translating from there. So a block always runs to the end once
+    # entered and its cycle count is fixed.
+    #
+    # The function takes and returns the registers:
+    #   block(a, d, ram) -> (a, d, next_pc)
+    #
+    # A isn't stored after every instruction. While it holds a constant
+    # from an A-instruction, M accesses and jump targets use the constant
+    # directly; after A=A+1 or A=A-1 it's kept as an offset from the a
+    # variable. It's only written back when something else is put in A or
+    # the block returns.
+    lines = ['def block(a, d, ram):']
+    a_constant = None
+    a_offset = 0
+    address = start
+    length = 0
+    visited = set()
+    rom_size = len(rom)
+
+    def a_value():
+        if a_constant is not None:
+            return str(a_constant)
+        return offset_expression(a_offset, 0xFFFF)
+
+    def m():
+        if a_constant is not None:
+            return 'ram[{}]'.format(a_constant & 0x7FFF)
+        return 'ram[{}]'.format(offset_expression(a_offset, 0x7FFF))
+
+    while address < rom_size:
+        visited.add(address)
+        length += 1
+
+        if not rom.is_c[address]:
+            a_constant = int(rom.value[address])
+            address += 1
+            continue
+
+        comp = int(rom.comp[address])
+        dest = int(rom.dest[address])
+        jump = int(rom.jump[address])
+        a_bit = rom.a_bit[address]
+
+        if dest == 4 and not jump and not a_bit and comp in (0b110111, 0b110010):
+            # A=A+1 or A=A-1
+            step = 1 if comp == 0b110111 else -1
+            if a_constant is not None:
+                a_constant = (a_constant + step) & 0xFFFF
+            else:
+                a_offset += step
+            address += 1
+            continue
+
+        y = m() if a_bit else a_value()
+        if comp in ALU_EXPRESSIONS:
+            expression = ALU_EXPRESSIONS[comp].format(x='d', y=y)
+        else:
+            expression = 'alu({}, d, {})'.format(comp, y)
+
+        # The jump goes to A as it was before this instruction
+        target = a_value()
+        if jump and dest & 4 and a_constant is None:
+            lines.append('    target = {}'.format(target))
+            target = 'target'
+
+        # Chained assignments store left to right, so M is still written
+        # before A changes
+        destinations = [name for bit, name in [(1, m()), (2, 'd'), (4, 'a')] if dest & bit]
+        condition = None
+        if jump not in (0, 0b111):
+            if dest & 6:
+                output = destinations[-1]
+            elif expression in ('d', 'a'):
+                output = expression # D;JGT and the like
+            else:
+                output = 'out'
+                destinations.append(output)
+            condition = JUMP_CONDITIONS[jump].replace('out', output)
+        if destinations:
+            lines.append('    {} = {}'.format(' = '.join(destinations), expression))
+        if dest & 4:
+            a_constant = None
+            a_offset = 0
+
+        if not jump:
+            address += 1
+            continue
+        if rom.halts[address] and (not target.isdigit() or rom.is_halt(address, int(target))):
+            lines.append('    return {}, d, {}'.format(a_value(), target))
+            return '\n'.join(lines) + '\n', length, address
+        if (jump == 0b111 and target.isdigit() and int(target) not in visited
+                and length < MAX_BLOCK_LENGTH):
+            address = int(target)
+            continue
+
+        if jump == 0b111:
+            next_pc = target
+        else:
+            next_pc = '{} if {} else {}'.format(target, condition, address + 1)
+        lines.append('    return {}, d, {}'.format(a_value(), next_pc))
+        return '\n'.join(lines) + '\n', length, None
+
+    # Ran off the end of the ROM
+    lines.append('    return {}, d, {}'.format(a_value(), address))
+    return '\n'.join(lines) + '\n', length, None
+
+def offset_expression(offset, mask):
+    # a plus offset, masked to 16 bits for A's value or 15 for an address
+    if offset == 0:
+        return 'a' if mask == 0xFFFF else 'a & 0x7FFF'
+    return '(a {} {}) & 0x{:X}'.format('+' if offset > 0 else '-', abs(offset), mask)
+
+class BlockJITCPU(HackCPU):
+    # HackCPU that translates each basic block of the ROM into a Python
+    # function the first time it's reached, and from then on runs the
+    # whole block with one call. Blocks are cached by their start address.
+    def __init__(self, words):
+        super().__init__(words)
+        self.blocks = [None] * len(self.rom)
+        self.blocks_translated = 0
+
+    def translate(self, start):
+        # Returns (block function, length, halt_targets). halt_targets are
+        # the jump targets that mean the block's last jump halts, starting
+        # with the jump's own address, or None if it can't halt.
+        source, length, halt_address = translate_block(self.rom, start)
+        namespace = {'alu': alu}
+        exec(compile(source, '<hack block {}>'.format(start), 'exec'), namespace)
+        self.blocks_translated += 1
+        halt_targets = None
+        if halt_address is not None:
+            halt_targets = (halt_address, int(self.rom.loop_starts[halt_address]))
+        return namespace['block'], length, halt_targets
+
+    def run(self, max_cycles):
+        # Same behaviour as HackCPU.run, down to the cycle count. When fewer
+        # cycles are left than the next block needs, the interpreter runs
+        # the rest one instruction at a time.
+        blocks = self.blocks
+        rom_size = len(self.rom)
+        # Blocks run on a list copy of RAM since lists index about twice as
+        # fast as a memoryview, it's copied back when the run stops
+        ram = self.ram.tolist()
+
+        a, d, pc = self.a, self.d, self.pc
+        cycles = 0
+        while True:
+            if pc >= rom_size:
+                self.halted = True
+                break
+
+            block = blocks[pc]
+            if block is None:
+                block = blocks[pc] = self.translate(pc)
+            fn, length, halt_targets = block
+
+            if cycles + length > max_cycles:
+                self.ram[:] = ram
+                self.a, self.d, self.pc = a, d, pc
+                self.cycles += cycles
+                return cycles + HackCPU.run(self, max_cycles - cycles)
+
+            a, d, next_pc = fn(a, d, ram)
+            cycles += length
+            if halt_targets is not None and next_pc in halt_targets:
+                # Stopped on the jump, same as the interpreter
+                self.halted = True
+                pc = halt_targets[0]
+                break
+            pc = next_pc
+
+        self.ram[:] = ram
+        self.a, self.d, self.pc = a, d, pc
+        self.cycles += cycles
+        return cycles
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+# Programs for the CPU tests to run, shared between the test modules
+
+def random_program(rng, size):
+    # Any instruction at all: every comp code (documented or not), dest and
+    # jump, with A-instructions pointing into the ROM or low RAM
+    words = []
+    for _ in range(size):
+        if rng.random() < 0.4:
+            words.append(rng.randrange(size + 32))
+        else:
+            words.append(0b111 << 13 | rng.randrange(1 << 13))
+    return words
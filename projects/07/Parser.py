@@ -1,21 +1,28 @@
 import Constants
 
+def read_commands(filepath):
+    # The file's commands without blank lines and comments
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('//'):
+                continue
+            yield line
+
 class Parser:
+    # Commands are read from the file one at a time as they're asked for,
+    # with the next one read ahead so has_more_commands can answer
     def __init__(self, filepath):
-        self.commands = []
+        self.commands = read_commands(filepath)
+        self.next_command = next(self.commands, None)
         self.current_command = ''
-        with open(filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line == '' or line.startswith('//'):
-                    continue
-                self.commands.append(line)
 
     def has_more_commands(self):
-        return len(self.commands) > 0
+        return self.next_command is not None
 
     def advance(self):
-        self.current_command = self.commands.pop(0)
+        self.current_command = self.next_command
+        self.next_command = next(self.commands, None)
         self.parse_command()
 
     def parse_command(self):
@@ -30,11 +37,6 @@ class Parser:
             self.arg1 = command_parts[1]
             self.arg2 = int(command_parts[2])
 
-        print('Command type: ' + self.command_type)
-        print('Arg 1: ' + str(self.arg1))
-        print('Arg 2: ' + str(self.arg2))
-        print('Current command: ' + self.current_command)
-
     def get_command_type(self, command):
         command_types = {
             'add': Constants.C_ARITHMETIC,
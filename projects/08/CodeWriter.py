@@ -1,15 +1,131 @@
 import Constants
+import Peephole
+
+# Lines are collected in a buffer and written out in one go once there
+# are this many of them, and when the CodeWriter is closed
+FLUSH_LINES = 8192
+
+# Fixed instruction sequences, shared by every command that uses them
+INCREMENT_SP = (
+    '@SP', # SP++
+    'M=M+1',
+)
+
+DECREMENT_SP = (
+    '@SP', # SP--
+    'M=M-1',
+)
+
+D_EQUALS_STAR_SP = (
+    '@SP', # D = *SP
+    'A=M',
+    'D=M',
+)
+
+STAR_SP_EQUALS_STAR_ADDR = (
+    '@R13', # D = *addr
+    'A=M',
+    'D=M',
+
+    '@SP', # *SP = D
+    'A=M',
+    'M=D',
+)
+
+STAR_SP_EQUALS_NEG_STAR_SP = (
+    '@SP', # *SP = -*SP
+    'A=M',
+    'M=-M',
+)
+
+STAR_SP_EQUALS_NOT_STAR_SP = (
+    '@SP', # *SP = !*SP
+    'A=M',
+    'M=!M',
+)
+
+# Labels of the shared routines in compact mode. VM identifiers can't
+# contain '$', so these can't clash with the program's.
+CALL_ROUTINE = 'VM$CALL'
+RETURN_ROUTINE = 'VM$RETURN'
+END_LOOP = 'VM$END'
+COMPARISON_ROUTINES = {
+    'eq': 'VM$EQ',
+    'gt': 'VM$GT',
+    'lt': 'VM$LT',
+}
+
+OPERATORS = {
+    'add': '+',
+    'sub': '-',
+    'and': '&',
+    'or':  '|'
+}
+
+JUMP_TYPES = {
+    'gt': 'JGT',
+    'lt': 'JLT',
+    'eq': 'JEQ',
+}
+
+# The jump for a comparison followed by not
+NEGATED_JUMP_TYPES = {
+    'gt': 'JLE',
+    'lt': 'JGE',
+    'eq': 'JNE',
+}
+
+# Segments whose base address is held in a pointer
+POINTER_SEGMENTS = ['local', 'argument', 'this', 'that']
+
+SEGMENT_TYPES = {
+    'local': 'LCL',
+    'LCL': 'LCL',
+    'argument': 'ARG',
+    'ARG': 'ARG',
+    'temp': '5',
+    'this': 'THIS',
+    'THIS': 'THIS',
+    'that': 'THAT',
+    'THAT': 'THAT',
+}
 
 class CodeWriter:
-    def __init__(self, output_filepath):
+    # In compact mode, calls and returns jump to one shared call routine
+    # and one shared return routine, written at the end of the output,
+    # instead of inlining the whole frame setup and teardown at every
+    # call site and return. eq, gt and lt likewise each jump to a shared
+    # routine rather than inlining the compare.
+    #
+    # With optimize, buffered lines go through Peephole before they're
+    # written, and instruction_counts keeps the counts before and after
+    # for each VM file. instructions_written counts everything written.
+    #
+    # With scoped_labels, the labels the comparisons make up are numbered
+    # per file and start with the file's name, like return addresses, so
+    # each file's code doesn't depend on the files before it. That's what
+    # lets TranslationCache reuse it (see begin_fragment).
+    def __init__(self, output_filepath, compact=False, optimize=False, scoped_labels=False):
         self.output_file = open(output_filepath, 'w')
+        self.lines = []
+        self.optimize = optimize
+        self.instruction_counts = {}
+        self.instructions_written = 0
+        self.scoped_labels = scoped_labels
+        self.label_prefix = ''
+        self.fragment = None
         self.set_file_name(output_filepath)
 
         self.label_counter = 0
+        self.compact = compact
+        self.routines_needed = set()
 
     # Informs the CodeWriter that the translation of a new VM file
     # has started
     def set_file_name(self, filename):
+        # Write out the last file's code so it's counted for that file
+        self.flush()
+
         # Reset return counters since they are specific to a file
         self.return_label_counter = 1
 
@@ -17,6 +133,10 @@ class CodeWriter:
         filename = filename.split('/')[-1]
         self.filename_no_extension = filename.split(".")[0]
 
+        if self.scoped_labels:
+            self.label_counter = 0
+            self.label_prefix = self.filename_no_extension + '$'
+
     # Writes the assembly instructions that effect the bootstrap code
     # that initializes the VM. This code must be placed at the beginning
     # of the generated *.asm file
@@ -25,188 +145,301 @@ class CodeWriter:
         # SP = 256
         # call Sys.init
 
-        sp_equals_256 = [
+        self.lines.extend((
             '@256',
             'D=A',
             '@SP',
             'M=D'
-        ]
-        for line in sp_equals_256:
-            self.output_file.write(line + '\n')
+        ))
 
         self.write_call('Sys.init', 0)
 
     # Writes to the output_file the assembly code that implements the given
     # arithmetic command
     def write_arithmetic(self, command):
-        result = []
         if command in ['add', 'sub', 'and', 'or']:
-            result = self.convert_builtin_operator_command(command)
+            self.convert_builtin_operator_command(command, self.lines)
+        elif command in ['eq', 'gt', 'lt'] and self.compact:
+            self.convert_compact_comparison_command(command, self.lines)
+            self.need_routine(COMPARISON_ROUTINES[command])
         elif command in ['eq', 'gt', 'lt']:
-            result = self.convert_comparison_command(command)
+            self.convert_comparison_command(command, self.lines)
         elif command == 'neg':
-            result = self.convert_neg_command()
+            self.convert_neg_command(self.lines)
         elif command == 'not':
-            result = self.convert_not_command()
+            self.convert_not_command(self.lines)
         else:
             raise Exception("Command '{}' not handled".format(command))
-
-        for line in result:
-            self.output_file.write(line + '\n')
+        self.flush_if_full()
 
     # Writes to the output_file the assembly code that implements the given
     # command, where command is either C_PUSH or C_POP
     def write_push_pop(self, command, segment, index):
         if command == Constants.C_PUSH:
-            result = self.convert_push_command(command, segment, index)
+            self.convert_push_command(command, segment, index, self.lines)
         elif command == Constants.C_POP:
-            result = self.convert_pop_command(command, segment, index)
+            self.convert_pop_command(command, segment, index, self.lines)
         else:
             raise Exception("Command '{}' not handled".format(command))
-
-        for line in result:
-            self.output_file.write(line + '\n')
+        self.flush_if_full()
 
     # Writes assembly code that effects the label command.
     def write_label(self, label):
-        for line in self.convert_label_command(label):
-            self.output_file.write(line + '\n')
+        self.convert_label_command(label, self.lines)
+        self.flush_if_full()
 
     # Writes assembly code that effects the goto command.
     def write_goto(self, label):
-        for line in self.convert_goto_command(label):
-            self.output_file.write(line + '\n')
+        self.convert_goto_command(label, self.lines)
+        self.flush_if_full()
 
     # Writes assembly code that effects the if-goto command.
     def write_if(self, label):
-        for line in self.convert_if_goto_command(label):
-            self.output_file.write(line + '\n')
+        self.convert_if_goto_command(label, self.lines)
+        self.flush_if_full()
 
     # Writes assembly code that effects the function command.
     def write_function(self, function_name, num_vars):
-        for line in self.convert_function_command(function_name, num_vars):
-            self.output_file.write(line + '\n')
+        self.convert_function_command(function_name, num_vars, self.lines)
+        self.flush_if_full()
 
     # Writes assembly code that effects the call command.
     def write_call(self, function_name, num_args):
-        for line in self.convert_call_command(function_name, num_args):
-            self.output_file.write(line + '\n')
+        if self.compact:
+            self.convert_compact_call_command(function_name, num_args, self.lines)
+            self.need_routine(CALL_ROUTINE)
+        else:
+            self.convert_call_command(function_name, num_args, self.lines)
+        self.flush_if_full()
 
     # Writes assembly code that effects the return command.
     def write_return(self):
-        for line in self.convert_return_command():
-            self.output_file.write(line + '\n')
+        if self.compact:
+            self.convert_compact_return_command(self.lines)
+            self.need_routine(RETURN_ROUTINE)
+        else:
+            self.convert_return_command(self.lines)
+        self.flush_if_full()
+
+    # Writes assembly code for the fused commands VMOptimizer makes, see
+    # there for what each of them stands for
+
+    def write_move(self, source, destination):
+        self.convert_move_command(source, destination, self.lines)
+        self.flush_if_full()
+
+    def write_update(self, variable, operation):
+        self.convert_update_command(variable, operation, self.lines)
+        self.flush_if_full()
+
+    def write_arithmetic_constant(self, command, constant):
+        self.convert_arithmetic_constant_command(command, constant, self.lines)
+        self.flush_if_full()
+
+    def write_compare_if(self, label, comparison):
+        self.convert_compare_if_command(label, comparison, self.lines)
+        self.flush_if_full()
+
+    def need_routine(self, routine):
+        self.routines_needed.add(routine)
+        if self.fragment is not None:
+            self.fragment['routines'].add(routine)
+
+    # A fragment is the code for one VM file, as TranslationCache stores
+    # it: begin_fragment after set_file_name, translate the file, and
+    # end_fragment returns the fragment. write_fragment writes a stored
+    # one back out as if the file had just been translated.
+
+    def begin_fragment(self):
+        self.flush()
+        self.fragment = {'chunks': [], 'routines': set(), 'instructions': 0}
+
+    def end_fragment(self):
+        self.flush()
+        fragment = self.fragment
+        self.fragment = None
+        return {
+            'asm': ''.join(fragment['chunks']),
+            'routines': sorted(fragment['routines']),
+            'instructions': fragment['instructions'],
+            'instruction_counts': self.instruction_counts.get(self.filename_no_extension),
+        }
+
+    def write_fragment(self, fragment):
+        self.flush()
+        self.output_file.write(fragment['asm'])
+        self.routines_needed.update(fragment['routines'])
+        self.instructions_written += fragment['instructions']
+        if fragment['instruction_counts'] is not None:
+            counts = self.instruction_counts.setdefault(self.filename_no_extension, [0, 0])
+            counts[0] += fragment['instruction_counts'][0]
+            counts[1] += fragment['instruction_counts'][1]
+
+    # Writes the shared routines that compact calls and returns jump to
+    def write_routines(self):
+        if not self.routines_needed:
+            return
+        # Programs without Sys.init can run off the end of their code, stop
+        # them there rather than in the first routine
+        self.lines.extend((
+            "// end of program",
+            "({})".format(END_LOOP),
+            "@{}".format(END_LOOP),
+            '0;JMP',
+        ))
+        if CALL_ROUTINE in self.routines_needed:
+            self.convert_call_routine(self.lines)
+        if RETURN_ROUTINE in self.routines_needed:
+            self.convert_return_routine(self.lines)
+        for command, routine in COMPARISON_ROUTINES.items():
+            if routine in self.routines_needed:
+                self.convert_comparison_routine(command, self.lines)
+        self.routines_needed = set()
+
+    def flush_if_full(self):
+        if len(self.lines) >= FLUSH_LINES:
+            self.flush()
+
+    # Writes out the buffered lines
+    def flush(self, section=None):
+        if not self.lines:
+            return
+        lines = self.lines
+        if self.optimize:
+            lines = Peephole.optimize(lines)
+            counts = self.instruction_counts.setdefault(section or self.filename_no_extension, [0, 0])
+            counts[0] += Peephole.count_instructions(self.lines)
+            counts[1] += Peephole.count_instructions(lines)
+        instructions = Peephole.count_instructions(lines)
+        text = '\n'.join(lines) + '\n'
+        self.instructions_written += instructions
+        self.output_file.write(text)
+        if self.fragment is not None:
+            self.fragment['chunks'].append(text)
+            self.fragment['instructions'] += instructions
+        self.lines = []
+
+    # The convert_* methods append a command's lines to out and return it,
+    # a new list if out isn't given
 
     # Handle add, sub, and, or commands
     # Since they're all the same except for operator
-    def convert_builtin_operator_command(self, command_type):
-        return \
-            ["// {}".format(command_type)] + \
-            self.decrement_sp() + \
-            self.d_equals_star_sp() + \
-            self.decrement_sp() + \
-            self.star_sp_equals_star_sp_operator_d(command_type) + \
-            self.increment_sp()
-
-    def convert_neg_command(self):
-        return \
-            ['// neg'] + \
-            self.decrement_sp() + \
-            self.star_sp_equals_neg_star_sp() + \
-            self.increment_sp()
-
-    def convert_not_command(self):
-        return \
-            ['// not'] + \
-            self.decrement_sp() + \
-            self.star_sp_equals_not_star_sp() + \
-            self.increment_sp()
+    def convert_builtin_operator_command(self, command_type, out=None):
+        out = [] if out is None else out
+        out.append("// {}".format(command_type))
+        out.extend(DECREMENT_SP)
+        out.extend(D_EQUALS_STAR_SP)
+        out.extend(DECREMENT_SP)
+        self.star_sp_equals_star_sp_operator_d(command_type, out)
+        out.extend(INCREMENT_SP)
+        return out
+
+    def convert_neg_command(self, out=None):
+        out = [] if out is None else out
+        out.append('// neg')
+        out.extend(DECREMENT_SP)
+        out.extend(STAR_SP_EQUALS_NEG_STAR_SP)
+        out.extend(INCREMENT_SP)
+        return out
+
+    def convert_not_command(self, out=None):
+        out = [] if out is None else out
+        out.append('// not')
+        out.extend(DECREMENT_SP)
+        out.extend(STAR_SP_EQUALS_NOT_STAR_SP)
+        out.extend(INCREMENT_SP)
+        return out
 
     # Handle eq, gt, lt commands
     # Since they're all the same except for jump condition
-    def convert_comparison_command(self, command_type):
-        return \
-            ["// {}".format(command_type)] + \
-            self.decrement_sp() + \
-            self.d_equals_star_sp() + \
-            self.decrement_sp() + \
-            self.star_sp_equals_star_sp_command_d(command_type) + \
-            self.increment_sp()
-
-    def convert_push_segment(self, segment):
-        return \
-            ["// push {}".format(segment)] + \
-            self.star_sp_equals_segment(segment) + \
-            self.increment_sp()
-
-    def convert_push_command(self, command, segment, index):
+    def convert_comparison_command(self, command_type, out=None):
+        out = [] if out is None else out
+        out.append("// {}".format(command_type))
+        out.extend(DECREMENT_SP)
+        out.extend(D_EQUALS_STAR_SP)
+        out.extend(DECREMENT_SP)
+        self.star_sp_equals_star_sp_command_d(command_type, out)
+        out.extend(INCREMENT_SP)
+        return out
+
+    def convert_push_segment(self, segment, out=None):
+        out = [] if out is None else out
+        out.append("// push {}".format(segment))
+        self.star_sp_equals_segment(segment, out)
+        out.extend(INCREMENT_SP)
+        return out
+
+    def convert_push_command(self, command, segment, index, out=None):
+        out = [] if out is None else out
+        out.append("// {} {} {}".format(command, segment, index))
         if segment == "constant":
-            return \
-                ["// {} {} {}".format(command, segment, index)] + \
-                self.star_sp_equals_index(index) + \
-                self.increment_sp()
-
-        if segment == "pointer" or segment == "static":
-            return \
-                ["// {} {} {}".format(command, segment, index)] + \
-                self.star_sp_equals_segment(segment, index) + \
-                self.increment_sp()
-
-        return \
-            ["// {} {} {}".format(command, segment, index)] + \
-            self.addr_equals_segment_plus_i(segment, index) + \
-            self.star_sp_equals_star_addr() + \
-            self.increment_sp()
-
-    def convert_pop_command(self, command, segment, index):
+            self.star_sp_equals_index(index, out)
+        elif segment == "pointer" or segment == "static":
+            self.star_sp_equals_segment(segment, out, index)
+        else:
+            self.addr_equals_segment_plus_i(segment, index, out)
+            out.extend(STAR_SP_EQUALS_STAR_ADDR)
+        out.extend(INCREMENT_SP)
+        return out
+
+    def convert_pop_command(self, command, segment, index, out=None):
+        out = [] if out is None else out
+        out.append("// {} {} {}".format(command, segment, index))
         if segment == "pointer" or segment == "static":
-            return \
-                ["// {} {} {}".format(command, segment, index)] + \
-                self.decrement_sp() + \
-                self.segment_equals_star_sp(segment, index)
-
-        return \
-            ["// {} {} {}".format(command, segment, index)] + \
-            self.addr_equals_segment_plus_i(segment, index) + \
-            self.decrement_sp() + \
-            self.star_addr_equals_star_sp('R13') # Use R13 as temp storage
-
-    def convert_label_command(self, label):
-        return [
+            out.extend(DECREMENT_SP)
+            self.segment_equals_star_sp(segment, index, out)
+        else:
+            self.addr_equals_segment_plus_i(segment, index, out)
+            out.extend(DECREMENT_SP)
+            self.star_addr_equals_star_sp('R13', out) # Use R13 as temp storage
+        return out
+
+    def convert_label_command(self, label, out=None):
+        out = [] if out is None else out
+        out.extend((
             "// label {}".format(label),
             "({})".format(label)
-        ]
+        ))
+        return out
 
-    def convert_goto_command(self, label):
-        return [
+    def convert_goto_command(self, label, out=None):
+        out = [] if out is None else out
+        out.extend((
             "// goto {}".format(label),
             "@{}".format(label),
             '0;JMP',
-        ]
-
-    def convert_if_goto_command(self, label):
-        return \
-            ["// if-goto {}".format(label)] + \
-            self.decrement_sp() + \
-            self.d_equals_star_sp() + \
-            ["@{}".format(label),
-            'D;JNE']
-
-    def convert_function_command(self, function_name, num_vars):
-        result = \
-            ["// function {} {}".format(function_name, num_vars)] + \
-            ["({})".format(function_name)]
+        ))
+        return out
+
+    def convert_if_goto_command(self, label, out=None):
+        out = [] if out is None else out
+        out.append("// if-goto {}".format(label))
+        out.extend(DECREMENT_SP)
+        out.extend(D_EQUALS_STAR_SP)
+        out.extend((
+            "@{}".format(label),
+            'D;JNE'
+        ))
+        return out
+
+    def convert_function_command(self, function_name, num_vars, out=None):
+        out = [] if out is None else out
+        out.extend((
+            "// function {} {}".format(function_name, num_vars),
+            "({})".format(function_name)
+        ))
         for x in range(0, num_vars):
-            result += self.convert_push_command(Constants.C_PUSH, 'constant', 0)
-        return result
+            self.convert_push_command(Constants.C_PUSH, 'constant', 0, out)
+        return out
 
-    def convert_call_command(self, function_name, num_args):
+    def convert_call_command(self, function_name, num_args, out=None):
+        out = [] if out is None else out
         # Format for return address label is "Filename$ret.1"
         return_address_label = "{}$ret.{}".format(self.filename_no_extension, self.return_label_counter)
         self.return_label_counter += 1
 
-        return \
-            ["// call {} {}".format(function_name, num_args)] + [ \
+        out.extend((
+            "// call {} {}".format(function_name, num_args),
             "// push {}".format(return_address_label),
             "@{}".format(return_address_label),
             'D=A',
@@ -214,11 +447,13 @@ class CodeWriter:
             'A=M',
             'M=D',
             '@SP',
-            'M=M+1', ] + \
-            self.convert_push_segment('LCL') + \
-            self.convert_push_segment('ARG') + \
-            self.convert_push_segment('THIS') + \
-            self.convert_push_segment('THAT') + [ \
+            'M=M+1',
+        ))
+        self.convert_push_segment('LCL', out)
+        self.convert_push_segment('ARG', out)
+        self.convert_push_segment('THIS', out)
+        self.convert_push_segment('THAT', out)
+        out.extend((
             '// ARG = SP-5-nArgs', # Repositions ARG
             '@SP', # SP - 5 - nArgs
             'D=M',
@@ -233,14 +468,18 @@ class CodeWriter:
             '@SP',
             'D=M',
             '@LCL',
-            'M=D'] + \
-            self.convert_goto_command(function_name) + [ \
+            'M=D',
+        ))
+        self.convert_goto_command(function_name, out)
+        out.extend((
             '// (retAddrLabel)', # The same translator-gen label
             "({})".format(return_address_label),
-            ]
+        ))
+        return out
 
-    def convert_return_command(self):
-        expected = [
+    def convert_return_command(self, out=None):
+        out = [] if out is None else out
+        out.extend((
             '// return',
 
             '// endFrame = LCL', # endFrame is a temp var
@@ -248,50 +487,341 @@ class CodeWriter:
             'D=M',
             '@R13',  # Store endFrame here
             'M=D',
-            ] + \
-            self.addr_equals_star_addr_minus_offset('R14', 'retAddr', 'endFrame', 5) + \
-            ['// *ARG = pop()'] + \
-            self.decrement_sp() + \
-            self.star_addr_equals_star_sp('ARG') + [ \
-
+        ))
+        self.addr_equals_star_addr_minus_offset('R14', 'retAddr', 'endFrame', 5, out)
+        out.append('// *ARG = pop()')
+        out.extend(DECREMENT_SP)
+        self.star_addr_equals_star_sp('ARG', out)
+        out.extend((
             '// SP = ARG + 1', # reposition SP of caller
             '@ARG',
             'D=M+1',
             '@SP',
             'M=D',
-
-            ] + \
-            self.addr_equals_star_addr_minus_offset('THAT', 'THAT', 'endFrame', 1) + \
-            self.addr_equals_star_addr_minus_offset('THIS', 'THIS', 'endFrame', 2) + \
-            self.addr_equals_star_addr_minus_offset('ARG', 'ARG', 'endFrame', 3) + \
-            self.addr_equals_star_addr_minus_offset('LCL', 'LCL', 'endFrame', 4) + [ \
-
+        ))
+        self.addr_equals_star_addr_minus_offset('THAT', 'THAT', 'endFrame', 1, out)
+        self.addr_equals_star_addr_minus_offset('THIS', 'THIS', 'endFrame', 2, out)
+        self.addr_equals_star_addr_minus_offset('ARG', 'ARG', 'endFrame', 3, out)
+        self.addr_equals_star_addr_minus_offset('LCL', 'LCL', 'endFrame', 4, out)
+        out.extend((
             '// goto retAddr',
             '@R14', # retAddr stored here
             'A=M',
             '0;JMP',
-        ]
-        return expected
+        ))
+        return out
+
+    # Compact call: the call routine gets the return address in D, the
+    # function's address in R13 and nArgs in R14
+    def convert_compact_call_command(self, function_name, num_args, out=None):
+        out = [] if out is None else out
+        # Same return address labels as the inline version
+        return_address_label = "{}$ret.{}".format(self.filename_no_extension, self.return_label_counter)
+        self.return_label_counter += 1
+
+        out.extend((
+            "// call {} {}".format(function_name, num_args),
+            "@{}".format(function_name), # R13 = function
+            'D=A',
+            '@R13',
+            'M=D',
+        ))
+        if num_args <= 1:
+            out.extend((
+                '@R14', # R14 = nArgs
+                "M={}".format(num_args),
+            ))
+        else:
+            out.extend((
+                "@{}".format(num_args), # R14 = nArgs
+                'D=A',
+                '@R14',
+                'M=D',
+            ))
+        out.extend((
+            "@{}".format(return_address_label), # D = retAddr
+            'D=A',
+            "@{}".format(CALL_ROUTINE),
+            '0;JMP',
+            "({})".format(return_address_label),
+        ))
+        return out
+
+    def convert_compact_return_command(self, out=None):
+        out = [] if out is None else out
+        out.extend((
+            '// return',
+            "@{}".format(RETURN_ROUTINE),
+            '0;JMP',
+        ))
+        return out
+
+    # Compact comparison: the comparison routine gets the return address
+    # in D
+    def convert_compact_comparison_command(self, command_type, out=None):
+        out = [] if out is None else out
+        self.label_counter += 1
+        return_address_label = "{}compare.{}".format(self.label_prefix or 'VM$', self.label_counter)
+        out.extend((
+            "// {}".format(command_type),
+            "@{}".format(return_address_label), # D = retAddr
+            'D=A',
+            "@{}".format(COMPARISON_ROUTINES[command_type]),
+            '0;JMP',
+            "({})".format(return_address_label),
+        ))
+        return out
+
+    # Replaces the top two values with the comparison's result, keeping
+    # the return address in R15. Leaves the stack and RAM as the inline
+    # comparison does.
+    def convert_comparison_routine(self, command_type, out=None):
+        out = [] if out is None else out
+        routine = COMPARISON_ROUTINES[command_type]
+        out.extend((
+            "// {} routine: D = retAddr".format(command_type),
+            "({})".format(routine),
+            '@R15',
+            'M=D',
+        ))
+        out.extend(DECREMENT_SP)
+        out.extend(D_EQUALS_STAR_SP)
+        out.extend((
+            '@SP', # D = *(SP-1) - D
+            'A=M-1',
+            'D=M-D',
+            "@{}.TRUE".format(routine),
+            'D;' + self.get_jump_type(command_type),
+
+            '@SP',
+            'A=M-1',
+            'M=0', # false
+            '@R15',
+            'A=M',
+            '0;JMP',
+
+            "({}.TRUE)".format(routine),
+            '@SP',
+            'A=M-1',
+            'M=-1', # true
+            '@R15',
+            'A=M',
+            '0;JMP',
+        ))
+        return out
+
+    # Everything convert_call_command does after working out the return
+    # address, with the function and nArgs coming from R13 and R14
+    def convert_call_routine(self, out=None):
+        out = [] if out is None else out
+        out.extend((
+            '// call routine: D = retAddr, R13 = function, R14 = nArgs',
+            "({})".format(CALL_ROUTINE),
+            '// push retAddr',
+            '@SP',
+            'A=M',
+            'M=D',
+            '@SP',
+            'M=M+1',
+        ))
+        self.convert_push_segment('LCL', out)
+        self.convert_push_segment('ARG', out)
+        self.convert_push_segment('THIS', out)
+        self.convert_push_segment('THAT', out)
+        out.extend((
+            '// ARG = SP-5-nArgs', # Repositions ARG
+            '@SP', # SP - 5 - nArgs
+            'D=M',
+            '@5',
+            'D=D-A',
+            '@R14', # nArgs
+            'D=D-M',
+            '@ARG',
+            'M=D',
+
+            '// LCL = SP', # Repositions LCL
+            '@SP',
+            'D=M',
+            '@LCL',
+            'M=D',
+
+            '// goto function',
+            '@R13',
+            'A=M',
+            '0;JMP',
+        ))
+        return out
+
+    # The return routine is the inline return code, it doesn't depend on
+    # where it's returning from
+    def convert_return_routine(self, out=None):
+        out = [] if out is None else out
+        out.extend((
+            '// return routine',
+            "({})".format(RETURN_ROUTINE),
+        ))
+        self.convert_return_command(out)
+        return out
+
+    # push a i; pop b j without going through the stack
+    def convert_move_command(self, source, destination, out=None):
+        out = [] if out is None else out
+        out.append("// push {} {}; pop {} {}".format(*(source + destination)))
+        if self.address_needs_d(*destination):
+            self.r13_equals_address(*destination, out)
+            self.d_equals_segment(*source, out)
+            out.extend((
+                '@R13', # *addr = D
+                'A=M',
+                'M=D',
+            ))
+        else:
+            self.d_equals_segment(*source, out)
+            self.a_equals_address(*destination, out)
+            out.append('M=D')
+        return out
+
+    # push a i; push constant c; add (or sub); pop a i, updating a[i] in
+    # place
+    def convert_update_command(self, variable, operation, out=None):
+        out = [] if out is None else out
+        segment, index = variable
+        command, constant = operation
+        out.append("// push {0} {1}; push constant {3}; {2}; pop {0} {1}".format(segment, index, command, constant))
+        if constant == 1:
+            self.a_equals_address(segment, index, out)
+            out.append('M=M+1' if command == 'add' else 'M=M-1')
+            return out
+
+        if self.address_needs_d(segment, index):
+            self.r13_equals_address(segment, index, out)
+            out.extend((
+                "@{}".format(constant),
+                'D=A',
+                '@R13',
+                'A=M',
+            ))
+        else:
+            out.extend((
+                "@{}".format(constant),
+                'D=A',
+            ))
+            self.a_equals_address(segment, index, out)
+        out.append('M=D+M' if command == 'add' else 'M=M-D')
+        return out
+
+    # push constant c; add (or sub), on the top of the stack in place
+    def convert_arithmetic_constant_command(self, command, constant, out=None):
+        out = [] if out is None else out
+        out.append("// push constant {}; {}".format(constant, command))
+        if constant == 1:
+            out.extend((
+                '@SP', # *(SP-1) += 1
+                'A=M-1',
+                'M=M+1' if command == 'add' else 'M=M-1',
+            ))
+        else:
+            out.extend((
+                "@{}".format(constant),
+                'D=A',
+                '@SP', # *(SP-1) += c
+                'A=M-1',
+                'M=D+M' if command == 'add' else 'M=M-D',
+            ))
+        return out
+
+    # The comparison's operands (the top two values, or the top value and
+    # a constant) are popped and subtracted, and the result is jumped on
+    # directly instead of pushing true or false for if-goto to pop
+    def convert_compare_if_command(self, label, comparison, out=None):
+        out = [] if out is None else out
+        command, constant, negate = comparison
+        out.append("// {}{}{}; if-goto {}".format(
+            '' if constant is None else "push constant {}; ".format(constant),
+            command, '; not' if negate else '', label))
+        out.extend((
+            '@SP', # D = pop()
+            'AM=M-1',
+            'D=M',
+        ))
+        if constant is None:
+            out.extend((
+                '@SP', # D = pop() - D
+                'AM=M-1',
+                'D=M-D',
+            ))
+        elif constant != 0:
+            out.extend((
+                "@{}".format(constant), # D = D - c
+                'D=D-A',
+            ))
+        out.extend((
+            "@{}".format(label),
+            'D;' + (NEGATED_JUMP_TYPES if negate else JUMP_TYPES)[command],
+        ))
+        return out
+
+    def address_needs_d(self, segment, index):
+        # Whether a_equals_address needs D to get to segment[index]
+        return segment in POINTER_SEGMENTS and index > 1
+
+    def a_equals_address(self, segment, index, out):
+        # A = the address of segment[index]
+        if segment in POINTER_SEGMENTS:
+            base = '@' + self.get_segment_type(segment, index)
+            if index == 0:
+                out.extend((base, 'A=M'))
+            elif index == 1:
+                out.extend((base, 'A=M+1'))
+            else:
+                out.extend((
+                    '@' + str(index),
+                    'D=A',
+                    base,
+                    'A=D+M',
+                ))
+        elif segment == 'temp':
+            out.append('@' + str(5 + index))
+        else:
+            out.append('@' + self.get_segment_type(segment, index))
+
+    def r13_equals_address(self, segment, index, out):
+        out.extend((
+            '@' + self.get_segment_type(segment, index), # R13 = segment + i
+            'D=M',
+            '@' + str(index),
+            'D=D+A',
+            '@R13',
+            'M=D',
+        ))
 
-    def segment_equals_star_sp(self, segment, index):
-        return [
+    def d_equals_segment(self, segment, index, out):
+        # D = segment[index]
+        if segment == 'constant':
+            out.extend(('@' + str(index), 'D=A'))
+        else:
+            self.a_equals_address(segment, index, out)
+            out.append('D=M')
+
+    def segment_equals_star_sp(self, segment, index, out):
+        out.extend((
             '@SP', # D = *SP
             'A=M',
             'D=M',
 
             '@' + self.get_segment_type(segment, index), # segment = D
             'M=D'
-        ]
+        ))
 
-    def addr_equals_segment_plus_i(self, segment, index):
-        return [
+    def addr_equals_segment_plus_i(self, segment, index, out):
+        out.extend((
             '@' + self.get_segment_type(segment, index), # D = segment + i
             self.set_d(segment),
             '@' + str(index),
             'D=D+A',
             '@R13', # addr = D, store for later
             'M=D',
-        ]
+        ))
 
     def set_d(self, segment):
         # For temp segment we use value 5 (stored as address)
@@ -301,31 +831,8 @@ class CodeWriter:
         else:
             return 'D=M'
 
-    def increment_sp(self):
-        return [
-            '@SP', # SP++
-            'M=M+1',
-        ]
-
-    def decrement_sp(self):
-        return [
-            '@SP', # SP--
-            'M=M-1',
-        ]
-
-    def star_sp_equals_star_addr(self):
-        return [
-            '@R13', # D = *addr
-            'A=M',
-            'D=M',
-
-            '@SP', # *SP = D
-            'A=M',
-            'M=D',
-        ]
-
-    def star_addr_equals_star_sp(self, addr):
-        return [
+    def star_addr_equals_star_sp(self, addr, out):
+        out.extend((
             '@SP', # D = *SP
             'A=M',
             'D=M',
@@ -333,87 +840,66 @@ class CodeWriter:
             "@{}".format(addr),
             'A=M',
             'M=D',
-        ]
-
-    def star_sp_equals_neg_star_sp(self):
-        return [
-            '@SP', # *SP = -*SP
-            'A=M',
-            'M=-M',
-        ]
+        ))
 
-    def star_sp_equals_not_star_sp(self):
-        return [
-            '@SP', # *SP = !*SP
-            'A=M',
-            'M=!M',
-        ]
-
-    def star_sp_equals_index(self, index):
-        return [
+    def star_sp_equals_index(self, index, out):
+        out.extend((
             '@' + str(index), # *SP = i
             'D=A', # Get address value, not memory value
             '@SP',
             'A=M',
             'M=D',
-        ]
+        ))
 
-    def star_sp_equals_segment(self, segment, index=0):
-        return [
+    def star_sp_equals_segment(self, segment, out, index=0):
+        out.extend((
             '@' + self.get_segment_type(segment, index), # D = segment
             'D=M',
 
             '@SP', # *SP = D
             'A=M',
             'M=D',
-        ]
+        ))
 
-    def d_equals_star_sp(self):
-        return [
-            '@SP', # D = *SP
-            'A=M',
-            'D=M',
-        ]
-
-    def star_sp_equals_star_sp_operator_d(self, command_type):
-        return [
+    def star_sp_equals_star_sp_operator_d(self, command_type, out):
+        out.extend((
             '@SP', # *SP = *SP - D
             'A=M',
             'M=M' + self.get_operator(command_type) + 'D',
-        ]
+        ))
 
-    def star_sp_equals_star_sp_command_d(self, command_type):
+    def star_sp_equals_star_sp_command_d(self, command_type, out):
         # TODO: Less hacky way to ensure labels are unique?
         self.label_counter += 1
 
-        return [
+        out.extend((
             '@SP', # *SP = *SP - D
             'A=M',
             'M=M-D',
             'D=M', # if M > 0
 
-            "@SETTRUE{}".format(self.label_counter),
+            "@{}SETTRUE{}".format(self.label_prefix, self.label_counter),
             'D;' + self.get_jump_type(command_type),
 
-            "(SETFALSE{})".format(self.label_counter),
+            "({}SETFALSE{})".format(self.label_prefix, self.label_counter),
             '@SP',
             'A=M',
             'M=0', # false
-            "@FINISH{}".format(self.label_counter),
+            "@{}FINISH{}".format(self.label_prefix, self.label_counter),
             '0;JMP',
 
-            "(SETTRUE{})".format(self.label_counter),
+            "({}SETTRUE{})".format(self.label_prefix, self.label_counter),
             '@SP',
             'A=M',
             'M=-1', # true
-            "@FINISH{}".format(self.label_counter),
+            "@{}FINISH{}".format(self.label_prefix, self.label_counter),
             '0;JMP',
 
-            "(FINISH{})".format(self.label_counter),
-        ]
+            "({}FINISH{})".format(self.label_prefix, self.label_counter),
+        ))
 
-    def addr_equals_star_addr_minus_offset(self, target_addr, target_addr_symbol, source_addr, offset):
-        return [
+    def addr_equals_star_addr_minus_offset(self, target_addr, target_addr_symbol, source_addr, offset, out):
+        out.extend((
             # For example:
             #'// retAddr = *(endFrame - 5)', # gets ret address
             #'// THAT = *(endFrame - 1)', # restores THAT of caller
@@ -426,22 +912,13 @@ class CodeWriter:
             'D=M',
             "@{}".format(target_addr), # target_addr
             'M=D',
-        ]
+        ))
 
     def get_operator(self, command_type):
-        return {
-            'add': '+',
-            'sub': '-',
-            'and': '&',
-            'or':  '|'
-        }[command_type]
+        return OPERATORS[command_type]
 
     def get_jump_type(self, command_type):
-        return {
-            'gt': 'JGT',
-            'lt': 'JLT',
-            'eq': 'JEQ',
-        }[command_type]
+        return JUMP_TYPES[command_type]
 
     def get_segment_type(self, segment, index):
         if len(segment.split('.')) > 1:
@@ -452,22 +929,13 @@ class CodeWriter:
         if (segment == 'static'):
             return self.get_static_segment_type(segment, index)
 
-        segment_types = {
-            'local': 'LCL',
-            'LCL': 'LCL',
-            'argument': 'ARG',
-            'ARG': 'ARG',
-            'temp': '5',
-            'this': 'THIS',
-            'THIS': 'THIS',
-            'that': 'THAT',
-            'THAT': 'THAT',
-        }
-        return segment_types[segment]
+        return SEGMENT_TYPES[segment]
 
     def get_static_segment_type(self, segment, index):
         return "{}.{}".format(self.filename_no_extension, index)
 
     def close(self):
+        self.flush()
+        self.write_routines()
+        self.flush(section='(shared routines)')
         self.output_file.close()
-
@@ -1,3 +1,4 @@
+import os
 import unittest
 import colour_runner
 import CodeWriter
@@ -945,6 +946,213 @@ class TestCodeWriterFunctions(unittest.TestCase):
         self.assertEqual(result, expected)
 
 
+class TestCodeWriterCompact(unittest.TestCase):
+
+    def test_compact_call_command(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_compact_call_command('Function.test', 2)
+        expected = [
+            '// call Function.test 2',
+            '@Function.test', # R13 = function
+            'D=A',
+            '@R13',
+            'M=D',
+            '@2', # R14 = nArgs
+            'D=A',
+            '@R14',
+            'M=D',
+            '@Test$ret.1', # D = retAddr
+            'D=A',
+            '@VM$CALL',
+            '0;JMP',
+            '(Test$ret.1)',
+        ]
+        cw.close()
+        self.assertEqual(result, expected)
+
+    def test_compact_call_command_no_args(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_compact_call_command('Function.test', 0)
+        cw.close()
+        self.assertEqual(result[5:7], ['@R14', 'M=0'])
+
+    def test_compact_return_command(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_compact_return_command()
+        cw.close()
+        self.assertEqual(result, ['// return', '@VM$RETURN', '0;JMP'])
+
+    def test_routines_written_once_at_end(self):
+        cw = CodeWriter.CodeWriter('Test.asm', compact=True)
+        cw.write_init()
+        cw.write_function('Sys.init', 0)
+        cw.write_call('Main.main', 0)
+        cw.write_return()
+        cw.write_return()
+        cw.close()
+        with open('Test.asm') as f:
+            lines = f.read().splitlines()
+        os.remove('Test.asm')
+
+        self.assertEqual(lines.count('(VM$CALL)'), 1)
+        self.assertEqual(lines.count('(VM$RETURN)'), 1)
+        self.assertEqual(lines.count('@VM$CALL'), 2)
+        self.assertEqual(lines.count('@VM$RETURN'), 2)
+        # After all the program's code, so nothing falls into them
+        self.assertGreater(lines.index('(VM$CALL)'), lines.index('(Test$ret.1)'))
+        # The return routine is the inline return code
+        cw = CodeWriter.CodeWriter('Test.vm')
+        return_routine = lines[lines.index('(VM$RETURN)') + 1:]
+        self.assertEqual(return_routine, cw.convert_return_command())
+        cw.close()
+
+    def test_compact_comparison(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_compact_comparison_command('gt')
+        cw.close()
+        self.assertEqual(result, [
+            '// gt',
+            '@VM$compare.1', # D = retAddr
+            'D=A',
+            '@VM$GT',
+            '0;JMP',
+            '(VM$compare.1)',
+        ])
+
+    def test_comparison_routine(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_comparison_routine('lt')
+        cw.close()
+        self.assertEqual(result[1:4], ['(VM$LT)', '@R15', 'M=D'])
+        self.assertIn('D;JLT', result)
+        self.assertEqual(result.count('(VM$LT.TRUE)'), 1)
+
+    def test_comparison_routines_only_when_used(self):
+        cw = CodeWriter.CodeWriter('Test.asm', compact=True)
+        for command in ['eq', 'lt', 'eq']:
+            cw.write_arithmetic(command)
+        cw.close()
+        with open('Test.asm') as f:
+            lines = f.read().splitlines()
+        os.remove('Test.asm')
+
+        self.assertEqual(lines.count('(VM$EQ)'), 1)
+        self.assertEqual(lines.count('(VM$LT)'), 1)
+        self.assertNotIn('(VM$GT)', lines)
+        self.assertNotIn('(VM$CALL)', lines)
+        # The program stops before the routines
+        self.assertLess(lines.index('(VM$END)'), lines.index('(VM$EQ)'))
+
+    def test_call_routine(self):
+        cw = CodeWriter.CodeWriter('Test.vm', compact=True)
+        result = cw.convert_call_routine()
+        inline = cw.convert_call_command('Function.test', 3)
+        cw.close()
+        self.assertEqual(result[1], '(VM$CALL)')
+        # Pushes the same frame as the inline call, from D rather than a
+        # constant return address
+        self.assertEqual(result[3:7], ['@SP', 'A=M', 'M=D', '@SP'])
+        self.assertEqual(result[8], '// push LCL')
+        self.assertEqual(result[8:40], inline[9:41])
+        self.assertEqual(result[-3:], ['@R13', 'A=M', '0;JMP'])
+
+class TestCodeWriterFused(unittest.TestCase):
+
+    def test_move_to_pointer_segment(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        result = cw.convert_move_command(('temp', 0), ('that', 0))
+        expected = [
+            '// push temp 0; pop that 0',
+            '@5', # D = temp 0
+            'D=M',
+            '@THAT', # that 0 = D
+            'A=M',
+            'M=D',
+        ]
+        cw.close()
+        self.assertEqual(result, expected)
+
+    def test_move_to_computed_address(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        result = cw.convert_move_command(('static', 1), ('local', 3))
+        expected = [
+            '// push static 1; pop local 3',
+            '@LCL', # R13 = LCL + 3
+            'D=M',
+            '@3',
+            'D=D+A',
+            '@R13',
+            'M=D',
+            '@Test.1', # D = static 1
+            'D=M',
+            '@R13', # *R13 = D
+            'A=M',
+            'M=D',
+        ]
+        cw.close()
+        self.assertEqual(result, expected)
+
+    def test_update(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        self.assertEqual(cw.convert_update_command(('local', 1), ('add', 1)), [
+            '// push local 1; push constant 1; add; pop local 1',
+            '@LCL',
+            'A=M+1',
+            'M=M+1',
+        ])
+        self.assertEqual(cw.convert_update_command(('argument', 2), ('sub', 5)), [
+            '// push argument 2; push constant 5; sub; pop argument 2',
+            '@ARG',
+            'D=M',
+            '@2',
+            'D=D+A',
+            '@R13',
+            'M=D',
+            '@5',
+            'D=A',
+            '@R13',
+            'A=M',
+            'M=M-D',
+        ])
+        cw.close()
+
+    def test_arithmetic_constant(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        result = cw.convert_arithmetic_constant_command('add', 16)
+        expected = [
+            '// push constant 16; add',
+            '@16',
+            'D=A',
+            '@SP', # *(SP-1) += c
+            'A=M-1',
+            'M=D+M',
+        ]
+        cw.close()
+        self.assertEqual(result, expected)
+
+    def test_compare_if(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        self.assertEqual(cw.convert_compare_if_command('WHILE_END0', ('lt', None, True)), [
+            '// lt; not; if-goto WHILE_END0',
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            '@SP',
+            'AM=M-1',
+            'D=M-D',
+            '@WHILE_END0',
+            'D;JGE',
+        ])
+        self.assertEqual(cw.convert_compare_if_command('IF_TRUE0', ('eq', 0, False)), [
+            '// push constant 0; eq; if-goto IF_TRUE0',
+            '@SP',
+            'AM=M-1',
+            'D=M',
+            '@IF_TRUE0',
+            'D;JEQ',
+        ])
+        cw.close()
+
 
 #if __name__ == '__main__':
 #    unittest.main()
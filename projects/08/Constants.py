@@ -7,3 +7,62 @@ C_IF = 'C_IF'
 C_FUNCTION = 'C_FUNCTION'
 C_CALL = 'C_CALL'
 C_RETURN = 'C_RETURN'
+
+# Fused commands, made by VMOptimizer out of several of the above
+C_MOVE = 'C_MOVE'                               # push a i; pop b j
+C_UPDATE = 'C_UPDATE'                           # push a i; push constant c; add/sub; pop a i
+C_ARITHMETIC_CONSTANT = 'C_ARITHMETIC_CONSTANT' # push constant c; add/sub
+C_COMPARE_IF = 'C_COMPARE_IF'                   # [push constant c;] eq/gt/lt; [not;] if-goto l
+
+# Integer opcodes for decoded programs (see Parser.decode)
+OP_ADD = 0
+OP_SUB = 1
+OP_NEG = 2
+OP_EQ = 3
+OP_GT = 4
+OP_LT = 5
+OP_AND = 6
+OP_OR = 7
+OP_NOT = 8
+OP_PUSH = 9
+OP_POP = 10
+OP_LABEL = 11
+OP_GOTO = 12
+OP_IF = 13
+OP_FUNCTION = 14
+OP_CALL = 15
+OP_RETURN = 16
+
+OPCODES = {
+    'add': OP_ADD,
+    'sub': OP_SUB,
+    'neg': OP_NEG,
+    'eq': OP_EQ,
+    'gt': OP_GT,
+    'lt': OP_LT,
+    'and': OP_AND,
+    'or': OP_OR,
+    'not': OP_NOT,
+    'push': OP_PUSH,
+    'pop': OP_POP,
+    'label': OP_LABEL,
+    'goto': OP_GOTO,
+    'if-goto': OP_IF,
+    'function': OP_FUNCTION,
+    'call': OP_CALL,
+    'return': OP_RETURN,
+}
+
+# Segment ids, indexes into SEGMENTS
+SEG_NONE = 0
+SEG_CONSTANT = 1
+SEG_LOCAL = 2
+SEG_ARGUMENT = 3
+SEG_THIS = 4
+SEG_THAT = 5
+SEG_POINTER = 6
+SEG_TEMP = 7
+SEG_STATIC = 8
+
+SEGMENTS = [None, 'constant', 'local', 'argument', 'this', 'that', 'pointer', 'temp', 'static']
+SEGMENT_IDS = {segment: i for i, segment in enumerate(SEGMENTS) if segment}
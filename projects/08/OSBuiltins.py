@@ -0,0 +1,229 @@
+import math
+
+# Native Python versions of the hottest tools/OS functions, for
+# VMEmulator. Each one takes the emulator and the call's arguments (as
+# unsigned 16-bit values) and returns the function's return value. They
+# do exactly what the VM code does to the heap, the screen and the OS
+# statics; what they don't reproduce is the VM code's scratch memory
+# (temp 0, the stack above SP, Math's internal arrays), which callers
+# never read.
+#
+# Where the VM code would call Sys.error (division by zero, a pixel off
+# the screen, the heap running out...) a builtin returns None instead,
+# and the emulator runs the VM version so the error is reported the
+# usual way. Builtins check for that before changing anything.
+
+def signed(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+def math_abs(vm, x):
+    return -x & 0xFFFF if x & 0x8000 else x
+
+def math_multiply(vm, x, y):
+    if x == 0x8000 or y == 0x8000:
+        return None # Math.abs can't make -32768 positive, leave it to the VM code
+    return (signed(x) * signed(y)) & 0xFFFF
+
+def math_divide(vm, x, y):
+    if y == 0 or x == 0x8000 or y == 0x8000:
+        return None
+    x, y = signed(x), signed(y)
+    quotient = abs(x) // abs(y)
+    return (-quotient if (x < 0) != (y < 0) else quotient) & 0xFFFF
+
+def math_sqrt(vm, x):
+    if x & 0x8000:
+        return None
+    return math.isqrt(x)
+
+def math_max(vm, x, y):
+    return x if signed(x) > signed(y) else y
+
+def math_min(vm, x, y):
+    return x if signed(x) < signed(y) else y
+
+def memory_peek(vm, address):
+    return vm.ram[address & 0x7FFF]
+
+def memory_poke(vm, address, value):
+    vm.ram[address & 0x7FFF] = value
+    return 0
+
+def memory_alloc(vm, size):
+    # First fit over the free list, each block is (size, next) followed
+    # by its memory
+    ram = vm.ram
+    size = signed(size)
+    if size < 1:
+        return None
+    block = 2048
+    while signed(ram[block]) < size:
+        block = ram[block + 1]
+    if block + size > 16379:
+        return None
+
+    if signed(ram[block]) > size + 2:
+        # Split the rest off as a new free block
+        ram[block + size + 2] = (ram[block] - size - 2) & 0xFFFF
+        if ram[block + 1] == block + 2:
+            ram[block + size + 3] = block + size + 4
+        else:
+            ram[block + size + 3] = ram[block + 1]
+        ram[block + 1] = block + size + 2
+    ram[block] = 0
+    return block + 2
+
+def memory_de_alloc(vm, address):
+    ram = vm.ram
+    block = (address - 2) & 0xFFFF
+    next_block = ram[block + 1]
+    if ram[next_block] == 0:
+        ram[block] = (ram[block + 1] - block - 2) & 0xFFFF
+    else:
+        ram[block] = (ram[block + 1] - block + ram[next_block]) & 0xFFFF
+        if ram[next_block + 1] == next_block + 2:
+            ram[block + 1] = block + 2
+        else:
+            ram[block + 1] = ram[next_block + 1]
+    return 0
+
+def array_new(vm, size):
+    if signed(size) <= 0:
+        return None
+    return memory_alloc(vm, size)
+
+def array_dispose(vm, array):
+    return memory_de_alloc(vm, array)
+
+# A String is (max length, character array, length)
+
+def string_dispose(vm, string):
+    ram = vm.ram
+    if signed(ram[string]) > 0:
+        memory_de_alloc(vm, ram[string + 1])
+    return memory_de_alloc(vm, string)
+
+def string_length(vm, string):
+    return vm.ram[string + 2]
+
+def string_index_ok(vm, string, j):
+    return 0 <= signed(j) < signed(vm.ram[string + 2])
+
+def string_char_at(vm, string, j):
+    if not string_index_ok(vm, string, j):
+        return None
+    return vm.ram[(vm.ram[string + 1] + j) & 0x7FFF]
+
+def string_set_char_at(vm, string, j, c):
+    if not string_index_ok(vm, string, j):
+        return None
+    vm.ram[(vm.ram[string + 1] + j) & 0x7FFF] = c
+    return 0
+
+def string_append_char(vm, string, c):
+    ram = vm.ram
+    length = ram[string + 2]
+    if length == ram[string]:
+        return None
+    ram[(ram[string + 1] + length) & 0x7FFF] = c
+    ram[string + 2] = (length + 1) & 0xFFFF
+    return string
+
+def string_erase_last_char(vm, string):
+    ram = vm.ram
+    if ram[string + 2] == 0:
+        return None
+    ram[string + 2] = (ram[string + 2] - 1) & 0xFFFF
+    return 0
+
+def string_new_line(vm):
+    return 128
+
+def string_back_space(vm):
+    return 129
+
+def string_double_quote(vm):
+    return 34
+
+# Screen's statics: 0 is the powers of two array, 1 the screen's base
+# address and 2 the colour (true for black)
+
+def screen_static(vm, index):
+    return vm.ram[vm.statics[('Screen', index)]]
+
+def screen_clear_screen(vm):
+    base = screen_static(vm, 1)
+    vm.ram[base:base + 8192] = [0] * 8192
+    return 0
+
+def screen_set_color(vm, color):
+    vm.ram[vm.statics[('Screen', 2)]] = color
+    return 0
+
+def screen_update_location(vm, address, mask):
+    ram = vm.ram
+    address = (screen_static(vm, 1) + address) & 0x7FFF
+    if screen_static(vm, 2):
+        ram[address] |= mask
+    else:
+        ram[address] &= mask ^ 0xFFFF
+    return 0
+
+def screen_draw_pixel(vm, x, y):
+    x, y = signed(x), signed(y)
+    if not (0 <= x <= 511 and 0 <= y <= 255):
+        return None
+    powers = screen_static(vm, 0)
+    return screen_update_location(vm, y * 32 + x // 16, vm.ram[powers + x % 16])
+
+def screen_draw_rectangle(vm, x1, y1, x2, y2):
+    x1, y1, x2, y2 = signed(x1), signed(y1), signed(x2), signed(y2)
+    if x1 > x2 or y1 > y2 or x1 < 0 or x2 > 511 or y1 < 0 or y2 > 255:
+        return None
+    ram = vm.ram
+    powers = screen_static(vm, 0)
+    first_word, last_word = x1 // 16, x2 // 16
+    # Bits from x1 on in the first word, up to x2 in the last one
+    first_mask = (ram[powers + x1 % 16] - 1) & 0xFFFF ^ 0xFFFF
+    last_mask = (ram[powers + x2 % 16 + 1] - 1) & 0xFFFF
+    width = last_word - first_word
+
+    for y in range(y1, y2 + 1):
+        address = y * 32 + first_word
+        if width == 0:
+            screen_update_location(vm, address, first_mask & last_mask)
+            continue
+        screen_update_location(vm, address, first_mask)
+        for middle in range(address + 1, address + width):
+            screen_update_location(vm, middle, 0xFFFF)
+        screen_update_location(vm, address + width, last_mask)
+    return 0
+
+BUILTINS = {
+    'Math.abs': math_abs,
+    'Math.multiply': math_multiply,
+    'Math.divide': math_divide,
+    'Math.sqrt': math_sqrt,
+    'Math.max': math_max,
+    'Math.min': math_min,
+    'Memory.peek': memory_peek,
+    'Memory.poke': memory_poke,
+    'Memory.alloc': memory_alloc,
+    'Memory.deAlloc': memory_de_alloc,
+    'Array.new': array_new,
+    'Array.dispose': array_dispose,
+    'String.dispose': string_dispose,
+    'String.length': string_length,
+    'String.charAt': string_char_at,
+    'String.setCharAt': string_set_char_at,
+    'String.appendChar': string_append_char,
+    'String.eraseLastChar': string_erase_last_char,
+    'String.newLine': string_new_line,
+    'String.backSpace': string_back_space,
+    'String.doubleQuote': string_double_quote,
+    'Screen.clearScreen': screen_clear_screen,
+    'Screen.setColor': screen_set_color,
+    'Screen.updateLocation': screen_update_location,
+    'Screen.drawPixel': screen_draw_pixel,
+    'Screen.drawRectangle': screen_draw_rectangle,
+}
@@ -0,0 +1,146 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import OSBuiltins
+import VMEmulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEVEN = os.path.join(HERE, '..', '11', 'Seven')
+# A program with its own Math and Screen classes, Screen keeping its
+# statics in a different order from tools/OS
+OWN_CLASSES = {
+    'Sys.vm': [
+        'function Sys.init 0',
+        'push constant 6', 'push constant 7', 'call Math.multiply 2', 'pop temp 0',
+        'push constant 0', 'call Screen.setColor 1', 'pop temp 1',
+        'call Sys.halt 0',
+        'function Sys.halt 0', 'label LOOP', 'goto LOOP',
+    ],
+    'Math.vm': ['function Math.multiply 0', 'push argument 0', 'push argument 1', 'add', 'return'],
+    'Screen.vm': ['function Screen.setColor 0', 'push argument 0', 'not', 'pop static 0',
+        'push constant 0', 'return'],
+}
+EDGE_VALUES = [0, 1, -1, 2, -2, 15, 16, 17, 181, 182, 255, 256, 32767, -32767, -32768]
+
+def load_os(builtins=None):
+    # The OS plus a Main to satisfy Sys.init, with the OS classes that
+    # builtins depend on initialized
+    filepaths = VMEmulator.find_vm_files([SEVEN])
+    vm = VMEmulator.VMEmulator(filepaths + VMEmulator.os_vm_files(filepaths), builtins)
+    vm.ram[VMEmulator.SP] = VMEmulator.STACK
+    for function_name in ['Memory.init', 'Math.init', 'Screen.init']:
+        vm.call_function(function_name)
+    return vm
+
+class TestOSBuiltins(unittest.TestCase):
+    # Each builtin against the VM code it replaces, run on a second copy of
+    # the same machine
+
+    def setUp(self):
+        self.rng = random.Random(0)
+        self.vm = load_os()
+        self.native = load_os()
+
+    def assertSameAsVM(self, function_name, *args):
+        expected = self.vm.call_function(function_name, *args)
+        result = OSBuiltins.BUILTINS[function_name](self.native, *[arg & 0xFFFF for arg in args])
+        self.assertEqual(result, expected, (function_name, args))
+
+    def random_values(self, count, low=-32767, high=32767):
+        return [self.rng.randint(low, high) for _ in range(count)]
+
+    def test_math(self):
+        values = EDGE_VALUES + self.random_values(40)
+        pairs = [(x, y) for x in EDGE_VALUES for y in EDGE_VALUES]
+        pairs += list(zip(self.random_values(200), self.random_values(200)))
+        pairs += list(zip(self.random_values(100, -200, 200), self.random_values(100, -200, 200)))
+        for x in values:
+            self.assertSameAsVM('Math.abs', x)
+            if x >= 0:
+                self.assertSameAsVM('Math.sqrt', x)
+        for x, y in pairs:
+            self.assertSameAsVM('Math.min', x, y)
+            self.assertSameAsVM('Math.max', x, y)
+            if -32768 not in (x, y):
+                self.assertSameAsVM('Math.multiply', x, y)
+                if y != 0:
+                    self.assertSameAsVM('Math.divide', x, y)
+
+    def test_declines_errors(self):
+        native = self.native
+        self.assertIsNone(OSBuiltins.math_divide(native, 5, 0))
+        self.assertIsNone(OSBuiltins.math_multiply(native, 0x8000, 3))
+        self.assertIsNone(OSBuiltins.math_sqrt(native, 0xFFFF))
+        self.assertIsNone(OSBuiltins.memory_alloc(native, 0))
+        self.assertIsNone(OSBuiltins.screen_draw_pixel(native, 512, 0))
+
+    def test_memory(self):
+        blocks = []
+        for _ in range(300):
+            if blocks and self.rng.random() < 0.4:
+                block = blocks.pop(self.rng.randrange(len(blocks)))
+                self.assertSameAsVM('Memory.deAlloc', block)
+            else:
+                size = self.rng.choice([1, 2, 3, 10, 100])
+                expected = self.vm.call_function('Memory.alloc', size)
+                self.assertEqual(OSBuiltins.memory_alloc(self.native, size), expected)
+                blocks.append(expected)
+        self.assertEqual(self.native.ram[2048:16384], self.vm.ram[2048:16384])
+
+    def test_strings(self):
+        string = self.vm.call_function('String.new', 5)
+        self.assertEqual(self.native.call_function('String.new', 5), string)
+        for c in b'abc':
+            self.assertSameAsVM('String.appendChar', string, c)
+        self.assertSameAsVM('String.length', string)
+        self.assertSameAsVM('String.charAt', string, 1)
+        self.assertSameAsVM('String.setCharAt', string, 2, ord('z'))
+        self.assertSameAsVM('String.eraseLastChar', string)
+        self.assertSameAsVM('String.newLine')
+        self.assertSameAsVM('String.dispose', string)
+        self.assertEqual(self.native.ram[2048:16384], self.vm.ram[2048:16384])
+
+    def test_screen(self):
+        for color in [-1, 0, -1]:
+            self.assertSameAsVM('Screen.setColor', color)
+            for _ in range(20):
+                self.assertSameAsVM('Screen.drawPixel', self.rng.randrange(512), self.rng.randrange(256))
+            for _ in range(10):
+                x1, x2 = sorted(self.rng.randrange(512) for _ in range(2))
+                y1, y2 = sorted(self.rng.randrange(256) for _ in range(2))
+                self.assertSameAsVM('Screen.drawRectangle', x1, y1, x2, y2)
+        self.assertSameAsVM('Screen.drawRectangle', 16, 0, 31, 3) # Exactly one word wide
+        self.assertEqual(self.native.ram[16384:24576], self.vm.ram[16384:24576])
+        self.assertSameAsVM('Screen.clearScreen')
+        self.assertEqual(self.native.ram[16384:24576], [0] * 8192)
+
+    def test_program_output_unchanged(self):
+        # Seven prints 7 on the screen
+        filepaths = VMEmulator.find_vm_files([SEVEN])
+        filepaths += VMEmulator.os_vm_files(filepaths)
+        vm = VMEmulator.VMEmulator(filepaths)
+        native = VMEmulator.VMEmulator(filepaths, OSBuiltins.BUILTINS)
+        for machine in [vm, native]:
+            machine.bootstrap()
+            machine.run(10000000)
+            self.assertTrue(machine.halted)
+        self.assertEqual(native.ram[16384:24576], vm.ram[16384:24576])
+        self.assertLess(native.steps, vm.steps / 5)
+
+    def test_program_classes_not_replaced(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for name, lines in OWN_CLASSES.items():
+                with open(os.path.join(tmpdir, name), 'w') as fp:
+                    fp.write('\n'.join(lines) + '\n')
+            vm = VMEmulator.VMEmulator(VMEmulator.find_vm_files([tmpdir]), OSBuiltins.BUILTINS)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(vm.builtin_calls, [])
+        vm.bootstrap()
+        vm.run(1000)
+        self.assertTrue(vm.halted)
+        self.assertEqual(vm.ram[5], 13)
+        self.assertEqual(vm.ram[VMEmulator.STATIC], 0xFFFF)
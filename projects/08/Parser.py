@@ -1,26 +1,56 @@
+from array import array
 import Constants
 
+COMMAND_TYPES = {
+    'add': Constants.C_ARITHMETIC,
+    'sub': Constants.C_ARITHMETIC,
+    'neg': Constants.C_ARITHMETIC,
+    'eq': Constants.C_ARITHMETIC,
+    'gt': Constants.C_ARITHMETIC,
+    'lt': Constants.C_ARITHMETIC,
+    'and': Constants.C_ARITHMETIC,
+    'or': Constants.C_ARITHMETIC,
+    'not': Constants.C_ARITHMETIC,
+    'push': Constants.C_PUSH,
+    'pop': Constants.C_POP,
+    'label': Constants.C_LABEL,
+    'goto': Constants.C_GOTO,
+    'if-goto': Constants.C_IF,
+    'function': Constants.C_FUNCTION,
+    'call': Constants.C_CALL,
+    'return': Constants.C_RETURN,
+}
+
+def read_commands(filepath):
+    # The file's commands without blank lines and comments
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('//'):
+                continue
+            yield line
+
 class Parser:
+    # Commands are read from the file one at a time as they're asked for,
+    # with the next one read ahead so has_more_commands can answer
     def __init__(self, filepath):
-        self.commands = []
+        self.filepath = filepath
+        self.commands = read_commands(filepath)
+        self.next_command = next(self.commands, None)
         self.current_command = ''
-        with open(filepath, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line == '' or line.startswith('//'):
-                    continue
-                self.commands.append(line)
 
     def has_more_commands(self):
-        return len(self.commands) > 0
+        return self.next_command is not None
 
     def advance(self):
-        self.current_command = self.commands.pop(0)
+        self.current_command = self.next_command
+        self.next_command = next(self.commands, None)
         self.parse_command()
 
     def parse_command(self):
         command_parts = self.current_command.split(' ')
         self.command_type = self.get_command_type(command_parts[0])
+        self.opcode = Constants.OPCODES[command_parts[0]]
         self.arg1 = None
         self.arg2 = None
 
@@ -32,29 +62,73 @@ class Parser:
             self.arg1 = command_parts[1]
             self.arg2 = int(command_parts[2])
 
-        print('Current command: ' + self.current_command)
-        print('Command type: ' + self.command_type)
-        print('Arg 1: ' + str(self.arg1))
-        print('Arg 2: ' + str(self.arg2))
-
     def get_command_type(self, command):
-        command_types = {
-            'add': Constants.C_ARITHMETIC,
-            'sub': Constants.C_ARITHMETIC,
-            'neg': Constants.C_ARITHMETIC,
-            'eq': Constants.C_ARITHMETIC,
-            'gt': Constants.C_ARITHMETIC,
-            'lt': Constants.C_ARITHMETIC,
-            'and': Constants.C_ARITHMETIC,
-            'or': Constants.C_ARITHMETIC,
-            'not': Constants.C_ARITHMETIC,
-            'push': Constants.C_PUSH,
-            'pop': Constants.C_POP,
-            'label': Constants.C_LABEL,
-            'goto': Constants.C_GOTO,
-            'if-goto': Constants.C_IF,
-            'function': Constants.C_FUNCTION,
-            'call': Constants.C_CALL,
-            'return': Constants.C_RETURN,
-        }
-        return command_types[command]
+        return COMMAND_TYPES[command]
+
+    # Parses the remaining commands into program (a new DecodedProgram if
+    # not given) and returns it
+    def decode(self, program=None):
+        if program is None:
+            program = DecodedProgram()
+        file_id = program.intern_file(self.filepath)
+
+        while self.has_more_commands():
+            self.advance()
+            segment = Constants.SEG_NONE
+            symbol = -1
+            argument = 0
+            if self.command_type in [Constants.C_PUSH, Constants.C_POP]:
+                if self.arg1 not in Constants.SEGMENT_IDS:
+                    raise Exception("Unknown segment '{}' in {}".format(self.arg1, self.filepath))
+                segment = Constants.SEGMENT_IDS[self.arg1]
+                argument = self.arg2
+            elif self.command_type in [Constants.C_LABEL, Constants.C_GOTO, Constants.C_IF]:
+                symbol = program.intern(self.arg1)
+            elif self.command_type in [Constants.C_FUNCTION, Constants.C_CALL]:
+                symbol = program.intern(self.arg1)
+                argument = self.arg2
+            program.append(self.opcode, segment, symbol, argument, file_id)
+        return program
+
+class DecodedProgram:
+    # A VM program as parallel arrays with one entry per command, so it can
+    # be translated or run without looking at any strings:
+    #   opcodes   Constants.OP_* for the command
+    #   segments  Constants.SEG_* for push and pop, SEG_NONE otherwise
+    #   symbols   the label or function name for label, goto, if-goto,
+    #             function and call, as an index into names (-1 otherwise)
+    #   arguments the index for push and pop, the number of locals or
+    #             arguments for function and call (0 otherwise)
+    #   file_ids  the file the command came from, as an index into files
+    # Several files can be decoded into the same program; symbols are
+    # shared between them.
+    def __init__(self):
+        self.opcodes = array('B')
+        self.segments = array('B')
+        self.symbols = array('i')
+        self.arguments = array('i')
+        self.file_ids = array('H')
+        self.names = []
+        self.symbol_ids = {}
+        self.files = []
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def intern(self, name):
+        symbol = self.symbol_ids.get(name)
+        if symbol is None:
+            symbol = self.symbol_ids[name] = len(self.names)
+            self.names.append(name)
+        return symbol
+
+    def intern_file(self, filepath):
+        self.files.append(filepath)
+        return len(self.files) - 1
+
+    def append(self, opcode, segment, symbol, argument, file_id):
+        self.opcodes.append(opcode)
+        self.segments.append(segment)
+        self.symbols.append(symbol)
+        self.arguments.append(argument)
+        self.file_ids.append(file_id)
@@ -0,0 +1,81 @@
+import os
+import unittest
+import Constants
+import Parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIBONACCI_ELEMENT = os.path.join(HERE, 'FunctionCalls', 'FibonacciElement')
+
+class TestParserDecode(unittest.TestCase):
+
+    def test_simple_function(self):
+        program = Parser.Parser(os.path.join(HERE, 'FunctionCalls/SimpleFunction/SimpleFunction.vm')).decode()
+        self.assertEqual(len(program), 10)
+        self.assertEqual(list(program.opcodes), [
+            Constants.OP_FUNCTION, Constants.OP_PUSH, Constants.OP_PUSH, Constants.OP_ADD,
+            Constants.OP_NOT, Constants.OP_PUSH, Constants.OP_ADD, Constants.OP_PUSH,
+            Constants.OP_SUB, Constants.OP_RETURN])
+        self.assertEqual(list(program.segments), [
+            Constants.SEG_NONE, Constants.SEG_LOCAL, Constants.SEG_LOCAL, Constants.SEG_NONE,
+            Constants.SEG_NONE, Constants.SEG_ARGUMENT, Constants.SEG_NONE, Constants.SEG_ARGUMENT,
+            Constants.SEG_NONE, Constants.SEG_NONE])
+        self.assertEqual(list(program.arguments), [2, 0, 1, 0, 0, 0, 0, 1, 0, 0])
+        self.assertEqual(list(program.symbols), [0] + [-1] * 9)
+        self.assertEqual(program.names, ['SimpleFunction.test'])
+
+    def test_symbols_shared_between_files(self):
+        program = Parser.DecodedProgram()
+        for filename in ['Main.vm', 'Sys.vm']:
+            Parser.Parser(os.path.join(FIBONACCI_ELEMENT, filename)).decode(program)
+        self.assertEqual(program.files, [os.path.join(FIBONACCI_ELEMENT, name) for name in ['Main.vm', 'Sys.vm']])
+        self.assertEqual(program.file_ids[0], 0)
+        self.assertEqual(program.file_ids[len(program) - 1], 1)
+
+        # Main.fibonacci is defined in Main.vm and called from both files,
+        # always with the same id
+        fibonacci = program.symbol_ids['Main.fibonacci']
+        self.assertEqual(program.names[fibonacci], 'Main.fibonacci')
+        uses = [(program.opcodes[i], program.file_ids[i]) for i in range(len(program))
+            if program.symbols[i] == fibonacci]
+        self.assertIn((Constants.OP_FUNCTION, 0), uses)
+        self.assertIn((Constants.OP_CALL, 0), uses)
+        self.assertIn((Constants.OP_CALL, 1), uses)
+        self.assertEqual(len(program.names), len(set(program.names)))
+
+    def test_intern(self):
+        program = Parser.DecodedProgram()
+        self.assertEqual(program.intern('LOOP'), 0)
+        self.assertEqual(program.intern('END'), 1)
+        self.assertEqual(program.intern('LOOP'), 0)
+        self.assertEqual(program.names, ['LOOP', 'END'])
+
+class TestParserStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.filepath = os.path.join(HERE, 'ParserStreaming.vm')
+        with open(self.filepath, 'w') as f:
+            f.write('// comment\n\npush constant 7\n   \n  label LOOP\n// another\nreturn\n')
+
+    def tearDown(self):
+        os.remove(self.filepath)
+
+    def test_advance(self):
+        parser = Parser.Parser(self.filepath)
+        commands = []
+        while parser.has_more_commands():
+            parser.advance()
+            commands.append((parser.command_type, parser.arg1, parser.arg2))
+        self.assertEqual(commands, [
+            (Constants.C_PUSH, 'constant', 7),
+            (Constants.C_LABEL, 'LOOP', None),
+            (Constants.C_RETURN, 'return', None),
+        ])
+        self.assertFalse(parser.has_more_commands())
+
+    def test_commands_read_lazily(self):
+        parser = Parser.Parser(self.filepath)
+        parser.advance()
+        # Only the command after the current one has been read
+        self.assertEqual(parser.current_command, 'push constant 7')
+        self.assertEqual(parser.next_command, 'label LOOP')
+        self.assertEqual(list(parser.commands), ['return'])
@@ -0,0 +1,152 @@
+# Peephole optimizer for the assembly CodeWriter generates. Each VM
+# command is translated on its own, so adjacent templates repeat work the
+# previous one already did: a push's SP++ straight followed by a pop's
+# SP--, reloading @SP when A still holds it, loading D and overwriting it
+# before it's read. The rules below remove that, working on the list of
+# lines CodeWriter builds.
+#
+# Comment lines are kept and otherwise ignored. Labels are where other
+# code can jump in, so no rule looks across one. The only assumption made
+# about the program is that the stack pointer never points at itself
+# (RAM[0] holds the stack's address, which is never 0).
+
+# How far dead_d_loads looks ahead for D being overwritten
+DEAD_D_WINDOW = 8
+
+def optimize(lines):
+    # Returns a new list of lines with the rules applied until none of them
+    # finds anything more to do
+    lines = list(lines)
+    changed = True
+    while changed:
+        changed = False
+        for rule in RULES:
+            if rule(lines, instruction_indexes(lines)):
+                lines = [line for line in lines if line is not None]
+                changed = True
+    return lines
+
+def count_instructions(lines):
+    # Lines that end up in ROM, so not comments or labels
+    return sum(1 for line in lines if not line.startswith('//') and not line.startswith('('))
+
+def instruction_indexes(lines):
+    # Where the instructions and labels are, skipping comments
+    return [i for i, line in enumerate(lines) if not line.startswith('//')]
+
+def split_c_instruction(line):
+    # dest=comp;jump as (dest, comp, jump), '' for missing parts
+    dest, _, rest = line.rpartition('=')
+    comp, _, jump = rest.partition(';')
+    return dest, comp, jump
+
+def writes_a(line):
+    if line.startswith('@') or line.startswith('('):
+        return True
+    dest, _, _ = split_c_instruction(line)
+    return 'A' in dest
+
+# Each rule takes the lines and the indexes of the instructions and labels
+# among them, sets the lines it removes to None, and returns whether it
+# changed anything
+
+def sp_round_trip(lines, code):
+    # @SP, M=M+1, @SP, M=M-1 leaves SP as it was. A ends up as 0, so the
+    # next instruction has to be one that sets A again.
+    changed = False
+    k = 0
+    while k + 4 < len(code):
+        window = [lines[i] for i in code[k:k + 5]]
+        if window[:4] == ['@SP', 'M=M+1', '@SP', 'M=M-1'] and window[4].startswith('@'):
+            for i in code[k:k + 4]:
+                lines[i] = None
+            changed = True
+            k += 4
+        else:
+            k += 1
+    return changed
+
+def store_then_reload(lines, code):
+    # *SP = D followed by D = *SP: A and D already hold what the reload
+    # would give them
+    changed = False
+    k = 0
+    while k + 5 < len(code):
+        window = [lines[i] for i in code[k:k + 6]]
+        if window == ['@SP', 'A=M', 'M=D', '@SP', 'A=M', 'D=M']:
+            for i in code[k + 3:k + 6]:
+                lines[i] = None
+            changed = True
+            k += 6
+        else:
+            k += 1
+    return changed
+
+def merge_update_and_load(lines, code):
+    # M=M-1 then A=M is AM=M-1, the write goes to the old A either way
+    changed = False
+    for k in range(len(code) - 1):
+        first, second = lines[code[k]], lines[code[k + 1]]
+        if first in ['M=M-1', 'M=M+1'] and second == 'A=M':
+            lines[code[k]] = 'A' + first
+            lines[code[k + 1]] = None
+            changed = True
+    return changed
+
+def repeated_a_loads(lines, code):
+    # @X when A already holds X
+    changed = False
+    current = None
+    for i in code:
+        line = lines[i]
+        if line is None:
+            continue
+        if line.startswith('@'):
+            if line == current:
+                lines[i] = None
+                changed = True
+            current = line
+        elif writes_a(line):
+            current = None
+    return changed
+
+def dead_a_loads(lines, code):
+    # @X straight followed by @Y
+    changed = False
+    for k in range(len(code) - 1):
+        if lines[code[k]].startswith('@') and lines[code[k + 1]].startswith('@'):
+            lines[code[k]] = None
+            changed = True
+    return changed
+
+def dead_d_loads(lines, code):
+    # D=... whose value is replaced before anything reads it. Jumps count
+    # as reading D since the jump condition might.
+    changed = False
+    for k, i in enumerate(code):
+        dest, comp, jump = split_c_instruction(lines[i])
+        if dest != 'D' or jump:
+            continue
+        for j in code[k + 1:k + 1 + DEAD_D_WINDOW]:
+            line = lines[j]
+            if line.startswith('('):
+                break
+            if line.startswith('@'):
+                continue
+            dest, comp, jump = split_c_instruction(line)
+            if 'D' in comp or jump:
+                break
+            if 'D' in dest:
+                lines[i] = None
+                changed = True
+                break
+    return changed
+
+RULES = [
+    sp_round_trip,
+    store_then_reload,
+    merge_update_and_load,
+    repeated_a_loads,
+    dead_a_loads,
+    dead_d_loads,
+]
@@ -0,0 +1,59 @@
+import os
+import unittest
+import CodeWriter
+import Peephole
+
+class TestPeephole(unittest.TestCase):
+
+    def test_push_then_pop(self):
+        # push constant 7, pop pointer 0
+        cw = CodeWriter.CodeWriter('Test.vm')
+        lines = cw.convert_push_command('push', 'constant', 7) + cw.convert_pop_command('pop', 'pointer', 0)
+        cw.close()
+        result = Peephole.optimize(lines)
+        instructions = [line for line in result if not line.startswith('//')]
+        self.assertEqual(instructions, ['@7', 'D=A', '@SP', 'A=M', 'M=D', '@THIS', 'M=D'])
+        # Comments stay
+        self.assertEqual(result[0], '// push constant 7')
+        self.assertIn('// pop pointer 0', result)
+
+    def test_binary_operator(self):
+        cw = CodeWriter.CodeWriter('Test.vm')
+        result = Peephole.optimize(cw.convert_builtin_operator_command('add'))
+        cw.close()
+        self.assertEqual(result, ['// add', '@SP', 'AM=M-1', 'D=M', '@SP', 'AM=M-1', 'M=M+D', '@SP', 'M=M+1'])
+
+    def test_repeated_a_loads(self):
+        self.assertEqual(Peephole.optimize(['@SP', 'M=M-1', '@SP', 'D=M']), ['@SP', 'M=M-1', 'D=M'])
+        self.assertEqual(Peephole.optimize(['@SP', 'A=M', '@SP', 'D=M']), ['@SP', 'A=M', '@SP', 'D=M'])
+
+    def test_dead_loads(self):
+        self.assertEqual(Peephole.optimize(['@5', 'D=A', '@7', 'D=A', '@R13', 'M=D']), ['@7', 'D=A', '@R13', 'M=D'])
+        self.assertEqual(Peephole.optimize(['@X', '@Y', 'M=0']), ['@Y', 'M=0'])
+        # Read by the jump
+        self.assertEqual(Peephole.optimize(['D=M', '@L', 'D;JNE', 'D=A']), ['D=M', '@L', 'D;JNE', 'D=A'])
+
+    def test_labels_are_barriers(self):
+        lines = ['@SP', 'M=M+1', '(LOOP)', '@SP', 'M=M-1', '@SP', 'D=M', '(END)', 'D=A']
+        self.assertEqual(Peephole.optimize(lines), ['@SP', 'M=M+1', '(LOOP)', '@SP', 'M=M-1', 'D=M', '(END)', 'D=A'])
+
+    def test_sp_round_trip_needs_a_set_after(self):
+        lines = ['@SP', 'M=M+1', '@SP', 'M=M-1', 'D=M']
+        self.assertEqual(Peephole.optimize(lines), ['@SP', 'M=M+1', 'M=M-1', 'D=M'])
+
+    def test_instruction_counts(self):
+        cw = CodeWriter.CodeWriter('PeepholeTest.asm', optimize=True)
+        cw.set_file_name('First.vm')
+        cw.write_push_pop('C_PUSH', 'constant', 1)
+        cw.write_push_pop('C_POP', 'static', 0)
+        cw.set_file_name('Second.vm')
+        cw.write_label('LOOP')
+        cw.write_goto('LOOP')
+        cw.close()
+        with open('PeepholeTest.asm') as f:
+            output = f.read().splitlines()
+        os.remove('PeepholeTest.asm')
+
+        self.assertEqual(cw.instruction_counts, {'First': [14, 7], 'Second': [2, 2]})
+        self.assertIn('@First.0', output)
+        self.assertEqual(Peephole.count_instructions(output), 9)
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Default cap on the total size of the cache directory
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+ENTRY_EXTENSION = '.json'
+
+# What every entry has, see CodeWriter.end_fragment and
+# VMTranslator.translate_cached
+FRAGMENT_KEYS = {'asm', 'routines', 'instructions', 'instruction_counts', 'dropped_instructions'}
+
+class TranslationCache:
+    # On-disk cache of translated .vm files, so translating a directory
+    # again only redoes the files that changed. Each entry is one file's
+    # fragment as a JSON file, named after a hash of everything the
+    # translation depends on: the translator version, the file's name
+    # (statics and return addresses are named after it), the options and
+    # the .vm source. Reading an entry marks it used by touching its
+    # mtime, and the entries used longest ago go first when the directory
+    # outgrows max_size. projects/06's AssemblyCache works the same way
+    # for assembled programs.
+    def __init__(self, directory, version, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.version = version
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filename, options, source):
+        # options is anything json can encode, with the same value for the
+        # same translation
+        digest = hashlib.sha256(self.version.encode())
+        for part in [os.path.basename(filename), json.dumps(options, sort_keys=True)]:
+            digest.update(b'\0')
+            digest.update(part.encode())
+        digest.update(b'\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ENTRY_EXTENSION)
+
+    def get(self, key):
+        # Returns the cached fragment, or None on a miss
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path) as fp:
+                fragment = json.load(fp)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            fragment = None
+        if not isinstance(fragment, dict) or not FRAGMENT_KEYS <= fragment.keys():
+            # Left half written by a full disk or the like. Removed so the
+            # file gets translated and cached again.
+            remove(entry_path)
+            return None
+        os.utime(entry_path)
+        return fragment
+
+    def put(self, key, fragment):
+        # Written to a temp file first so other processes sharing the
+        # cache never see a half-written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(fragment, fp)
+            os.replace(tmp_path, self.entry_path(key))
+        except BaseException:
+            remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            remove(path)
+            total_size -= size
+
+def remove(path):
+    # Entries can go from under us (another process got to it first), and
+    # one that can't be removed is left for the next eviction
+    try:
+        os.remove(path)
+    except OSError:
+        pass
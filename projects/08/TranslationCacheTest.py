@@ -0,0 +1,136 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from TranslationCache import *
+import CodeWriter
+import Parser
+import VMTranslator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OPTIONS = {'compact': False, 'optimize': False, 'fuse': False, 'kept_functions': None}
+
+class TranslationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = TranslationCache(os.path.join(self.tmpdir, 'cache'), '1')
+        self.program = os.path.join(self.tmpdir, 'StaticsTest')
+        shutil.copytree(os.path.join(HERE, 'FunctionCalls/StaticsTest'), self.program)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def fragment(self, asm):
+        return {'asm': asm, 'routines': [], 'instructions': 2, 'instruction_counts': None,
+            'dropped_instructions': 0}
+
+    def test_miss_then_hit(self):
+        key = self.cache.key('Main.vm', OPTIONS, b'push constant 0\n')
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, self.fragment('@0\nD=A\n'))
+        self.assertEqual(self.cache.get(key), self.fragment('@0\nD=A\n'))
+
+    def test_key_depends_on_name_options_source_and_version(self):
+        key = self.cache.key('Main.vm', OPTIONS, b'push constant 0')
+        other_version = TranslationCache(self.cache.directory, '2')
+        self.assertEqual(self.cache.key('dir/Main.vm', dict(OPTIONS), b'push constant 0'), key)
+        self.assertNotEqual(self.cache.key('Other.vm', OPTIONS, b'push constant 0'), key)
+        self.assertNotEqual(self.cache.key('Main.vm', dict(OPTIONS, compact=True), b'push constant 0'), key)
+        self.assertNotEqual(self.cache.key('Main.vm', OPTIONS, b'push constant 1'), key)
+        self.assertNotEqual(other_version.key('Main.vm', OPTIONS, b'push constant 0'), key)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        keys = [self.cache.key('Main.vm', OPTIONS, str(i).encode()) for i in range(3)]
+        self.cache.put(keys[0], self.fragment('@0\n' * 100))
+        self.cache.max_size = os.path.getsize(self.cache.entry_path(keys[0])) * 2
+        self.cache.put(keys[1], self.fragment('@1\n' * 100))
+        # Make sure entry 0 is more recently used than entry 1
+        os.utime(self.cache.entry_path(keys[1]), ns=(0, 0))
+        self.cache.get(keys[0])
+
+        self.cache.put(keys[2], self.fragment('@2\n' * 100))
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_unreadable_entries_are_misses(self):
+        key = self.cache.key('Main.vm', OPTIONS, b'push constant 0\n')
+        for contents in ['', '{', '[]', '{"asm": ""}']:
+            with open(self.cache.entry_path(key), 'w') as fp:
+                fp.write(contents)
+            self.assertIsNone(self.cache.get(key))
+            self.assertFalse(os.path.exists(self.cache.entry_path(key)))
+
+    def test_failed_put_leaves_nothing_behind(self):
+        key = self.cache.key('Main.vm', OPTIONS, b'push constant 0\n')
+        with self.assertRaises(TypeError):
+            self.cache.put(key, dict(self.fragment('@0\n'), routines={'VM$CALL'})) # Sets aren't JSON
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def translate(self, output_filepath, cache=None, **options):
+        # Returns the output and how many files came from the cache
+        vm_files = sorted(os.path.join(self.program, name) for name in os.listdir(self.program)
+            if name.endswith('.vm'))
+        code_writer = CodeWriter.CodeWriter(output_filepath, scoped_labels=True, **options)
+        code_writer.write_init()
+        hits = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for vm_file in vm_files:
+                code_writer.set_file_name(vm_file)
+                if cache is None:
+                    VMTranslator.parse_file(code_writer, Parser.Parser(vm_file))
+                else:
+                    file_options = dict(OPTIONS, **options)
+                    hits += VMTranslator.translate_cached(code_writer, vm_file, cache, file_options)
+        code_writer.close()
+        with open(output_filepath) as fp:
+            return fp.read(), hits
+
+    def test_only_changed_files_are_translated_again(self):
+        output_filepath = os.path.join(self.tmpdir, 'StaticsTest.asm')
+        for options in [{}, {'compact': True, 'optimize': True}]:
+            expected, _ = self.translate(output_filepath, **options)
+            self.assertEqual(self.translate(output_filepath, self.cache, **options), (expected, 0))
+            self.assertEqual(self.translate(output_filepath, self.cache, **options), (expected, 3))
+
+        with open(os.path.join(self.program, 'Class1.vm'), 'a') as fp:
+            fp.write('function Class1.unused 0\npush constant 1\npush constant 2\nlt\nreturn\n')
+        expected, _ = self.translate(output_filepath)
+        self.assertEqual(self.translate(output_filepath, self.cache), (expected, 2))
+
+    def test_corrupt_entry_is_translated_again(self):
+        output_filepath = os.path.join(self.tmpdir, 'StaticsTest.asm')
+        expected, _ = self.translate(output_filepath, self.cache)
+        for entry in os.listdir(self.cache.directory):
+            with open(os.path.join(self.cache.directory, entry), 'w') as fp:
+                fp.write('{')
+        self.assertEqual(self.translate(output_filepath, self.cache), (expected, 0))
+        self.assertEqual(self.translate(output_filepath, self.cache), (expected, 3))
+
+    def test_scoped_labels(self):
+        cw = CodeWriter.CodeWriter('Test.vm', scoped_labels=True)
+        cw.set_file_name('dir/Class1.vm')
+        self.assertIn('(Class1$SETTRUE1)', cw.convert_comparison_command('eq'))
+        cw.set_file_name('dir/Class2.vm')
+        self.assertIn('(Class2$SETTRUE1)', cw.convert_comparison_command('eq'))
+        self.assertIn('(Class2$compare.2)', cw.convert_compact_comparison_command('lt'))
+
+    def test_relative_cache_dir_with_directory_argument(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            for expected in ['Reused 0 of 3', 'Reused 3 of 3']:
+                output = io.StringIO()
+                with mock.patch('sys.argv', ['VMTranslator.py', 'StaticsTest', '--cache-dir', 'cache']):
+                    with contextlib.redirect_stdout(output):
+                        VMTranslator.main()
+                os.chdir(self.tmpdir)
+                self.assertIn(expected, output.getvalue())
+        finally:
+            os.chdir(cwd)
+        self.assertTrue(os.path.isdir(os.path.join(self.tmpdir, 'cache')))
+        self.assertFalse(os.path.exists(os.path.join(self.program, 'cache')))
@@ -0,0 +1,362 @@
+import argparse
+import glob
+import os
+import time
+import Constants
+import OSBuiltins
+import Parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+OS_DIRECTORY = os.path.join(HERE, '..', '..', 'tools', 'OS')
+
+# Memory map, the same as the Hack platform's
+RAM_SIZE = 32768
+SP = 0
+LCL = 1
+ARG = 2
+THIS = 3
+THAT = 4
+TEMP = 5
+STATIC = 16
+STACK = 256
+
+# Opcodes of the decoded program
+PUSH_CONSTANT = 0
+PUSH_SEGMENT = 1 # local, argument, this, that: arg1 is the base pointer's address
+PUSH_FIXED = 2   # temp, pointer, static: arg1 is the address itself
+POP_SEGMENT = 3
+POP_FIXED = 4
+ADD = 5
+SUB = 6
+NEG = 7
+EQ = 8
+GT = 9
+LT = 10
+AND = 11
+OR = 12
+NOT = 13
+GOTO = 14
+IF_GOTO = 15
+FUNCTION = 16
+CALL = 17
+RETURN = 18
+CALL_BUILTIN = 19 # arg1 indexes builtin_calls
+
+ARITHMETIC_OPCODES = {
+    Constants.OP_ADD: ADD, Constants.OP_SUB: SUB, Constants.OP_NEG: NEG,
+    Constants.OP_EQ: EQ, Constants.OP_GT: GT, Constants.OP_LT: LT,
+    Constants.OP_AND: AND, Constants.OP_OR: OR, Constants.OP_NOT: NOT,
+}
+SEGMENT_POINTERS = {
+    Constants.SEG_LOCAL: LCL, Constants.SEG_ARGUMENT: ARG,
+    Constants.SEG_THIS: THIS, Constants.SEG_THAT: THAT,
+}
+FIXED_SEGMENTS = {Constants.SEG_TEMP: TEMP, Constants.SEG_POINTER: THIS}
+
+def main():
+    args = parse_args()
+    filepaths = find_vm_files(args.paths)
+    if args.os:
+        filepaths += os_vm_files(filepaths)
+
+    start = time.perf_counter()
+    vm = VMEmulator(filepaths, OSBuiltins.BUILTINS if args.builtins else None)
+    load_seconds = time.perf_counter() - start
+
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        vm.ram[int(address)] = int(value) & 0xFFFF
+    vm.bootstrap()
+
+    start = time.perf_counter()
+    steps = vm.run(args.steps)
+    seconds = time.perf_counter() - start
+
+    print("Loaded {} commands in {:.1f} ms, ran {} in {:.1f} ms ({:.2f} M commands/s){}".format(
+        len(vm.opcodes), load_seconds * 1000, steps, seconds * 1000,
+        steps / seconds / 1e6 if seconds else 0, ', halted' if vm.halted else ''))
+    for address in args.dump:
+        print("RAM[{}] = {}".format(address, vm.signed(address)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run .vm programs directly')
+    parser.add_argument('paths', nargs='+', help='.vm files or directories of them')
+    parser.add_argument('--os', action='store_true',
+        help='add the tools/OS .vm files the program doesn\'t provide itself')
+    parser.add_argument('--builtins', action='store_true',
+        help='run native Python versions of the hottest OS functions')
+    parser.add_argument('-n', '--steps', type=int, default=100000000,
+        help='stop after this many VM commands if the program hasn\'t halted')
+    parser.add_argument('-s', '--set', nargs='*', default=[], metavar='ADDRESS=VALUE',
+        help='initial RAM contents')
+    parser.add_argument('-d', '--dump', type=int, nargs='*', default=[], metavar='ADDRESS',
+        help='RAM addresses to print once the program stops')
+    return parser.parse_args()
+
+def find_vm_files(paths):
+    filepaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            filepaths += sorted(glob.glob(os.path.join(path, '*.vm')))
+        else:
+            filepaths.append(path)
+    return filepaths
+
+def os_vm_files(filepaths):
+    # The OS classes not already among filepaths
+    names = set(os.path.basename(filepath) for filepath in filepaths)
+    return [filepath for filepath in sorted(glob.glob(os.path.join(OS_DIRECTORY, '*.vm')))
+        if os.path.basename(filepath) not in names]
+
+def is_os_file(filepath):
+    return os.path.dirname(os.path.realpath(filepath)) == os.path.realpath(OS_DIRECTORY)
+
+class VMEmulator:
+    # Runs VM programs without translating them to assembly. The .vm files
+    # are decoded by Parser and turned up front into parallel lists of
+    # opcodes and integer arguments, with labels and function names
+    # resolved to command indexes. Memory is laid out the same as on the
+    # Hack platform (SP, LCL, ARG, THIS, THAT, temp, statics, stack, heap,
+    # screen, keyboard), so the OS works unchanged. Values are stored as
+    # unsigned 16-bit numbers like the hardware.
+    #
+    # builtins maps function names to native versions (see OSBuiltins),
+    # which calls to those functions run instead of the VM code. They're
+    # written against tools/OS, so only functions loaded from there are
+    # replaced, never a program's own class of the same name.
+    def __init__(self, filepaths, builtins=None):
+        self.ram = [0] * RAM_SIZE
+        self.functions = {}
+        self.function_files = {}
+        self.builtins = builtins or {}
+        self.builtin_calls = []
+        self.load(filepaths)
+        self.reset()
+
+    def load(self, filepaths):
+        # The files are decoded into one Parser.DecodedProgram. A first pass
+        # finds where each label and function is, the second turns the
+        # commands into this emulator's opcodes. Labels are scoped to the
+        # function they're in.
+        program = Parser.DecodedProgram()
+        for filepath in filepaths:
+            Parser.Parser(filepath).decode(program)
+
+        commands = []
+        labels = {}
+        function_symbol = -1
+        for i, opcode in enumerate(program.opcodes):
+            if opcode == Constants.OP_LABEL:
+                labels[(function_symbol, program.symbols[i])] = len(commands)
+                continue
+            if opcode == Constants.OP_FUNCTION:
+                function_symbol = program.symbols[i]
+                self.functions[program.names[function_symbol]] = len(commands)
+                self.function_files[program.names[function_symbol]] = program.files[program.file_ids[i]]
+            commands.append((i, function_symbol))
+
+        self.statics = {}
+        self.opcodes = []
+        self.arg1s = []
+        self.arg2s = []
+        for i, function_symbol in commands:
+            opcode, arg1, arg2 = self.decode(program, i, function_symbol, labels)
+            self.opcodes.append(opcode)
+            self.arg1s.append(arg1)
+            self.arg2s.append(arg2)
+
+    def decode(self, program, i, function_symbol, labels):
+        opcode = program.opcodes[i]
+        segment = program.segments[i]
+        symbol = program.symbols[i]
+        argument = program.arguments[i]
+        if opcode in ARITHMETIC_OPCODES:
+            return ARITHMETIC_OPCODES[opcode], 0, 0
+        elif opcode in [Constants.OP_PUSH, Constants.OP_POP]:
+            push = opcode == Constants.OP_PUSH
+            if segment == Constants.SEG_CONSTANT and push:
+                return PUSH_CONSTANT, argument, 0
+            elif segment in SEGMENT_POINTERS:
+                return PUSH_SEGMENT if push else POP_SEGMENT, SEGMENT_POINTERS[segment], argument
+            elif segment in FIXED_SEGMENTS:
+                return PUSH_FIXED if push else POP_FIXED, FIXED_SEGMENTS[segment] + argument, 0
+            elif segment == Constants.SEG_STATIC:
+                # Statics are given addresses in the order they're first
+                # seen, like the assembler does with variables
+                filepath = program.files[program.file_ids[i]]
+                filename = os.path.splitext(os.path.basename(filepath))[0]
+                address = self.statics.setdefault((filename, argument), STATIC + len(self.statics))
+                return PUSH_FIXED if push else POP_FIXED, address, 0
+            raise Exception("Can't {} segment '{}'".format('push' if push else 'pop', Constants.SEGMENTS[segment]))
+        elif opcode in [Constants.OP_GOTO, Constants.OP_IF]:
+            if (function_symbol, symbol) not in labels:
+                scope = program.names[function_symbol] if function_symbol >= 0 else program.files[program.file_ids[i]]
+                raise Exception("Label '{}' not defined in {}".format(program.names[symbol], scope))
+            return GOTO if opcode == Constants.OP_GOTO else IF_GOTO, labels[(function_symbol, symbol)], 0
+        elif opcode == Constants.OP_FUNCTION:
+            return FUNCTION, argument, 0
+        elif opcode == Constants.OP_CALL:
+            name = program.names[symbol]
+            if name not in self.functions:
+                raise Exception("Function '{}' not defined".format(name))
+            if name in self.builtins and is_os_file(self.function_files[name]):
+                # The VM code is still there for when the builtin declines
+                self.builtin_calls.append((self.builtins[name], self.functions[name]))
+                return CALL_BUILTIN, len(self.builtin_calls) - 1, argument
+            return CALL, self.functions[name], argument
+        elif opcode == Constants.OP_RETURN:
+            return RETURN, 0, 0
+        raise Exception("Opcode {} not handled".format(opcode))
+
+    def reset(self):
+        # Starts again from the first command, RAM is left alone
+        self.pc = 0
+        self.steps = 0
+        self.halted = False
+
+    def bootstrap(self):
+        # Same as the translator's bootstrap code: SP = 256, call Sys.init.
+        # Programs without Sys.init (like the single file tests) start at
+        # their first command with RAM as the caller set it up.
+        if 'Sys.init' not in self.functions:
+            return
+        ram = self.ram
+        ram[SP] = STACK
+        self.call(self.functions['Sys.init'], 0, len(self.opcodes))
+
+    def call(self, target, num_args, return_address):
+        ram = self.ram
+        sp = ram[SP]
+        ram[sp:sp + 5] = [return_address, ram[LCL], ram[ARG], ram[THIS], ram[THAT]]
+        ram[ARG] = sp - num_args
+        ram[LCL] = ram[SP] = sp + 5
+        self.pc = target
+
+    def call_function(self, function_name, *args):
+        # Calls a function on its own (with the VM code, builtins aside)
+        # and returns what it returns
+        ram = self.ram
+        sp = ram[SP]
+        ram[sp:sp + len(args)] = [arg & 0xFFFF for arg in args]
+        ram[SP] = sp + len(args)
+        self.call(self.functions[function_name], len(args), len(self.opcodes))
+        self.halted = False
+        while not self.halted:
+            self.run(100000000)
+        ram[SP] -= 1
+        return ram[ram[SP]]
+
+    def signed(self, address):
+        value = self.ram[address]
+        return value - 0x10000 if value & 0x8000 else value
+
+    def run(self, max_steps):
+        # Runs until Sys.halt is called, the outermost function returns (or
+        # the program runs off its end), or max_steps commands have run.
+        # Returns the number of commands run.
+        opcodes, arg1s, arg2s = self.opcodes, self.arg1s, self.arg2s
+        builtin_calls = self.builtin_calls
+        program_size = len(opcodes)
+        halt = self.functions.get('Sys.halt', -1)
+        ram = self.ram
+
+        pc = self.pc
+        sp = ram[SP]
+        steps = 0
+        while steps < max_steps:
+            if pc >= program_size or pc == halt:
+                self.halted = True
+                break
+            steps += 1
+            opcode = opcodes[pc]
+
+            if opcode == PUSH_CONSTANT:
+                ram[sp] = arg1s[pc]
+                sp += 1
+            elif opcode == PUSH_SEGMENT:
+                ram[sp] = ram[(ram[arg1s[pc]] + arg2s[pc]) & 0x7FFF]
+                sp += 1
+            elif opcode == PUSH_FIXED:
+                ram[sp] = ram[arg1s[pc]]
+                sp += 1
+            elif opcode == POP_SEGMENT:
+                sp -= 1
+                ram[(ram[arg1s[pc]] + arg2s[pc]) & 0x7FFF] = ram[sp]
+            elif opcode == POP_FIXED:
+                sp -= 1
+                ram[arg1s[pc]] = ram[sp]
+            elif opcode <= NOT:
+                if opcode == NEG:
+                    ram[sp - 1] = -ram[sp - 1] & 0xFFFF
+                elif opcode == NOT:
+                    ram[sp - 1] ^= 0xFFFF
+                else:
+                    sp -= 1
+                    x, y = ram[sp - 1], ram[sp]
+                    if opcode == ADD:
+                        ram[sp - 1] = (x + y) & 0xFFFF
+                    elif opcode == SUB:
+                        ram[sp - 1] = (x - y) & 0xFFFF
+                    elif opcode == EQ:
+                        ram[sp - 1] = 0xFFFF if x == y else 0
+                    elif opcode == GT:
+                        # Flipping the sign bits orders them as signed numbers
+                        ram[sp - 1] = 0xFFFF if x ^ 0x8000 > y ^ 0x8000 else 0
+                    elif opcode == LT:
+                        ram[sp - 1] = 0xFFFF if x ^ 0x8000 < y ^ 0x8000 else 0
+                    elif opcode == AND:
+                        ram[sp - 1] = x & y
+                    else:
+                        ram[sp - 1] = x | y
+            elif opcode == GOTO:
+                pc = arg1s[pc]
+                continue
+            elif opcode == IF_GOTO:
+                sp -= 1
+                if ram[sp]:
+                    pc = arg1s[pc]
+                    continue
+            elif opcode == FUNCTION:
+                num_locals = arg1s[pc]
+                ram[sp:sp + num_locals] = [0] * num_locals
+                sp += num_locals
+            elif opcode == CALL:
+                ram[sp:sp + 5] = [pc + 1, ram[LCL], ram[ARG], ram[THIS], ram[THAT]]
+                ram[ARG] = sp - arg2s[pc]
+                sp += 5
+                ram[LCL] = sp
+                pc = arg1s[pc]
+                continue
+            elif opcode == CALL_BUILTIN:
+                builtin, target = builtin_calls[arg1s[pc]]
+                num_args = arg2s[pc]
+                result = builtin(self, *ram[sp - num_args:sp])
+                if result is None:
+                    # Declined, run the VM code instead
+                    ram[sp:sp + 5] = [pc + 1, ram[LCL], ram[ARG], ram[THIS], ram[THAT]]
+                    ram[ARG] = sp - num_args
+                    sp += 5
+                    ram[LCL] = sp
+                    pc = target
+                    continue
+                sp -= num_args
+                ram[sp] = result
+                sp += 1
+            else: # RETURN
+                frame = ram[LCL]
+                return_address = ram[frame - 5]
+                arg = ram[ARG]
+                ram[arg] = ram[sp - 1]
+                sp = arg + 1
+                ram[THAT], ram[THIS], ram[ARG], ram[LCL] = ram[frame - 1], ram[frame - 2], ram[frame - 3], ram[frame - 4]
+                pc = return_address
+                continue
+            pc += 1
+
+        ram[SP] = sp
+        self.pc = pc
+        self.steps += steps
+        return steps
+
+if __name__ == '__main__':
+    main()
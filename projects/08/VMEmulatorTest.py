@@ -0,0 +1,69 @@
+import os
+import unittest
+import VMEmulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load(path, with_os=False):
+    filepaths = VMEmulator.find_vm_files([os.path.join(HERE, path)])
+    if with_os:
+        filepaths += VMEmulator.os_vm_files(filepaths)
+    return VMEmulator.VMEmulator(filepaths)
+
+def set_ram(vm, values):
+    for address, value in values.items():
+        vm.ram[address] = value & 0xFFFF
+
+def signed_ram(vm, addresses):
+    return [vm.signed(address) for address in addresses]
+
+class TestVMEmulator(unittest.TestCase):
+    # Expected values are from the .cmp files next to each test program
+
+    def test_basic_loop(self):
+        vm = load('ProgramFlow/BasicLoop')
+        set_ram(vm, {0: 256, 1: 300, 2: 400, 400: 3})
+        vm.run(1000)
+        self.assertTrue(vm.halted)
+        self.assertEqual(signed_ram(vm, [0, 256]), [257, 6])
+
+    def test_fibonacci_series(self):
+        vm = load('ProgramFlow/FibonacciSeries')
+        set_ram(vm, {0: 256, 1: 300, 2: 400, 400: 6, 401: 3000})
+        vm.run(1000)
+        self.assertEqual(signed_ram(vm, range(3000, 3006)), [0, 1, 1, 2, 3, 5])
+
+    def test_simple_function(self):
+        vm = load('FunctionCalls/SimpleFunction')
+        set_ram(vm, {0: 317, 1: 317, 2: 310, 3: 3000, 4: 4000,
+            310: 1234, 311: 37, 312: 9, 313: 305, 314: 300, 315: 3010, 316: 4010})
+        # The fake return address is inside the program, so stop right
+        # after the return like the test script does
+        vm.run(10)
+        self.assertEqual(signed_ram(vm, [0, 1, 2, 3, 4, 310]), [311, 305, 300, 3010, 4010, 1196])
+
+    def test_fibonacci_element(self):
+        vm = load('FunctionCalls/FibonacciElement')
+        vm.bootstrap()
+        vm.run(10000)
+        self.assertEqual(signed_ram(vm, [0, 261]), [262, 3])
+
+    def test_statics(self):
+        vm = load('FunctionCalls/StaticsTest')
+        vm.bootstrap()
+        vm.run(10000)
+        self.assertEqual(signed_ram(vm, [0, 261, 262]), [263, -2, 8])
+
+    def test_os_program(self):
+        # The OS functions all reuse labels like WHILE_EXP0, which only
+        # works since labels are scoped to their function
+        vm = load('../11/ConvertToBin', with_os=True)
+        vm.ram[8000] = 13
+        vm.bootstrap()
+        vm.run(10000000)
+        self.assertTrue(vm.halted)
+        self.assertEqual(signed_ram(vm, range(8001, 8006)), [1, 0, 1, 1, 0])
+
+    def test_undefined_function(self):
+        with self.assertRaises(Exception):
+            load('../11/Seven')
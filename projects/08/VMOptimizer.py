@@ -0,0 +1,151 @@
+import Constants
+import Parser
+
+# VM to VM optimization: finds the command sequences the Jack compiler
+# emits all the time and replaces each with one fused command (see the
+# C_* constants at the end of Constants), which CodeWriter translates
+# with a template of its own:
+#
+#   push a i; pop b j                           C_MOVE: b[j] = a[i]
+#   push a i; push constant c; add; pop a i     C_UPDATE: a[i] += c (or -= for sub)
+#   push constant c; add                        C_ARITHMETIC_CONSTANT: top of stack += c
+#   [push constant c;] eq; [not;] if-goto l     C_COMPARE_IF: jump on the comparison
+#                                               without pushing a boolean
+#
+# The fused commands leave the stack, the segments and SP exactly as the
+# commands they replace do. What's different is the unused memory above
+# the top of the stack, which the fused versions don't write to.
+
+# Longest sequence any pattern matches
+MAX_PATTERN_LENGTH = 4
+
+COMPARISONS = ['eq', 'gt', 'lt']
+
+def fuse(commands):
+    # Takes and yields commands as (command_type, arg1, arg2), keeping just
+    # enough of them to match the longest pattern
+    window = []
+    for command in commands:
+        window.append(command)
+        if len(window) == MAX_PATTERN_LENGTH:
+            fused, length = match(window)
+            yield fused
+            del window[:length]
+    while window:
+        fused, length = match(window)
+        yield fused
+        del window[:length]
+
+def match(window):
+    # Returns the fused command for the start of window and how many
+    # commands it replaces, (window[0], 1) if nothing matches
+    for pattern in PATTERNS:
+        result = pattern(window)
+        if result is not None:
+            return result
+    return window[0], 1
+
+def is_push_constant(command):
+    return command[0] == Constants.C_PUSH and command[1] == 'constant'
+
+def is_arithmetic(command, commands):
+    return command[0] == Constants.C_ARITHMETIC and command[1] in commands
+
+def update(window):
+    if len(window) < 4:
+        return None
+    push, constant, operator, pop = window[:4]
+    if (push[0] == Constants.C_PUSH and push[1] != 'constant' and is_push_constant(constant)
+            and is_arithmetic(operator, ['add', 'sub'])
+            and pop[0] == Constants.C_POP and (pop[1], pop[2]) == (push[1], push[2])):
+        return (Constants.C_UPDATE, (push[1], push[2]), (operator[1], constant[2])), 4
+    return None
+
+def compare_if(window):
+    # Optional push constant, the comparison, optional not, if-goto
+    position = 0
+    constant = None
+    if is_push_constant(window[0]):
+        constant = window[0][2]
+        position += 1
+    if position >= len(window) or not is_arithmetic(window[position], COMPARISONS):
+        return None
+    comparison = window[position][1]
+    position += 1
+    negate = position < len(window) and is_arithmetic(window[position], ['not'])
+    if negate:
+        position += 1
+    if position >= len(window) or window[position][0] != Constants.C_IF:
+        return None
+    return (Constants.C_COMPARE_IF, window[position][1], (comparison, constant, negate)), position + 1
+
+def move(window):
+    if len(window) < 2:
+        return None
+    push, pop = window[:2]
+    if push[0] == Constants.C_PUSH and pop[0] == Constants.C_POP:
+        return (Constants.C_MOVE, (push[1], push[2]), (pop[1], pop[2])), 2
+    return None
+
+def arithmetic_constant(window):
+    if len(window) < 2:
+        return None
+    constant, operator = window[:2]
+    if is_push_constant(constant) and is_arithmetic(operator, ['add', 'sub']):
+        return (Constants.C_ARITHMETIC_CONSTANT, operator[1], constant[2]), 2
+    return None
+
+# Tried in order, the longer patterns first
+PATTERNS = [
+    update,
+    compare_if,
+    move,
+    arithmetic_constant,
+]
+
+# Whole program dead function elimination: functions that can't be
+# reached by calls from the roots (Sys.init for a whole program) are
+# dropped before translation. VM code can only get to a function through
+# call, so the call graph is all there is to it.
+
+def call_graph(filepaths, defined=None):
+    # Maps each function defined in the files to the set of functions it
+    # calls. With defined, also maps each file to the functions defined in
+    # it.
+    graph = {}
+    for filepath in filepaths:
+        calls = None
+        parser = Parser.Parser(filepath)
+        while parser.has_more_commands():
+            parser.advance()
+            if parser.command_type == Constants.C_FUNCTION:
+                calls = graph.setdefault(parser.arg1, set())
+                if defined is not None:
+                    defined.setdefault(filepath, []).append(parser.arg1)
+            elif parser.command_type == Constants.C_CALL and calls is not None:
+                calls.add(parser.arg1)
+    return graph
+
+def reachable_functions(graph, roots):
+    reachable = set()
+    pending = [root for root in roots if root in graph]
+    while pending:
+        function_name = pending.pop()
+        if function_name in reachable:
+            continue
+        reachable.add(function_name)
+        pending.extend(callee for callee in graph[function_name] if callee in graph)
+    return reachable
+
+def drop_unreachable(commands, reachable, dropped=None):
+    # Yields the commands that aren't in a function outside reachable,
+    # calling dropped with each of the others. Commands before a file's
+    # first function are kept.
+    keep = True
+    for command in commands:
+        if command[0] == Constants.C_FUNCTION:
+            keep = command[1] in reachable
+        if keep:
+            yield command
+        elif dropped is not None:
+            dropped(command)
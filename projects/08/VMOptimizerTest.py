@@ -0,0 +1,100 @@
+import glob
+import os
+import unittest
+import Constants
+import VMOptimizer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def push(segment, index):
+    return (Constants.C_PUSH, segment, index)
+
+def pop(segment, index):
+    return (Constants.C_POP, segment, index)
+
+def arithmetic(command):
+    return (Constants.C_ARITHMETIC, command, None)
+
+def if_goto(label):
+    return (Constants.C_IF, label, None)
+
+class TestVMOptimizer(unittest.TestCase):
+
+    def fuse(self, commands):
+        return list(VMOptimizer.fuse(commands))
+
+    def test_move(self):
+        self.assertEqual(self.fuse([push('argument', 1), pop('pointer', 1)]),
+            [(Constants.C_MOVE, ('argument', 1), ('pointer', 1))])
+
+    def test_update(self):
+        commands = [push('local', 2), push('constant', 1), arithmetic('add'), pop('local', 2)]
+        self.assertEqual(self.fuse(commands), [(Constants.C_UPDATE, ('local', 2), ('add', 1))])
+        # Popped somewhere else, so not an update
+        commands[3] = pop('local', 3)
+        self.assertEqual(self.fuse(commands), [
+            push('local', 2),
+            (Constants.C_ARITHMETIC_CONSTANT, 'add', 1),
+            pop('local', 3),
+        ])
+
+    def test_compare_if(self):
+        commands = [push('local', 0), push('constant', 0), arithmetic('eq'), if_goto('IF_TRUE0')]
+        self.assertEqual(self.fuse(commands), [
+            push('local', 0),
+            (Constants.C_COMPARE_IF, 'IF_TRUE0', ('eq', 0, False)),
+        ])
+        commands = [push('local', 0), push('argument', 0), arithmetic('lt'), arithmetic('not'), if_goto('WHILE_END0')]
+        self.assertEqual(self.fuse(commands), [
+            push('local', 0),
+            push('argument', 0),
+            (Constants.C_COMPARE_IF, 'WHILE_END0', ('lt', None, True)),
+        ])
+
+    def test_unmatched_commands_kept_in_order(self):
+        commands = [
+            (Constants.C_LABEL, 'LOOP', None),
+            push('constant', 3),
+            arithmetic('eq'),
+            arithmetic('not'),
+            (Constants.C_GOTO, 'LOOP', None),
+            push('constant', 1),
+        ]
+        self.assertEqual(self.fuse(commands), commands)
+
+class TestDeadFunctions(unittest.TestCase):
+
+    def test_call_graph(self):
+        filepaths = sorted(glob.glob(os.path.join(HERE, 'FunctionCalls/StaticsTest/*.vm')))
+        defined = {}
+        graph = VMOptimizer.call_graph(filepaths, defined)
+        self.assertEqual(graph['Sys.init'], {'Class1.set', 'Class1.get', 'Class2.set', 'Class2.get'})
+        self.assertEqual(graph['Class1.get'], set())
+        self.assertEqual(len(graph), 5)
+        self.assertEqual(defined[filepaths[0]], ['Class1.set', 'Class1.get'])
+
+    def test_reachable_functions(self):
+        graph = {
+            'Sys.init': {'Main.main', 'Memory.init'},
+            'Main.main': {'Main.loop', 'Output.printInt'}, # Output isn't part of the program
+            'Main.loop': {'Main.loop'},
+            'Main.unused': {'Main.main'},
+            'Memory.init': set(),
+        }
+        self.assertEqual(VMOptimizer.reachable_functions(graph, ['Sys.init']),
+            {'Sys.init', 'Main.main', 'Main.loop', 'Memory.init'})
+        self.assertEqual(VMOptimizer.reachable_functions(graph, ['Nothing.here']), set())
+
+    def test_drop_unreachable(self):
+        commands = [
+            (Constants.C_FUNCTION, 'Main.main', 0),
+            push('constant', 1),
+            (Constants.C_RETURN, 'return', None),
+            (Constants.C_FUNCTION, 'Main.unused', 1),
+            push('local', 0),
+            (Constants.C_RETURN, 'return', None),
+        ]
+        dropped = []
+        kept = list(VMOptimizer.drop_unreachable(commands, {'Main.main'}, dropped.append))
+        self.assertEqual(kept, commands[:3])
+        self.assertEqual(dropped, commands[3:])
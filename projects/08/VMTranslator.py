@@ -1,12 +1,23 @@
+import argparse
 import glob
 import os
 import sys
 import CodeWriter
 import Constants
 import Parser
+import TranslationCache
+import VMOptimizer
+
+# Goes into every TranslationCache key along with the options. Translations
+# cached by an older CodeWriter are reused unless this is changed too.
+TRANSLATOR_VERSION = '1'
 
 def main():
-    path = sys.argv[1]
+    args = parse_args()
+    path = args.path
+    if args.cache_dir:
+        # Relative to where we were run from, not the directory chdir'd to
+        args.cache_dir = os.path.abspath(args.cache_dir)
     vm_files = []
     output_filepath = ''
     is_directory = False
@@ -26,7 +37,26 @@ def main():
         print("Path {} does not exist. Exiting...".format(path))
         sys.exit()
 
-    code_writer = CodeWriter.CodeWriter(output_filepath)
+    # Cached files are translated with labels of their own so their code
+    # is the same whatever was translated before them
+    cache = None
+    if args.cache_dir:
+        cache = TranslationCache.TranslationCache(args.cache_dir, TRANSLATOR_VERSION, args.cache_size * 1024 * 1024)
+    code_writer = CodeWriter.CodeWriter(output_filepath, compact=args.compact, optimize=args.optimize,
+        scoped_labels=cache is not None)
+
+    # Unreachable functions are translated on the side, into nowhere, to
+    # see how much ROM leaving them out saved
+    reachable = None
+    dropped_writer = None
+    defined = {}
+    if args.drop_dead_functions:
+        graph = VMOptimizer.call_graph(vm_files, defined)
+        if 'Sys.init' in graph:
+            reachable = VMOptimizer.reachable_functions(graph, ['Sys.init'])
+            dropped_writer = CodeWriter.CodeWriter(os.devnull, compact=args.compact, optimize=args.optimize)
+        else:
+            print('No Sys.init, translating every function')
 
     # Only run bootstrap code when multiple files (in a dir)
     # are being translated since it kicks off Sys.init function
@@ -34,38 +64,152 @@ def main():
     if is_directory:
         code_writer.write_init()
 
+    cache_hits = 0
     for vm_file in vm_files:
         print('Loading file: ' + vm_file)
         code_writer.set_file_name(vm_file)
-        parser = Parser.Parser(vm_file)
-        parse_file(code_writer, parser)
+        if reachable is not None:
+            dropped_writer.set_file_name(vm_file)
+        if cache is None:
+            parser = Parser.Parser(vm_file)
+            parse_file(code_writer, parser, fuse=args.fuse, reachable=reachable, dropped_writer=dropped_writer)
+        else:
+            # Which of the file's functions are kept is all that dropping
+            # dead functions changes about its translation
+            kept_functions = None
+            if reachable is not None:
+                kept_functions = [name for name in defined.get(vm_file, []) if name in reachable]
+            options = {'compact': args.compact, 'optimize': args.optimize, 'fuse': args.fuse,
+                'kept_functions': kept_functions}
+            if translate_cached(code_writer, vm_file, cache, options, reachable, dropped_writer):
+                cache_hits += 1
 
     code_writer.close()
     print('Closing file: ' + vm_file)
 
-def parse_file(code_writer, parser):
+    if reachable is not None:
+        # Only the dropped functions themselves, not routines they'd share
+        dropped_writer.routines_needed.clear()
+        dropped_writer.close()
+        print_dead_functions(graph, reachable, dropped_writer.instructions_written, code_writer.instructions_written)
+
+    if args.optimize:
+        print_instruction_counts(code_writer.instruction_counts)
+
+    if cache is not None:
+        print("Reused {} of {} translated files from the cache".format(cache_hits, len(vm_files)))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Translate .vm files to Hack assembly')
+    parser.add_argument('path', help='a .vm file or a directory of them')
+    parser.add_argument('--compact', action='store_true',
+        help='share one routine for calls, returns and each comparison instead of inlining them')
+    parser.add_argument('-O', '--optimize', action='store_true',
+        help='run the peephole optimizer over the output and report what it saved')
+    parser.add_argument('--fuse', action='store_true',
+        help='translate common sequences of VM commands as one (see VMOptimizer)')
+    parser.add_argument('--drop-dead-functions', action='store_true',
+        help='leave out functions Sys.init can never call and report the ROM saved')
+    parser.add_argument('--cache-dir',
+        help='reuse the translation of unchanged .vm files, stored in this directory')
+    parser.add_argument('--cache-size', type=int, default=TranslationCache.DEFAULT_MAX_SIZE // (1024 * 1024),
+        help='evict least recently used cache entries beyond this many MB')
+    return parser.parse_args()
+
+def print_instruction_counts(instruction_counts):
+    total_before = total_after = 0
+    for name, (before, after) in instruction_counts.items():
+        print("{:<24} {:7} -> {:7} instructions ({:.1f}% fewer)".format(
+            name, before, after, 100 * (before - after) / before if before else 0))
+        total_before += before
+        total_after += after
+    print("{:<24} {:7} -> {:7} instructions ({:.1f}% fewer)".format(
+        'Total', total_before, total_after, 100 * (total_before - total_after) / total_before if total_before else 0))
+
+def print_dead_functions(graph, reachable, instructions_saved, instructions_written):
+    dead = sorted(set(graph) - reachable)
+    print("Dropped {} of {} functions: {}".format(len(dead), len(graph), ', '.join(dead) or 'none'))
+    print("ROM: {} instructions instead of {}, saved {}".format(
+        instructions_written, instructions_written + instructions_saved, instructions_saved))
+
+def parse_file(code_writer, parser, fuse=False, reachable=None, dropped_writer=None):
+    # With reachable, only the functions in it are translated, the rest go
+    # to dropped_writer if it's given
     print('Running through all commands in VM code')
-    while parser.has_more_commands():
-        parser.advance()
+    commands = read_commands(parser)
+    dropped = []
+    if reachable is not None:
+        commands = VMOptimizer.drop_unreachable(commands, reachable, dropped.append)
+    write_commands(code_writer, commands, fuse)
+    if dropped_writer is not None:
+        write_commands(dropped_writer, dropped, fuse)
+
+def translate_cached(code_writer, vm_file, cache, options, reachable=None, dropped_writer=None):
+    # Writes the file's cached translation, or translates it and caches
+    # that. options must hold everything the translation depends on.
+    # Returns whether it was a cache hit.
+    with open(vm_file, 'rb') as fp:
+        source = fp.read()
+
+    key = cache.key(vm_file, options, source)
+    fragment = cache.get(key)
+    if fragment is not None:
+        print('Reusing cached translation')
+        code_writer.write_fragment(fragment)
+        if dropped_writer is not None:
+            dropped_writer.instructions_written += fragment['dropped_instructions']
+        return True
+
+    dropped_before = 0
+    if dropped_writer is not None:
+        dropped_before = dropped_writer.instructions_written
+    code_writer.begin_fragment()
+    parse_file(code_writer, Parser.Parser(vm_file), options['fuse'], reachable, dropped_writer)
+    fragment = code_writer.end_fragment()
+    fragment['dropped_instructions'] = 0
+    if dropped_writer is not None:
+        dropped_writer.flush()
+        fragment['dropped_instructions'] = dropped_writer.instructions_written - dropped_before
+    cache.put(key, fragment)
+    return False
 
-        if parser.command_type == Constants.C_ARITHMETIC:
-            code_writer.write_arithmetic(parser.arg1)
-        elif parser.command_type in [Constants.C_PUSH, Constants.C_POP]:
-            code_writer.write_push_pop(parser.command_type, parser.arg1, parser.arg2)
-        elif parser.command_type == Constants.C_LABEL:
-            code_writer.write_label(parser.arg1)
-        elif parser.command_type == Constants.C_GOTO:
-            code_writer.write_goto(parser.arg1)
-        elif parser.command_type == Constants.C_IF:
-            code_writer.write_if(parser.arg1)
-        elif parser.command_type == Constants.C_FUNCTION:
-            code_writer.write_function(parser.arg1, parser.arg2)
-        elif parser.command_type == Constants.C_CALL:
-            code_writer.write_call(parser.arg1, parser.arg2)
-        elif parser.command_type == Constants.C_RETURN:
+def write_commands(code_writer, commands, fuse=False):
+    if fuse:
+        commands = VMOptimizer.fuse(commands)
+
+    for command_type, arg1, arg2 in commands:
+        if command_type == Constants.C_ARITHMETIC:
+            code_writer.write_arithmetic(arg1)
+        elif command_type in [Constants.C_PUSH, Constants.C_POP]:
+            code_writer.write_push_pop(command_type, arg1, arg2)
+        elif command_type == Constants.C_LABEL:
+            code_writer.write_label(arg1)
+        elif command_type == Constants.C_GOTO:
+            code_writer.write_goto(arg1)
+        elif command_type == Constants.C_IF:
+            code_writer.write_if(arg1)
+        elif command_type == Constants.C_FUNCTION:
+            code_writer.write_function(arg1, arg2)
+        elif command_type == Constants.C_CALL:
+            code_writer.write_call(arg1, arg2)
+        elif command_type == Constants.C_RETURN:
             code_writer.write_return()
+        elif command_type == Constants.C_MOVE:
+            code_writer.write_move(arg1, arg2)
+        elif command_type == Constants.C_UPDATE:
+            code_writer.write_update(arg1, arg2)
+        elif command_type == Constants.C_ARITHMETIC_CONSTANT:
+            code_writer.write_arithmetic_constant(arg1, arg2)
+        elif command_type == Constants.C_COMPARE_IF:
+            code_writer.write_compare_if(arg1, arg2)
         else:
-            raise Exception("Command '{}' not handled".format(parser.command_type))
+            raise Exception("Command '{}' not handled".format(command_type))
+
+def read_commands(parser):
+    # The parser's commands as (command_type, arg1, arg2)
+    while parser.has_more_commands():
+        parser.advance()
+        yield parser.command_type, parser.arg1, parser.arg2
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,170 @@
+import argparse
+import glob
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import Parser
+import VMTranslator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PROGRAMS = ['FunctionCalls/SimpleFunction', 'FunctionCalls/FibonacciElement',
+    'FunctionCalls/NestedCall', 'FunctionCalls/StaticsTest']
+DEFAULT_SCALE = 1000
+
+def main():
+    args = parse_args()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for program in args.programs:
+            filepaths = scale_program(os.path.join(HERE, program), args.scale, tmpdir)
+            result = run_isolated(benchmark_translation, filepaths, args.code_writer, args.repeat)
+            result['program'] = program
+            result['scale'] = args.scale
+            results.append(result)
+            print_result(result)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='VM translator benchmarks')
+    parser.add_argument('programs', nargs='*', default=DEFAULT_PROGRAMS,
+        help='directories of .vm files, relative to projects/08 (default: the FunctionCalls programs)')
+    parser.add_argument('--scale', type=int, default=DEFAULT_SCALE,
+        help='how many times each .vm file is repeated')
+    parser.add_argument('--code-writer', metavar='PATH',
+        help='CodeWriter.py to time instead of this one, to compare against older versions')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+        help='runs per measurement, the fastest is reported')
+    parser.add_argument('-o', '--output',
+        help='write the results to this file as JSON (default: stdout)')
+    return parser.parse_args()
+
+def print_result(result):
+    # Human readable summary, on stderr so stdout stays valid JSON
+    print("{:<32} {:8} commands {:8.1f} ms ({:6.1f} ms writing) {:8.0f} commands/s  "
+        "peak allocated {:6.2f} MB  peak RSS {:6.1f} MB".format(
+        result['program'], result['commands'], result['seconds'] * 1000, result['write_seconds'] * 1000,
+        result['commands_per_second'], result['peak_allocated_bytes'] / (1024 * 1024),
+        result['peak_rss_kb'] / 1024), file=sys.stderr)
+
+def scale_program(directory, scale, tmpdir):
+    # Writes each of the program's .vm files repeated scale times and
+    # returns their paths. Labels and functions end up defined many times
+    # over, which the translator doesn't mind.
+    scaled_directory = os.path.join(tmpdir, os.path.basename(directory))
+    os.mkdir(scaled_directory)
+    filepaths = []
+    for filepath in sorted(glob.glob(os.path.join(directory, '*.vm'))):
+        with open(filepath) as fp:
+            text = fp.read()
+        scaled_filepath = os.path.join(scaled_directory, os.path.basename(filepath))
+        with open(scaled_filepath, 'w') as fp:
+            fp.write((text.rstrip('\n') + '\n') * scale)
+        filepaths.append(scaled_filepath)
+    return filepaths
+
+def run_isolated(fn, *args):
+    # Runs fn(*args) in a fresh interpreter so its peak RSS isn't
+    # inflated by whatever ran before it
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+def load_code_writer(filepath):
+    if filepath is None:
+        import CodeWriter
+        return CodeWriter
+    spec = importlib.util.spec_from_file_location('CodeWriter', filepath)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def translate(code_writer_module, filepaths, output_filepath, parsers=None):
+    code_writer = code_writer_module.CodeWriter(output_filepath)
+    code_writer.write_init()
+    for i, filepath in enumerate(filepaths):
+        code_writer.set_file_name(filepath)
+        parser = Parser.Parser(filepath) if parsers is None else parsers[i]()
+        VMTranslator.parse_file(code_writer, parser)
+    code_writer.close()
+
+class ParsedCommands:
+    # Stands in for Parser with the file's commands already parsed, so
+    # CodeWriter can be timed on its own
+    def __init__(self, filepath):
+        self.commands = []
+        parser = Parser.Parser(filepath)
+        while parser.has_more_commands():
+            parser.advance()
+            self.commands.append((parser.command_type, parser.arg1, parser.arg2))
+
+    def __call__(self):
+        self.position = 0
+        return self
+
+    def has_more_commands(self):
+        return self.position < len(self.commands)
+
+    def advance(self):
+        self.command_type, self.arg1, self.arg2 = self.commands[self.position]
+        self.position += 1
+
+def benchmark_translation(filepaths, code_writer_filepath, repeat):
+    # Times the whole translation, parsing included, and CodeWriter on its
+    # own with the commands parsed beforehand. Then runs it once more under
+    # tracemalloc for the peak memory allocated along the way.
+    code_writer_module = load_code_writer(code_writer_filepath)
+    output_filepath = os.path.splitext(filepaths[0])[0] + '.asm'
+    parsers = [ParsedCommands(filepath) for filepath in filepaths]
+    commands = sum(len(parser.commands) for parser in parsers)
+
+    # parse_file prints a line per file, which would end up in the timings
+    sys.stdout = io.StringIO()
+    seconds = best_time(lambda: translate(code_writer_module, filepaths, output_filepath), repeat)
+    write_seconds = best_time(lambda: translate(code_writer_module, filepaths, output_filepath, parsers), repeat)
+    tracemalloc.start()
+    translate(code_writer_module, filepaths, output_filepath, parsers)
+    _, peak_allocated_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sys.stdout = sys.__stdout__
+
+    return {
+        'commands': commands,
+        'seconds': seconds,
+        'commands_per_second': commands / seconds,
+        'write_seconds': write_seconds,
+        'output_bytes': os.path.getsize(output_filepath),
+        'peak_allocated_bytes': peak_allocated_bytes,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def best_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+if __name__ == '__main__':
+    main()